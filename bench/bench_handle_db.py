@@ -0,0 +1,245 @@
+# bench_handle_db.py
+"""
+Benchmark das operações do handle_db contra um PostgREST falso local
+(bench/fake_postgrest.py), com latência de rede configurável.
+
+Para cada operação mede p50/p95/p99 (ms), requisições HTTP e bytes
+trafegados por chamada. O resultado pode ser salvo em JSON e comparado com
+uma execução anterior; regressões fazem o processo sair com código 1.
+
+Uso:
+    python -m bench.bench_handle_db --latencia-ms 20 --saida bench_atual.json
+    python -m bench.bench_handle_db --comparar bench_base.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+from bench.fake_postgrest import FakePostgrest, TIMEZONE
+
+USUARIO = "bench"
+TOLERANCIA_PADRAO = 0.20   # 20% acima da base conta como regressão
+FOLGA_MS = 1.0             # diferença absoluta mínima para contar (ruído)
+
+def _preparar_ambiente(fake):
+    """Aponta o handle_db para o servidor falso e isola os caches em disco."""
+    pasta = tempfile.mkdtemp(prefix="bench_handle_db_")
+    os.environ["HOME"] = pasta
+    os.environ["APPDATA"] = pasta
+    os.environ["SUPABASE_URL"] = fake.url
+    os.environ["SUPABASE_KEY"] = "bench-key"
+    os.environ.pop("SUPABASE_DB_URL", None)
+    return pasta
+
+def _semear(fake, linhas):
+    """Histórico fechado para as leituras (inserido direto na memória, sem HTTP)."""
+    agora = datetime.now(TIMEZONE)
+    rows = []
+    for i in range(linhas):
+        inicio = agora - timedelta(hours=i + 1)
+        fim = inicio + timedelta(minutes=45)
+        rows.append({
+            "tipo_atividade": ("Cadastro", "Reunião", "Suporte")[i % 3],
+            "descricao": f"atividade {i}", "inicio": inicio.isoformat(), "fim": fim.isoformat(),
+            "user_id": USUARIO, "ano": inicio.year, "mes": inicio.month, "dia": inicio.day,
+            "horas_trabalhadas": 0.75, "chave": f"seed-{i}",
+        })
+    fake.banco.inserir("atividades", rows)
+
+def _abrir_atividade(fake):
+    """Cria uma atividade aberta fora da medição e retorna a linha."""
+    agora = datetime.now(TIMEZONE)
+    return fake.banco.inserir("atividades", {
+        "tipo_atividade": "Cadastro", "descricao": "bench", "inicio": agora.isoformat(),
+        "user_id": USUARIO, "ano": agora.year, "mes": agora.month, "dia": agora.day,
+    })[0]
+
+def _operacoes(db, fake):
+    """
+    nome -> (preparar, executar). preparar() roda fora da medição e o seu
+    retorno é passado para executar().
+    """
+    abrir = lambda: _abrir_atividade(fake)
+    return {
+        "iniciar_nova_atividade": (
+            None, lambda _: db.iniciar_nova_atividade("Cadastro", "bench", USUARIO)),
+        "finalizar_atividade": (
+            abrir, lambda row: db.finalizar_atividade(row["id"])),
+        "finalizar_atividade[inicio]": (
+            abrir, lambda row: db.finalizar_atividade(row["id"], inicio=row["inicio"])),
+        "trocar_atividade": (
+            abrir, lambda row: db.trocar_atividade(row["id"], "Reunião", "bench", USUARIO)),
+        "buscar_atividade_em_andamento": (
+            None, lambda _: db.buscar_atividade_em_andamento(USUARIO, usar_cache=False)),
+        "buscar_atividade_em_andamento[cache]": (
+            None, lambda _: db.buscar_atividade_em_andamento(USUARIO)),
+        "listar_atividades": (
+            None, lambda _: db.listar_atividades(100, USUARIO, usar_cache=False)),
+        "listar_atividades[cache]": (
+            None, lambda _: db.listar_atividades(100, USUARIO)),
+        "setup_database": (
+            None, lambda _: db.setup_database(forcar=True)),
+        "setup_database[cache]": (
+            None, lambda _: db.setup_database()),
+    }
+
+def percentil(valores, p):
+    """Percentil com interpolação linear (valores já ordenados)."""
+    if not valores:
+        return 0.0
+    k = (len(valores) - 1) * p / 100.0
+    i = int(k)
+    j = min(i + 1, len(valores) - 1)
+    return valores[i] + (valores[j] - valores[i]) * (k - i)
+
+def medir(fake, preparar, executar, iteracoes, aquecimento):
+    for _ in range(aquecimento):
+        executar(preparar() if preparar else None)
+
+    tempos = []
+    requisicoes = bytes_enviados = bytes_recebidos = 0
+    for _ in range(iteracoes):
+        arg = preparar() if preparar else None
+        fake.zerar_estatisticas()
+        t0 = time.perf_counter()
+        executar(arg)
+        tempos.append((time.perf_counter() - t0) * 1000)
+        stats = fake.estatisticas()
+        requisicoes += stats["requisicoes"]
+        bytes_enviados += stats["bytes_enviados"]
+        bytes_recebidos += stats["bytes_recebidos"]
+
+    tempos.sort()
+    return {
+        "iteracoes": iteracoes,
+        "p50_ms": round(percentil(tempos, 50), 3),
+        "p95_ms": round(percentil(tempos, 95), 3),
+        "p99_ms": round(percentil(tempos, 99), 3),
+        "media_ms": round(sum(tempos) / len(tempos), 3),
+        "min_ms": round(tempos[0], 3),
+        "max_ms": round(tempos[-1], 3),
+        "requisicoes_por_op": round(requisicoes / iteracoes, 3),
+        "bytes_enviados_por_op": round(bytes_enviados / iteracoes, 1),
+        "bytes_recebidos_por_op": round(bytes_recebidos / iteracoes, 1),
+    }
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def executar_benchmark(iteracoes: int = 50, aquecimento: int = 3, latencia_ms: float = 20.0,
+                       linhas: int = 500, operacoes=None):
+    """Roda as operações selecionadas e retorna o dicionário de resultados."""
+    with FakePostgrest(latencia_ms=latencia_ms) as fake:
+        _preparar_ambiente(fake)
+        import src.handle_db as db
+        db.fechar_supabase_client()
+        db.limpar_cache()
+        _semear(fake, linhas)
+
+        todas = _operacoes(db, fake)
+        selecionadas = operacoes or list(todas)
+        desconhecidas = [o for o in selecionadas if o not in todas]
+        if desconhecidas:
+            raise ValueError(f"operações desconhecidas: {', '.join(desconhecidas)}")
+
+        db.aquecer_conexao()
+        resultados = {}
+        try:
+            for nome in selecionadas:
+                preparar, executar = todas[nome]
+                resultados[nome] = medir(fake, preparar, executar, iteracoes, aquecimento)
+        finally:
+            db.fechar_supabase_client()
+
+    return {
+        "metadados": {
+            "data": datetime.now(TIMEZONE).isoformat(timespec="seconds"),
+            "commit": _commit_atual(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "latencia_ms": latencia_ms,
+            "iteracoes": iteracoes,
+            "aquecimento": aquecimento,
+            "linhas_semeadas": linhas,
+        },
+        "resultados": resultados,
+    }
+
+def comparar(atual, base, tolerancia: float = TOLERANCIA_PADRAO):
+    """
+    Lista de regressões (strings) de 'atual' em relação a 'base': p50/p95
+    acima da tolerância, ou mais requisições por operação.
+    """
+    regressoes = []
+    for nome, r in atual["resultados"].items():
+        b = base.get("resultados", {}).get(nome)
+        if b is None:
+            continue
+        for campo in ("p50_ms", "p95_ms"):
+            limite = b[campo] * (1 + tolerancia) + FOLGA_MS
+            if r[campo] > limite:
+                regressoes.append(f"{nome}: {campo} {b[campo]:.1f} -> {r[campo]:.1f}")
+        if r["requisicoes_por_op"] > b["requisicoes_por_op"]:
+            regressoes.append(
+                f"{nome}: requisições/op {b['requisicoes_por_op']:g} -> {r['requisicoes_por_op']:g}")
+    return regressoes
+
+def formatar(resultado) -> str:
+    linhas = [f"{'operação':<38} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/op':>7} {'B env/op':>9} {'B rec/op':>9}"]
+    for nome, r in resultado["resultados"].items():
+        linhas.append(
+            f"{nome:<38} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+            f"{r['requisicoes_por_op']:>7g} {r['bytes_enviados_por_op']:>9.0f} {r['bytes_recebidos_por_op']:>9.0f}"
+        )
+    return "\n".join(linhas)
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m bench.bench_handle_db",
+                                     description="Benchmark do handle_db contra um PostgREST falso.")
+    parser.add_argument("--iteracoes", "-n", type=int, default=50)
+    parser.add_argument("--aquecimento", type=int, default=3, help="execuções descartadas por operação")
+    parser.add_argument("--latencia-ms", type=float, default=20.0, help="latência injetada por requisição")
+    parser.add_argument("--linhas", type=int, default=500, help="atividades no histórico semeado")
+    parser.add_argument("--operacao", action="append", dest="operacoes", help="limita às operações dadas (repetível)")
+    parser.add_argument("--saida", "-o", help="grava o resultado em JSON")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_PADRAO)
+    return parser.parse_args(args)
+
+def main(args) -> int:
+    opts = _parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)  # o handle_db liga INFO ao ser importado
+    resultado = executar_benchmark(opts.iteracoes, opts.aquecimento, opts.latencia_ms,
+                                   opts.linhas, opts.operacoes)
+    print(formatar(resultado))
+    if opts.saida:
+        with open(opts.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"Resultado salvo em {opts.saida}", file=sys.stderr)
+    if opts.comparar:
+        with open(opts.comparar, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        regressoes = comparar(resultado, base, opts.tolerancia)
+        if regressoes:
+            print("Regressões em relação a " + opts.comparar + ":\n  " + "\n  ".join(regressoes), file=sys.stderr)
+            return 1
+        print(f"Sem regressões em relação a {opts.comparar}.", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
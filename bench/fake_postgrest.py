@@ -0,0 +1,403 @@
+# fake_postgrest.py
+"""
+Servidor HTTP local que imita o subconjunto da API do Supabase/PostgREST
+usado pelo handle_db, com dados em memória.
+
+Serve para medir o custo de cada operação (benchmarks) e para testar o app
+sem rede: conta requisições e bytes trafegados e pode injetar latência fixa
+em cada resposta.
+
+Suporta:
+  GET/POST/PATCH/DELETE /rest/v1/<tabela>  (select, filtros eq/neq/lt/lte/gt/gte/is/in,
+                                            not.*, order, limit/offset, upsert por on_conflict)
+  POST /rest/v1/rpc/finalizar_atividade | trocar_atividade
+"""
+
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import pytz
+
+TIMEZONE = pytz.timezone('America/Sao_Paulo')
+
+# colunas de cada tabela conhecida (usadas para validar select/insert)
+SCHEMAS = {
+    "atividades": (
+        "id", "tipo_atividade", "descricao", "inicio", "fim", "user_id",
+        "ano", "mes", "dia", "horas_trabalhadas", "chave",
+    ),
+    "atividades_resumo_diario": (
+        "user_id", "tipo_atividade", "ano", "mes", "dia", "horas_trabalhadas", "quantidade",
+    ),
+    "tipos_atividade": ("nome", "departamento", "ordem", "ativo"),
+    "catalogo_versao": ("id", "versao"),
+}
+UNIQUE = {"atividades": ("id", "chave")}
+
+
+class ErroPostgrest(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _converter(valor_texto, referencia):
+    """Converte o valor do filtro para o tipo da coluna (pela linha comparada)."""
+    if isinstance(referencia, bool):
+        return valor_texto.lower() == "true"
+    if isinstance(referencia, int):
+        return int(valor_texto)
+    if isinstance(referencia, float):
+        return float(valor_texto)
+    return valor_texto
+
+
+def _avaliar(row, coluna, expressao):
+    negado = expressao.startswith("not.")
+    if negado:
+        expressao = expressao[4:]
+    op, _, valor = expressao.partition(".")
+    atual = row.get(coluna)
+    if op == "is":
+        resultado = atual is None if valor == "null" else atual == (valor == "true")
+    elif op == "in":
+        itens = [v.strip().strip('"') for v in valor.strip("()").split(",") if v.strip()]
+        resultado = atual is not None and any(atual == _converter(v, atual) for v in itens)
+    elif atual is None:
+        resultado = False
+    else:
+        alvo = _converter(valor, atual)
+        resultado = {
+            "eq": atual == alvo, "neq": atual != alvo,
+            "lt": atual < alvo, "lte": atual <= alvo,
+            "gt": atual > alvo, "gte": atual >= alvo,
+        }.get(op)
+        if resultado is None:
+            raise ErroPostgrest(400, "PGRST100", f"operador não suportado: {op}")
+    return not resultado if negado else resultado
+
+
+class Banco:
+    """Tabelas em memória + regras de negócio das funções RPC."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tabelas = {nome: [] for nome in SCHEMAS}
+        self.proximo_id = {nome: 1 for nome in SCHEMAS}
+
+    def _colunas(self, tabela):
+        if tabela not in SCHEMAS:
+            raise ErroPostgrest(404, "PGRST205", f"Could not find the table 'public.{tabela}'")
+        return SCHEMAS[tabela]
+
+    def _validar_colunas(self, tabela, colunas):
+        validas = self._colunas(tabela)
+        for c in colunas:
+            if c not in validas:
+                raise ErroPostgrest(400, "42703", f"column {tabela}.{c} does not exist")
+
+    def _filtrar(self, tabela, filtros):
+        self._validar_colunas(tabela, [c for c, _ in filtros])
+        return [r for r in self.tabelas[tabela] if all(_avaliar(r, c, e) for c, e in filtros)]
+
+    def _projetar(self, tabela, rows, select):
+        if not select or select == "*":
+            return [dict(r) for r in rows]
+        colunas = [c.strip() for c in select.split(",") if c.strip()]
+        self._validar_colunas(tabela, colunas)
+        return [{c: r.get(c) for c in colunas} for r in rows]
+
+    def select(self, tabela, filtros, select, order, limit, offset):
+        with self.lock:
+            rows = self._filtrar(tabela, filtros)
+            for termo in reversed([t for t in (order or "").split(",") if t]):
+                partes = termo.split(".")
+                coluna, desc = partes[0], "desc" in partes[1:]
+                self._validar_colunas(tabela, [coluna])
+                rows.sort(key=lambda r: (r.get(coluna) is None, r.get(coluna)), reverse=desc)
+            if offset:
+                rows = rows[offset:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._projetar(tabela, rows, select)
+
+    def _inserir_linha(self, tabela, dados, on_conflict, ignorar_duplicadas=False):
+        self._validar_colunas(tabela, dados.keys())
+        existente = None
+        for coluna in (on_conflict or "").split(","):
+            if coluna and dados.get(coluna) is not None:
+                existente = next((r for r in self.tabelas[tabela] if r.get(coluna) == dados[coluna]), None)
+        if existente is not None:
+            if ignorar_duplicadas:
+                return None
+            existente.update({k: v for k, v in dados.items() if k != "id" or v is not None})
+            return existente
+        for coluna in UNIQUE.get(tabela, ()):
+            valor = dados.get(coluna)
+            if valor is not None and any(r.get(coluna) == valor for r in self.tabelas[tabela]):
+                raise ErroPostgrest(409, "23505", f"duplicate key value violates unique constraint ({coluna})")
+        row = {c: None for c in SCHEMAS[tabela]}
+        row.update(dados)
+        if "id" in row and row["id"] is None:
+            row["id"] = self.proximo_id[tabela]
+        if isinstance(row.get("id"), int):
+            self.proximo_id[tabela] = max(self.proximo_id[tabela], row["id"] + 1)
+        self.tabelas[tabela].append(row)
+        return row
+
+    def inserir(self, tabela, payload, on_conflict=None, ignorar_duplicadas=False):
+        linhas = payload if isinstance(payload, list) else [payload]
+        with self.lock:
+            self._colunas(tabela)
+            gravadas = [self._inserir_linha(tabela, d, on_conflict, ignorar_duplicadas) for d in linhas]
+            return [dict(r) for r in gravadas if r is not None]
+
+    def atualizar(self, tabela, filtros, dados):
+        with self.lock:
+            self._validar_colunas(tabela, dados.keys())
+            rows = self._filtrar(tabela, filtros)
+            for r in rows:
+                r.update(dados)
+            return [dict(r) for r in rows]
+
+    def apagar(self, tabela, filtros):
+        with self.lock:
+            rows = self._filtrar(tabela, filtros)
+            self.tabelas[tabela] = [r for r in self.tabelas[tabela] if r not in rows]
+            return [dict(r) for r in rows]
+
+    @staticmethod
+    def _agora():
+        return datetime.now(TIMEZONE)
+
+    @staticmethod
+    def _instante(iso):
+        # colunas 'timestamp without time zone': texto sem fuso é hora de TIMEZONE
+        dt = datetime.fromisoformat(iso.replace('Z', '+00:00'))
+        return TIMEZONE.localize(dt) if dt.tzinfo is None else dt.astimezone(TIMEZONE)
+
+    @classmethod
+    def _horas(cls, inicio_iso, fim):
+        return round((fim - cls._instante(inicio_iso)).total_seconds() / 3600, 10)
+
+    def _fechar(self, row, agora):
+        row["fim"] = agora.isoformat()
+        row["horas_trabalhadas"] = self._horas(row["inicio"], agora)
+
+    def rpc(self, nome, args):
+        with self.lock:
+            rows = self.tabelas["atividades"]
+            agora = self._agora()
+            if nome == "finalizar_atividade":
+                # como FINALIZAR_ATIVIDADE_SQL: só fecha se aberta; já finalizada volta como está
+                alvo = [r for r in rows if r["id"] == args.get("p_id")]
+                for r in alvo:
+                    if r["fim"] is None:
+                        self._fechar(r, agora)
+                return [dict(r) for r in alvo]
+            if nome == "trocar_atividade":
+                for r in rows:
+                    if r["id"] == args.get("p_id") and r["fim"] is None:
+                        self._fechar(r, agora)
+                # como TROCAR_ATIVIDADE_SQL (ON CONFLICT (chave) DO UPDATE SET chave = EXCLUDED.chave):
+                # chave repetida devolve a linha existente sem alterá-la
+                existente = next((r for r in rows if args.get("p_chave") is not None
+                                  and r["chave"] == args.get("p_chave")), None)
+                if existente is not None:
+                    return [dict(existente)]
+                nova = self._inserir_linha("atividades", {
+                    "tipo_atividade": args.get("p_tipo"), "descricao": args.get("p_descricao"),
+                    "inicio": agora.isoformat(), "user_id": args.get("p_user_id"),
+                    "ano": agora.year, "mes": agora.month, "dia": agora.day,
+                    "chave": args.get("p_chave"),
+                }, "chave")
+                return [dict(nova)]
+            if nome == "fechar_atividades_abandonadas":
+                # como FECHAR_ABANDONADAS_SQL: um lote por chamada, só as ainda abertas
+                corte = self._instante(args["p_corte"])
+                valor, unidade = args["p_duracao"].split()
+                duracao = timedelta(**{unidade: float(valor)})
+                alvo = sorted((r for r in rows if r["fim"] is None and self._instante(r["inicio"]) < corte),
+                              key=lambda r: r["id"])[:int(args["p_limite"])]
+                for r in alvo:
+                    self._fechar(r, min(self._instante(r["inicio"]) + duracao, agora))
+                return [{"id": r["id"], "user_id": r["user_id"], "horas_trabalhadas": r["horas_trabalhadas"]}
+                        for r in alvo]
+        raise ErroPostgrest(404, "PGRST202", f"Could not find the function public.{nome}")
+
+
+class _ContadorEscrita:
+    """Envolve o wfile do handler para contar bytes de resposta."""
+
+    def __init__(self, arquivo, servidor):
+        self._arquivo = arquivo
+        self._servidor = servidor
+
+    def write(self, dados):
+        self._servidor._contar(bytes_recebidos=len(dados))
+        return self._arquivo.write(dados)
+
+    def __getattr__(self, nome):
+        return getattr(self._arquivo, nome)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakePostgREST/1.0"
+    disable_nagle_algorithm = True  # cabeçalho e corpo saem em writes separados
+
+    def setup(self):
+        super().setup()
+        self.wfile = _ContadorEscrita(self.wfile, self.server.fake)
+
+    def log_message(self, format, *args):
+        pass  # silencioso
+
+    def _responder(self, status, corpo=None, total=None):
+        dados = b"" if corpo is None else json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if total is not None:
+            self.send_header("Content-Range", f"*/{total}")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _processar(self):
+        fake = self.server.fake
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        corpo = self.rfile.read(tamanho) if tamanho else b""
+        fake._contar(requisicoes=1, bytes_enviados=len(self.raw_requestline) + len(str(self.headers)) + len(corpo))
+        if fake.latencia:
+            time.sleep(fake.latencia)
+        status_falha = fake._consumir_falha()
+        if status_falha:
+            dados = b"falha injetada"
+            self.send_response(status_falha)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+            return
+
+        partes = urlsplit(self.path)
+        caminho = partes.path
+        if not caminho.startswith("/rest/v1/"):
+            return self._responder(404, {"message": "not found"})
+        recurso = caminho[len("/rest/v1/"):]
+        params = parse_qsl(partes.query, keep_blank_values=True)
+        especiais = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+        filtros = [(k, v) for k, v in params if k not in especiais]
+        opcoes = {k: v for k, v in params if k in especiais}
+        prefer = self.headers.get("Prefer", "")
+        payload = json.loads(corpo) if corpo else None
+
+        try:
+            if recurso.startswith("rpc/"):
+                return self._responder(200, fake.banco.rpc(recurso[4:], payload or {}))
+            if self.command == "GET":
+                limit = int(opcoes["limit"]) if "limit" in opcoes else None
+                rows = fake.banco.select(recurso, filtros, opcoes.get("select"), opcoes.get("order"),
+                                         limit, int(opcoes.get("offset", 0)))
+                return self._responder(200, rows)
+            if self.command == "POST":
+                upsert = "merge-duplicates" in prefer or "ignore-duplicates" in prefer
+                on_conflict = opcoes.get("on_conflict") if upsert else None
+                rows = fake.banco.inserir(recurso, payload, on_conflict, "ignore-duplicates" in prefer)
+            elif self.command == "PATCH":
+                rows = fake.banco.atualizar(recurso, filtros, payload or {})
+            elif self.command == "DELETE":
+                rows = fake.banco.apagar(recurso, filtros)
+            else:
+                return self._responder(405, {"message": "method not allowed"})
+            # count=exact em escritas: Content-Range */n com as linhas afetadas, como o PostgREST
+            total = len(rows) if "count=exact" in prefer else None
+            if "return=representation" in prefer:
+                return self._responder(201 if self.command == "POST" else 200, rows, total)
+            return self._responder(201 if self.command == "POST" else 204, total=total)
+        except ErroPostgrest as e:
+            return self._responder(e.status, {"code": e.code, "message": e.message, "details": None, "hint": None})
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _processar
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # cliente desistiu da resposta (ex.: timeout do lado do app)
+
+
+class FakePostgrest:
+    """
+    Uso:
+        with FakePostgrest(latencia_ms=20) as fake:
+            os.environ["SUPABASE_URL"] = fake.url
+            ...
+            fake.estatisticas()  # requisições e bytes desde o último reset
+    """
+
+    def __init__(self, host: str = "127.0.0.1", porta: int = 0, latencia_ms: float = 0.0):
+        self.banco = Banco()
+        self.latencia = latencia_ms / 1000.0
+        self._lock = threading.Lock()
+        self._falhas = []
+        self.zerar_estatisticas()
+        self._server = _Servidor((host, porta), _Handler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, porta = self._server.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def _contar(self, requisicoes=0, bytes_enviados=0, bytes_recebidos=0):
+        with self._lock:
+            self._requisicoes += requisicoes
+            self._bytes_enviados += bytes_enviados
+            self._bytes_recebidos += bytes_recebidos
+
+    def injetar_falhas(self, quantidade: int, status: int = 503):
+        """As próximas 'quantidade' requisições recebem 'status' (corpo não-JSON)."""
+        with self._lock:
+            self._falhas.extend([status] * quantidade)
+
+    def _consumir_falha(self):
+        with self._lock:
+            return self._falhas.pop(0) if self._falhas else None
+
+    def zerar_estatisticas(self):
+        with self._lock:
+            self._requisicoes = 0
+            self._bytes_enviados = 0    # cliente -> servidor
+            self._bytes_recebidos = 0   # servidor -> cliente
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "requisicoes": self._requisicoes,
+                "bytes_enviados": self._bytes_enviados,
+                "bytes_recebidos": self._bytes_recebidos,
+            }
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-postgrest", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
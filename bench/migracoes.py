@@ -0,0 +1,101 @@
+# migracoes.py
+"""
+Verificação repetível das migrações do handle_db contra um Postgres local
+descartável (ex.: um banco criado só para isso, ou pgserver).
+
+Aplica MIGRACOES duas vezes e confere que:
+  - a primeira execução termina em SCHEMA_VERSION, com as versões 1..N
+    registradas em ordem em schema_version;
+  - a segunda não aplica nada (schema_version idêntica, mesma versao_schema);
+  - a consulta da atividade em andamento usa o índice idx_atividades_abertas.
+Nenhuma linha de atividade é gravada. Sai com código 1 se alguma conferência
+falhar.
+
+Uso:
+    python -m bench.migracoes --dsn postgresql://postgres@localhost/migracoes_teste
+    python -m bench.migracoes            # usa SUPABASE_DB_URL
+"""
+
+import os
+import re
+import sys
+import logging
+import argparse
+import src.handle_db as db
+
+CONSULTA_EM_ANDAMENTO = (f"SELECT * FROM public.{db.TABLE_NAME} "
+                         "WHERE user_id = 'migracoes' AND fim IS NULL ORDER BY id DESC LIMIT 1")
+INDICE_EM_ANDAMENTO = f"idx_{db.TABLE_NAME}_abertas"
+
+def _registradas(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT versao, aplicada_em FROM public.{db.SCHEMA_VERSION_TABLE} ORDER BY versao")
+        linhas = cur.fetchall()
+    conn.rollback()
+    return [tuple(linha) for linha in linhas]
+
+def _plano_em_andamento(conn):
+    # sem dados o planner prefere seq scan; desligado só nesta transação
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        cur.execute("EXPLAIN " + CONSULTA_EM_ANDAMENTO)
+        plano = "\n".join(linha[0] for linha in cur.fetchall())
+    conn.rollback()
+    return plano
+
+def verificar(dsn):
+    """Roda as conferências; retorna a lista de falhas (vazia se tudo certo)."""
+    falhas = []
+    esperadas = [versao for versao, _, _ in db.MIGRACOES]
+    conn = db.conectar_postgres(dsn)
+    try:
+        antes = db.versao_schema(conn)
+        primeira = db.aplicar_migracoes(conn)
+        registradas = _registradas(conn)
+        print(f"1ª execução: versão {antes} -> {primeira}")
+        if primeira != db.SCHEMA_VERSION or db.versao_schema(conn) != db.SCHEMA_VERSION:
+            falhas.append(f"versão após a 1ª execução: {primeira} (esperada {db.SCHEMA_VERSION})")
+        if [versao for versao, _ in registradas] != esperadas:
+            falhas.append(f"schema_version registra {[v for v, _ in registradas]} (esperado {esperadas})")
+
+        segunda = db.aplicar_migracoes(conn)
+        print(f"2ª execução: versão {segunda}")
+        if segunda != primeira or db.versao_schema(conn) != primeira:
+            falhas.append(f"versão após a 2ª execução: {segunda} (esperada {primeira})")
+        if _registradas(conn) != registradas:
+            falhas.append("a 2ª execução alterou schema_version (reaplicou alguma migração)")
+
+        plano = _plano_em_andamento(conn)
+        if not re.search(rf"(using|on) {INDICE_EM_ANDAMENTO}(\s|$)", plano, re.MULTILINE):
+            falhas.append(f"atividade em andamento não usa {INDICE_EM_ANDAMENTO}:\n{plano}")
+    finally:
+        conn.close()
+    return falhas
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m bench.migracoes",
+                                     description="Aplica as migrações duas vezes num Postgres descartável.")
+    parser.add_argument("--dsn", default=os.environ.get("SUPABASE_DB_URL"),
+                        help="Postgres de teste (padrão: SUPABASE_DB_URL)")
+    return parser.parse_args(args)
+
+def main(args) -> int:
+    opts = _parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)  # o handle_db liga INFO ao ser importado
+    if not opts.dsn:
+        print("Erro: informe --dsn ou defina SUPABASE_DB_URL.", file=sys.stderr)
+        return 1
+    try:
+        falhas = verificar(opts.dsn)
+    except RuntimeError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    for falha in falhas:
+        print(f"FALHA: {falha}", file=sys.stderr)
+    if not falhas:
+        print(f"OK: migrações 1-{db.SCHEMA_VERSION} aplicadas e reaplicadas sem alterações.")
+    return 1 if falhas else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,7 +5,9 @@ from kivy.uix.label import Label
 from kivy.uix.togglebutton import ToggleButton
 from kivy.uix.button import Button
 from kivymd.app import MDApp
-import src.handle_db as db
+import src.journal as journal
+import src.catalogo as catalogo
+from src.worker import executar_em_background
 
 # Cores (RGBA 0-1): ajuste como preferir
 NORMAL_COLOR = (1, 1, 1, 1)            # cor normal do botão
@@ -15,48 +17,111 @@ DISABLED_COLOR = (0.7, 0.7, 0.7, 1)    # cor quando desabilitado (opcional)
 class MainScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.current_activity_id = None
+        self.current_activity_key = None  # chave da atividade aberta no journal local
+        self.current_activity_type = None  # tipo da atividade aberta
+        self.current_button = None         # ToggleButton da atividade aberta
+        self._restaurando_selecao = False
         self.selected_activity_type = None
         self.selected_button = None  # referência ao ToggleButton selecionado
+        self.ocupado = False  # True enquanto uma alteração (iniciar/finalizar/trocar) está em andamento
+        self._alteracoes = 0  # alterações disparadas; invalida leituras que começaram antes
+        self._sessao = 0      # incrementado no logout para descartar respostas antigas
+        # ToggleButtons por tipo: criados uma vez e reaproveitados entre logins
+        self._botoes = {}
+        self._tipos = []      # tipos do catálogo na ordem exibida
 
-    def carregar_atividades(self):
+    def carregar_atividades(self, prefetch=None):
+        """
+        Monta os botões e carrega a atividade em andamento. 'prefetch' é um
+        Future já disparado (no login) com o resultado de
+        journal.buscar_em_andamento para o usuário.
+
+        Os botões vêm do catálogo em cache (src/catalogo.py); a versão do
+        catálogo é conferida em segundo plano e os botões só são refeitos se
+        ela mudou.
+        """
         self.app = MDApp.get_running_app()
+        self._sessao += 1
+        self.ocupado = False
+        self._limpar_selecao()
+        self.current_activity_key = None
+        self.current_activity_type = None
+        self.current_button = None
+        self.selected_activity_type = None
+        self.selected_button = None
 
-        activity_types = [
-            "Pesquisa e Desenvolvimento",
-            "Atendimento na Fábrica",
-            "Documentação",
-            "Confecção de Gabaritos",
-            "Cadastro",
-            "Reuniões"
-        ]
-
-        activity_buttons = self.ids.activity_buttons
-        activity_buttons.clear_widgets()
-
-        # Criar ToggleButtons em grupo 'activity' (apenas 1 fica 'down' ao mesmo tempo)
-        for activity_type in activity_types:
-            btn = ToggleButton(
-                text=activity_type,
-                size_hint_y=None,
-                height=48,
-                group='activity',
-                background_color=NORMAL_COLOR,
-                allow_no_selection=False
-            )
-            # quando o estado muda, atualiza a seleção
-            btn.bind(state=lambda inst, st, at=activity_type: self.on_activity_toggled(inst, st, at))
-            activity_buttons.add_widget(btn)
+        self._montar_botoes(catalogo.tipos_locais())
 
         # Verifica se existe atividade em andamento para o usuário atual
-        self.verificar_atividade_em_andamento()
+        self.verificar_atividade_em_andamento(prefetch)
+
+        sessao = self._sessao
 
-    def on_activity_toggled(self, inst, state, activity_type):
+        def on_catalogo(resultado):
+            tipos, mudou = resultado
+            if mudou and sessao == self._sessao:
+                self._montar_botoes(tipos)
+
+        executar_em_background(catalogo.atualizar_catalogo, on_sucesso=on_catalogo)
+
+    def _criar_botao(self, activity_type):
+        # ToggleButtons em grupo 'activity' (apenas 1 fica 'down' ao mesmo tempo)
+        btn = ToggleButton(
+            text=activity_type,
+            size_hint_y=None,
+            height=48,
+            group='activity',
+            background_color=NORMAL_COLOR,
+            allow_no_selection=False
+        )
+        # quando o estado muda, atualiza a seleção
+        btn.bind(state=self.on_activity_toggled)
+        self._botoes[activity_type] = btn
+        return btn
+
+    def _botao(self, activity_type):
+        """Botão do tipo; cria um (fora do catálogo) para atividades abertas de tipos removidos."""
+        btn = self._botoes.get(activity_type)
+        if btn is None:
+            btn = self._criar_botao(activity_type)
+            self.ids.activity_buttons.add_widget(btn)
+        return btn
+
+    def _montar_botoes(self, tipos):
+        """
+        Exibe os botões de 'tipos', nessa ordem. Botões já existentes são
+        reaproveitados; só tipos novos criam widgets.
         """
-        inst: ToggleButton
+        tipos = list(tipos)
+        if tipos == self._tipos and len(self.ids.activity_buttons.children) == len(tipos):
+            return
+        container = self.ids.activity_buttons
+        container.clear_widgets()
+        for activity_type in tipos:
+            container.add_widget(self._botoes.get(activity_type) or self._criar_botao(activity_type))
+        # o botão da atividade em andamento continua na tela mesmo se o tipo saiu do catálogo
+        if self.current_activity_type and self.current_activity_type not in tipos:
+            container.add_widget(self._botao(self.current_activity_type))
+        for nome in set(self._botoes) - set(tipos) - {self.current_activity_type}:
+            del self._botoes[nome]
+        self._tipos = tipos
+
+    def _limpar_selecao(self):
+        """Solta os botões marcados na sessão anterior (os botões são reaproveitados)."""
+        self._restaurando_selecao = True
+        try:
+            for btn in (self.selected_button, self.current_button):
+                if btn is not None:
+                    btn.state = 'normal'
+        finally:
+            self._restaurando_selecao = False
+
+    def on_activity_toggled(self, inst, state):
+        """
+        inst: ToggleButton (o texto é o nome do tipo)
         state: 'down' ou 'normal'
-        activity_type: nome do tipo
         """
+        activity_type = inst.text
         if state == 'down':
             # marcar seleção
             self.selected_button = inst
@@ -71,6 +136,10 @@ class MainScreen(Screen):
                 self.ids.selected_activity_label.text = f"Selecionado: {activity_type}"
             except Exception:
                 pass
+            # com uma atividade em andamento, escolher outro tipo troca a atividade
+            if (self.current_activity_key and activity_type != self.current_activity_type
+                    and not self._restaurando_selecao):
+                self.acao_trocar(activity_type)
         else:
             # voltar cor ao normal
             try:
@@ -86,7 +155,65 @@ class MainScreen(Screen):
                 except Exception:
                     pass
 
+    def _executar_db(self, func, *args, on_sucesso=None, on_erro=None, mensagem="Aguarde...", mutacao=True):
+        """
+        Executa uma operação do journal/handle_db no worker em background.
+        Operações que alteram a atividade (mutacao=True) deixam a tela ocupada
+        e novos cliques são ignorados; retorna False se já havia uma pendente.
+        Leituras (mutacao=False) nunca são recusadas nem ocupam a tela; o
+        resultado é descartado se uma alteração começou enquanto rodavam.
+        """
+        if mutacao and self.ocupado:
+            return False
+        sessao = self._sessao
+        if mutacao:
+            self._alteracoes += 1
+            self._set_ocupado(True, mensagem)
+        elif mensagem:
+            try:
+                self.ids.status_label.text = mensagem
+            except Exception:
+                pass
+        alteracoes = self._alteracoes
+
+        def _atual():
+            # resposta de uma sessão anterior (logout no meio) ou leitura já superada
+            return sessao == self._sessao and alteracoes == self._alteracoes
+
+        def _sucesso(resultado):
+            if not _atual():
+                return
+            if mutacao:
+                self._set_ocupado(False)
+            if on_sucesso:
+                on_sucesso(resultado)
+
+        def _erro(exc):
+            if not _atual():
+                return
+            if mutacao:
+                self._set_ocupado(False)
+            if on_erro:
+                on_erro(exc)
+
+        executar_em_background(func, *args, on_sucesso=_sucesso, on_erro=_erro)
+        return True
+
+    def _set_ocupado(self, ocupado, mensagem=None):
+        self.ocupado = ocupado
+        try:
+            if ocupado:
+                self.ids.start_button.disabled = True
+                self.ids.end_button.disabled = True
+                if mensagem:
+                    self.ids.status_label.text = mensagem
+                self.ids.activity_buttons.disabled = True
+        except Exception:
+            pass
+
     def acao_iniciar(self):
+        if self.ocupado:
+            return
         if not self.selected_activity_type:
             self.show_error("Por favor, selecione um tipo de atividade.")
             return
@@ -97,31 +224,43 @@ class MainScreen(Screen):
         except Exception:
             pass
 
-        try:
-            # iniciar atividade no DB
-            self.current_activity_id = db.iniciar_nova_atividade(
-                self.selected_activity_type, descricao, MDApp.get_running_app().user_id
-            )
+        tipo = self.selected_activity_type
+
+        def on_sucesso(row):
+            self.current_activity_key = row["chave"]
+            self.current_activity_type = tipo
+            self.current_button = self.selected_button
             # Atualizar estado UI
             try:
-                self.ids.status_label.text = f"Em andamento: {self.selected_activity_type}"
+                self.ids.status_label.text = f"Em andamento: {tipo}"
             except Exception:
                 pass
             # mostra a caixa com o título da atividade e mantém a cor do botão selecionado
-            self._show_active_box(self.selected_activity_type)
+            self._show_active_box(tipo)
             self._set_state_em_andamento(True)
-        except Exception as e:
+
+        def on_erro(e):
+            self._restaurar_status()
             self.show_error(f"Falha ao iniciar atividade:\n{e}")
 
+        # grava o início no journal local (o sincronizador envia ao Supabase)
+        self._executar_db(
+            journal.registrar_inicio, tipo, descricao, MDApp.get_running_app().user_id,
+            on_sucesso=on_sucesso, on_erro=on_erro, mensagem="Iniciando atividade..."
+        )
+
     def acao_finalizar(self):
-        if not self.current_activity_id:
+        if self.ocupado:
+            return
+        if not self.current_activity_key:
             self.show_error("Não há atividade em andamento para finalizar.")
             return
 
-        try:
-            db.finalizar_atividade(self.current_activity_id)
+        def on_sucesso(_):
             self.show_success("Atividade finalizada com sucesso.")
-            self.current_activity_id = None
+            self.current_activity_key = None
+            self.current_activity_type = None
+            self.current_button = None
 
             # limpar seleção visual: botão volta ao normal
             if self.selected_button:
@@ -142,26 +281,73 @@ class MainScreen(Screen):
             # esconder a caixa de atividade ativa
             self._show_active_box(None)
             self._set_state_em_andamento(False)
-        except Exception as e:
+
+        def on_erro(e):
+            self._restaurar_status()
             self.show_error(f"Falha ao finalizar atividade:\n{e}")
 
-    def verificar_atividade_em_andamento(self):
+        self._executar_db(
+            journal.registrar_fim, self.current_activity_key,
+            on_sucesso=on_sucesso, on_erro=on_erro, mensagem="Finalizando atividade..."
+        )
+
+    def acao_trocar(self, tipo):
+        """
+        Finaliza a atividade em andamento e inicia 'tipo' numa única operação
+        (journal.registrar_troca), sem intervalo sem atividade aberta.
+        """
+        user_id = MDApp.get_running_app().user_id
+        novo_botao = self.selected_button
+
+        def on_sucesso(row):
+            self.current_activity_key = row["chave"]
+            self.current_activity_type = tipo
+            self.current_button = novo_botao
+            try:
+                self.ids.descricao_text.text = ""
+                self.ids.status_label.text = f"Em andamento: {tipo}"
+            except Exception:
+                pass
+            self._show_active_box(tipo)
+            self._set_state_em_andamento(True)
+
+        def on_erro(e):
+            self._voltar_para_atividade_atual()
+            self._restaurar_status()
+            self.show_error(f"Falha ao trocar atividade:\n{e}")
+
+        iniciou = self._executar_db(
+            journal.registrar_troca, self.current_activity_key, tipo, "", user_id,
+            on_sucesso=on_sucesso, on_erro=on_erro, mensagem=f"Trocando para: {tipo}..."
+        )
+        if not iniciou:
+            self._voltar_para_atividade_atual()
+
+    def _voltar_para_atividade_atual(self):
+        """Remarca o ToggleButton da atividade em andamento (após troca recusada/falha)."""
+        if self.current_button is None:
+            return
+        self._restaurando_selecao = True
         try:
-            user_id = MDApp.get_running_app().user_id
-            row = db.buscar_atividade_em_andamento(user_id)
+            self.current_button.state = 'down'
+        finally:
+            self._restaurando_selecao = False
+
+    def verificar_atividade_em_andamento(self, prefetch=None):
+        user_id = MDApp.get_running_app().user_id
+
+        def on_sucesso(row):
             if row:
                 # existe atividade em andamento -> ajustar UI
-                self.current_activity_id = row.get("id")
+                self.current_activity_key = row.get("chave")
                 tipo = row.get("tipo_atividade")
+                self.current_activity_type = tipo
                 self.selected_activity_type = tipo
-                # tenta marcar o ToggleButton correspondente como 'down'
-                for btn in list(self.ids.activity_buttons.children):
-                    if getattr(btn, 'text', None) == tipo:
-                        btn.state = 'down'      # acionará on_activity_toggled e mudará cor
-                        self.selected_button = btn
-                    else:
-                        # opcional: deixar os outros habilitados mas não selecionados
-                        pass
+                # marca o ToggleButton correspondente como 'down'
+                btn = self._botao(tipo)
+                btn.state = 'down'      # acionará on_activity_toggled e mudará cor
+                self.selected_button = btn
+                self.current_button = btn
 
                 self.ids.selected_activity_label.text = f"Continuando: {tipo}"
                 self.ids.descricao_text.text = row.get("descricao") or ""
@@ -170,11 +356,42 @@ class MainScreen(Screen):
                 self._show_active_box(tipo)
                 self._set_state_em_andamento(True)
             else:
+                self.ids.status_label.text = "Pronto para começar."
                 self._set_state_em_andamento(False)
-        except Exception as e:
+
+        def on_erro(e):
             print("Aviso: falha ao verificar atividade em andamento:", e)
+            self.ids.status_label.text = "Pronto para começar."
             self._set_state_em_andamento(False)
 
+        # até saber se há atividade aberta, Iniciar/Finalizar ficam desabilitados
+        # (a leitura não ocupa a tela: os tipos continuam selecionáveis)
+        try:
+            self.ids.start_button.disabled = True
+            self.ids.end_button.disabled = True
+        except Exception:
+            pass
+        if prefetch is not None:
+            # só aguarda a busca que já começou durante o login
+            self._executar_db(prefetch.result, on_sucesso=on_sucesso, on_erro=on_erro,
+                              mensagem="Carregando...", mutacao=False)
+            return
+        self._executar_db(
+            journal.buscar_em_andamento, user_id,
+            on_sucesso=on_sucesso, on_erro=on_erro, mensagem="Carregando...", mutacao=False
+        )
+
+    def _restaurar_status(self):
+        """Volta o status/botões para o estado anterior a uma operação que falhou."""
+        try:
+            if self.current_activity_key and self.selected_activity_type:
+                self.ids.status_label.text = f"Em andamento: {self.selected_activity_type}"
+            else:
+                self.ids.status_label.text = "Pronto para começar."
+        except Exception:
+            pass
+        self._set_state_em_andamento(bool(self.current_activity_key))
+
     def _set_state_em_andamento(self, em_andamento):
         try:
             self.ids.start_button.disabled = em_andamento
@@ -183,13 +400,12 @@ class MainScreen(Screen):
         except Exception:
             pass
 
-        # opcional: desabilitar todos os botões enquanto em andamento (se quiser)
-        for btn in list(self.ids.activity_buttons.children):
-            try:
-                # se você preferir que o usuário não mude a seleção enquanto em andamento:
-                btn.disabled = em_andamento and (btn is not self.selected_button)
-            except Exception:
-                pass
+        # os botões ficam habilitados mesmo em andamento: escolher outro tipo
+        # troca a atividade (ver acao_trocar)
+        try:
+            self.ids.activity_buttons.disabled = False
+        except Exception:
+            pass
 
     def _show_active_box(self, tipo_atividade_or_none):
         """
@@ -216,7 +432,14 @@ class MainScreen(Screen):
         popup = Popup(title='Sucesso', content=Label(text=message), size_hint=(0.8, 0.4))
         popup.open()
 
+    def abrir_historico(self):
+        app = MDApp.get_running_app()
+        app.sm.current = 'historico'
+        app.sm.get_screen('historico').abrir(self._tipos)
+
     def logout(self):
         app = MDApp.get_running_app()
+        self._sessao += 1  # respostas pendentes da sessão anterior serão ignoradas
+        self.ocupado = False
         app.user_id = ""
         app.sm.current = 'login'
@@ -0,0 +1,87 @@
+# catalogo.py
+"""
+Catálogo de tipos de atividade exibidos na tela principal.
+
+A lista vem da tabela tipos_atividade do Supabase e fica em cache em
+catalogo_atividades.json (pasta de dados do app), junto com a versão do
+catálogo. No login os botões são montados na hora a partir do cache
+(tipos_locais) e atualizar_catalogo confere a versão em segundo plano: só
+quando ela mudou o catálogo inteiro é baixado de novo.
+
+Sem cache e sem conexão, valem os tipos padrão (handle_db.TIPOS_ATIVIDADE_PADRAO).
+"""
+
+import os
+import json
+import logging
+import threading
+import src.handle_db as db
+from src.storage import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+CATALOGO_FILENAME = "catalogo_atividades.json"
+_lock = threading.Lock()
+
+def _cache_path():
+    return get_app_data_dir() / CATALOGO_FILENAME
+
+def ler_cache():
+    """{"versao": int, "tipos": [{"nome", "departamento"}, ...]} ou None."""
+    try:
+        with open(_cache_path(), "r", encoding="utf-8") as f:
+            dados = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(dados, dict) or not dados.get("tipos"):
+        return None
+    return dados
+
+def _gravar_cache(versao, tipos):
+    path = _cache_path()
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"versao": versao, "tipos": tipos}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Não foi possível gravar o cache do catálogo: %s", e)
+
+def _nomes(tipos):
+    return [t["nome"] for t in tipos]
+
+def tipos_locais():
+    """Nomes dos tipos sem ir à rede: cache em disco ou, sem cache, os padrão."""
+    dados = ler_cache()
+    if dados:
+        return _nomes(dados["tipos"])
+    return list(db.TIPOS_ATIVIDADE_PADRAO)
+
+def atualizar_catalogo():
+    """
+    Confere a versão do catálogo no Supabase e, se mudou, baixa a lista e
+    atualiza o cache. Retorna (nomes, mudou); em caso de falha mantém o que
+    já estava em cache (mudou=False).
+    """
+    with _lock:
+        dados = ler_cache()
+        try:
+            versao = db.buscar_versao_catalogo()
+            if dados and dados.get("versao") == versao:
+                return _nomes(dados["tipos"]), False
+            tipos = db.listar_tipos_atividade()
+        except Exception as e:
+            logger.warning("Catálogo de atividades indisponível; usando o local: %s", e)
+            return tipos_locais(), False
+
+        if not tipos:
+            # tabela ainda vazia: mantém o local em vez de deixar a tela sem botões
+            logger.warning("Catálogo de atividades vazio no Supabase; usando o local.")
+            return tipos_locais(), False
+
+        anteriores = _nomes(dados["tipos"]) if dados else list(db.TIPOS_ATIVIDADE_PADRAO)
+        _gravar_cache(versao, tipos)
+        nomes = _nomes(tipos)
+        if nomes != anteriores:
+            logger.info("Catálogo de atividades atualizado (versão %s, %d tipos).", versao, len(nomes))
+        return nomes, nomes != anteriores
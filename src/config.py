@@ -0,0 +1,38 @@
+# config.py
+"""
+Carregamento do .env sem depender do Kivy, para poder ser usado tanto pelo
+app quanto pelos utilitários de linha de comando (ex.: src.export).
+"""
+
+import os
+import sys
+from dotenv import load_dotenv
+
+def carregar_env() -> None:
+    """
+    Prioridade:
+      1) .env externo (arquivo ao lado do exe)
+      2) .env embutido extraído em sys._MEIPASS (quando onefile)
+      3) variáveis do sistema (os.environ)
+    """
+    # 1) pasta do executável (quando empacotado) ou cwd em dev
+    if getattr(sys, "frozen", False):
+        exe_dir = os.path.dirname(sys.executable)
+    else:
+        exe_dir = os.path.abspath(os.getcwd())
+
+    external_env = os.path.join(exe_dir, ".env")
+    if os.path.exists(external_env):
+        load_dotenv(external_env)
+        return
+
+    # 2) .env embutido extraído em _MEIPASS (onefile)
+    base = getattr(sys, "_MEIPASS", None)
+    if base:
+        bundled_env = os.path.join(base, ".env")
+        if os.path.exists(bundled_env):
+            load_dotenv(bundled_env)
+            return
+
+    # 3) se nada encontrado, não faz nada (usa variáveis do sistema, se existirem)
+    return
@@ -0,0 +1,108 @@
+# export.py
+"""
+Exportação em massa da tabela de atividades para CSV ou JSONL.
+
+As linhas são lidas página a página (handle_db.iterar_atividades) e escritas
+no arquivo à medida que chegam, então o uso de memória não depende do tamanho
+do histórico.
+
+Uso:
+    python -m src.export --saida atividades_2025_01.csv.gz --ano 2025 --mes 1
+    python -m src.export --formato jsonl --usuario joao --saida -
+"""
+
+import io
+import sys
+import csv
+import gzip
+import json
+import time
+import argparse
+import src.handle_db as db
+from src.config import carregar_env
+
+FORMATOS = ("csv", "jsonl")
+COLUNAS_EXPORTACAO = (
+    "id", "user_id", "tipo_atividade", "descricao", "inicio", "fim",
+    "ano", "mes", "dia", "horas_trabalhadas",
+)
+
+def _abrir_saida(saida, compactar):
+    if saida == "-":
+        if compactar:
+            return gzip.open(sys.stdout.buffer, "wt", encoding="utf-8", newline="")
+        return io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="", write_through=True)
+    if compactar:
+        return gzip.open(saida, "wt", encoding="utf-8", newline="")
+    return open(saida, "w", encoding="utf-8", newline="")
+
+def exportar_atividades(saida, formato: str = "csv", compactar: bool = False,
+                        page_size: int = None, user_id=None, tipo_atividade=None,
+                        ano=None, mes=None, supabase_client=None):
+    """
+    Escreve as atividades filtradas em 'saida' (caminho ou '-' para stdout).
+    Retorna (linhas_exportadas, segundos).
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"formato deve ser um de {FORMATOS}")
+
+    linhas = db.iterar_atividades(
+        user_id=user_id, tipo_atividade=tipo_atividade, ano=ano, mes=mes,
+        page_size=page_size or db.DEFAULT_PAGE_SIZE,
+        colunas=", ".join(COLUNAS_EXPORTACAO), supabase_client=supabase_client,
+    )
+
+    total = 0
+    inicio = time.perf_counter()
+    arquivo = _abrir_saida(saida, compactar)
+    try:
+        if formato == "csv":
+            writer = csv.DictWriter(arquivo, fieldnames=COLUNAS_EXPORTACAO, extrasaction="ignore")
+            writer.writeheader()
+            for row in linhas:
+                writer.writerow(row)
+                total += 1
+        else:
+            for row in linhas:
+                arquivo.write(json.dumps(row.para_dict(), ensure_ascii=False, default=str))
+                arquivo.write("\n")
+                total += 1
+    finally:
+        linhas.close()
+        if saida == "-" and not compactar:
+            arquivo.flush()
+            arquivo.detach()  # não fecha o stdout
+        else:
+            arquivo.close()
+    return total, time.perf_counter() - inicio
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m src.export", description="Exporta atividades para CSV/JSONL.")
+    parser.add_argument("--saida", "-o", required=True, help="arquivo de saída ('-' para stdout)")
+    parser.add_argument("--formato", choices=FORMATOS, help="padrão: deduzido da extensão (csv)")
+    parser.add_argument("--gzip", action="store_true", help="compacta a saída (automático para .gz)")
+    parser.add_argument("--usuario", help="filtra por user_id")
+    parser.add_argument("--tipo", help="filtra por tipo_atividade")
+    parser.add_argument("--ano", type=int)
+    parser.add_argument("--mes", type=int)
+    parser.add_argument("--page-size", type=int, help="linhas por requisição")
+    return parser.parse_args(args)
+
+def main(args) -> None:
+    opts = _parse_args(args)
+    compactar = opts.gzip or opts.saida.endswith(".gz")
+    formato = opts.formato
+    if formato is None:
+        nome = opts.saida[:-3] if opts.saida.endswith(".gz") else opts.saida
+        formato = "jsonl" if nome.endswith((".jsonl", ".json")) else "csv"
+
+    carregar_env()
+    total, segundos = exportar_atividades(
+        opts.saida, formato=formato, compactar=compactar, page_size=opts.page_size,
+        user_id=opts.usuario, tipo_atividade=opts.tipo, ano=opts.ano, mes=opts.mes,
+    )
+    taxa = total / segundos if segundos > 0 else float(total)
+    print(f"{total} atividade(s) exportada(s) em {segundos:.2f}s ({taxa:.0f} linhas/s).", file=sys.stderr)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
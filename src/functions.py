@@ -1,65 +1,109 @@
 import sys
 import os
+import logging
+import threading
 from kivy.resources import resource_add_path
-from dotenv import load_dotenv
+from src.config import carregar_env
+
+logger = logging.getLogger(__name__)
 
 def adicionar_caminhos_kv() -> None:
     # Se executável onefile extrair arquivos, adiciona o caminho de recursos para Kivy
     if getattr(sys, '_MEIPASS', None):
         resource_add_path(os.path.join(sys._MEIPASS))
 
-def carregar_env() -> None:
-    """
-    Prioridade:
-      1) .env externo (arquivo ao lado do exe)
-      2) .env embutido extraído em sys._MEIPASS (quando onefile)
-      3) variáveis do sistema (os.environ)
-    """
-    # 1) pasta do executável (quando empacotado) ou cwd em dev
-    if getattr(sys, "frozen", False):
-        exe_dir = os.path.dirname(sys.executable)
-    else:
-        exe_dir = os.path.abspath(os.getcwd())
-
-    external_env = os.path.join(exe_dir, ".env")
-    if os.path.exists(external_env):
-        load_dotenv(external_env)
-        return
-
-    # 2) .env embutido extraído em _MEIPASS (onefile)
-    base = getattr(sys, "_MEIPASS", None)
-    if base:
-        bundled_env = os.path.join(base, ".env")
-        if os.path.exists(bundled_env):
-            load_dotenv(bundled_env)
-            return
-
-    # 3) se nada encontrado, não faz nada (usa variáveis do sistema, se existirem)
-    return
-
 # Agora importa o Kivy / telas
 from kivy.lang import Builder
+from kivy.clock import Clock
 from kivymd.app import MDApp
 from kivy.uix.screenmanager import ScreenManager
-from kivy.properties import StringProperty
+from kivy.properties import StringProperty, BooleanProperty
 
-# Importar telas só após carregar env
-from src.login import LoginScreen
-from src.GUI import MainScreen
+# Só a tela de login é importada aqui. Supabase/pytz (handle_db, journal), a
+# tela principal e o main.kv são carregados depois que a janela aparece.
+from src.login import LoginScreen, calibrar_iteracoes
+from src.worker import encerrar_worker, executar_em_background
+from src import perfil
 
 
 def carregar_arquivos_kv() -> None: 
     # Carregar os arquivos KV (devem estar na mesma pasta do exe / ou embutidos)
+    # main.kv fica para carregar_kv_principal, junto com a tela principal
     Builder.load_file('kv/login.kv')
+
+def carregar_kv_principal() -> None:
     Builder.load_file('kv/main.kv')
+    Builder.load_file('kv/historico.kv')
 
 class ActivityTrackerApp(MDApp):
     user_id = StringProperty("")
+    tela_principal_pronta = BooleanProperty(False)
 
     def build(self):
         self.theme_cls.primary_palette = "Teal"
         self.theme_cls.theme_style = "Light"
         self.sm = ScreenManager()
         self.sm.add_widget(LoginScreen(name='login'))
+        self._ao_ficar_pronto = []
+        self._erro_inicializacao = None
+        perfil.marcar("build (tela de login)")
+        return self.sm
+
+    def on_start(self):
+        perfil.marcar("janela de login exibida")
+        # importa os módulos de dados (supabase, pytz) fora da thread da UI
+        threading.Thread(target=self._importar_modulos_db, name="startup-imports", daemon=True).start()
+        # calibra o custo do PBKDF2 desta máquina sem travar a tela
+        executar_em_background(calibrar_iteracoes)
+
+    def _importar_modulos_db(self):
+        try:
+            import src.journal  # noqa: F401  (importa handle_db -> supabase, pytz)
+        except Exception as e:
+            logger.exception("Falha ao carregar módulos de acesso a dados: %s", e)
+            Clock.schedule_once(lambda dt: self._falha_inicializacao(e))
+            return
+        perfil.marcar("imports supabase/pytz/journal")
+        Clock.schedule_once(self._montar_tela_principal)
+
+    def _montar_tela_principal(self, dt):
+        # widgets e regras KV precisam ser criados na thread do Kivy
+        carregar_kv_principal()
+        from src.GUI import MainScreen
+        from src.historico import HistoricoScreen
+        import src.journal as journal
         self.sm.add_widget(MainScreen(name='main'))
-        return self.sm
\ No newline at end of file
+        self.sm.add_widget(HistoricoScreen(name='historico'))
+        perfil.marcar("main.kv e tela principal")
+        # envia em segundo plano os eventos gravados no journal local
+        journal.iniciar_sincronizador()
+        self.tela_principal_pronta = True
+        pendentes, self._ao_ficar_pronto = self._ao_ficar_pronto, []
+        for callback in pendentes:
+            callback()
+        if perfil.ativo():
+            perfil.imprimir()
+
+    def _falha_inicializacao(self, erro):
+        self._erro_inicializacao = erro
+        if self._ao_ficar_pronto:
+            self._ao_ficar_pronto = []
+            self.sm.get_screen('login').show_error(f"Falha ao iniciar:\n{erro}")
+
+    def quando_pronto(self, callback):
+        """Executa callback quando a tela principal estiver montada (ou já, se estiver)."""
+        if self.tela_principal_pronta:
+            callback()
+        elif self._erro_inicializacao is not None:
+            self.sm.get_screen('login').show_error(f"Falha ao iniciar:\n{self._erro_inicializacao}")
+        else:
+            self._ao_ficar_pronto.append(callback)
+
+    def on_stop(self):
+        # encerra o worker de background e libera as conexões com o Supabase
+        if self.tela_principal_pronta:
+            import src.journal as journal
+            journal.parar_sincronizador()
+        encerrar_worker()
+        if "src.handle_db" in sys.modules:
+            sys.modules["src.handle_db"].fechar_supabase_client()
@@ -8,12 +8,24 @@ priorizando .env externo e .env embutido.
 """
 
 import os
-from datetime import datetime
+import json
+import time as _time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, time, timedelta
 import logging
 import pytz
+from src.storage import get_app_data_dir
+from src import metricas, resiliencia
 
 try:
-    from supabase import create_client, Client
+    import httpx
+    from supabase import create_client, Client, ClientOptions
+    from postgrest.exceptions import APIError
+    from postgrest.types import CountMethod, ReturnMethod
 except Exception as e:
     raise ImportError("Biblioteca 'supabase' não encontrada. Instale com: pip install supabase") from e
 
@@ -35,36 +47,579 @@ CREATE TABLE IF NOT EXISTS public.{TABLE_NAME} (
   ano integer,
   mes integer,
   dia integer,
-  horas_trabalhadas numeric
+  horas_trabalhadas numeric,
+  chave text UNIQUE
 );
 """
 
+# Finaliza a atividade numa única ida ao banco: fim e horas_trabalhadas são
+# calculados no Postgres a partir de 'inicio' (mesma conta de
+# calcular_horas_trabalhadas, no fuso TIMEZONE).
+RPC_FINALIZAR = "finalizar_atividade"
+FINALIZAR_ATIVIDADE_V1_SQL = f"""
+CREATE OR REPLACE FUNCTION public.{RPC_FINALIZAR}(p_id bigint)
+RETURNS SETOF public.{TABLE_NAME}
+LANGUAGE sql AS $$
+  UPDATE public.{TABLE_NAME}
+     SET fim = (now() AT TIME ZONE '{TIMEZONE.zone}'),
+         horas_trabalhadas = round((extract(epoch FROM ((now() AT TIME ZONE '{TIMEZONE.zone}') - inicio)) / 3600)::numeric, 10)
+   WHERE id = p_id
+  RETURNING *;
+$$;
+"""
+
+# Versão atual (migração 9): só finaliza atividades abertas. Uma chamada
+# repetida ou atrasada não altera fim/horas de uma atividade já finalizada:
+# devolve a linha como está (o SELECT vê o estado anterior ao UPDATE, então
+# as duas partes nunca devolvem a mesma linha).
+FINALIZAR_ATIVIDADE_SQL = f"""
+CREATE OR REPLACE FUNCTION public.{RPC_FINALIZAR}(p_id bigint)
+RETURNS SETOF public.{TABLE_NAME}
+LANGUAGE sql AS $$
+  WITH finalizada AS (
+    UPDATE public.{TABLE_NAME}
+       SET fim = (now() AT TIME ZONE '{TIMEZONE.zone}'),
+           horas_trabalhadas = round((extract(epoch FROM ((now() AT TIME ZONE '{TIMEZONE.zone}') - inicio)) / 3600)::numeric, 10)
+     WHERE id = p_id AND fim IS NULL
+    RETURNING *
+  )
+  SELECT * FROM finalizada
+  UNION ALL
+  SELECT * FROM public.{TABLE_NAME} WHERE id = p_id AND fim IS NOT NULL;
+$$;
+"""
+
+# Troca de atividade numa única transação no servidor: fecha a atividade
+# aberta e abre a próxima com o mesmo instante, sem intervalo entre elas.
+RPC_TROCAR = "trocar_atividade"
+TROCAR_ATIVIDADE_SQL = f"""
+CREATE OR REPLACE FUNCTION public.{RPC_TROCAR}(
+  p_id bigint, p_tipo text, p_descricao text, p_user_id text, p_chave text
+)
+RETURNS SETOF public.{TABLE_NAME}
+LANGUAGE plpgsql AS $$
+DECLARE
+  agora timestamp := now() AT TIME ZONE '{TIMEZONE.zone}';
+BEGIN
+  UPDATE public.{TABLE_NAME}
+     SET fim = agora,
+         horas_trabalhadas = round((extract(epoch FROM (agora - inicio)) / 3600)::numeric, 10)
+   WHERE id = p_id AND fim IS NULL;
+
+  RETURN QUERY
+  INSERT INTO public.{TABLE_NAME} (tipo_atividade, descricao, inicio, user_id, ano, mes, dia, chave)
+  VALUES (p_tipo, p_descricao, agora, p_user_id,
+          extract(year FROM agora)::int, extract(month FROM agora)::int, extract(day FROM agora)::int,
+          p_chave)
+  ON CONFLICT (chave) DO UPDATE SET chave = EXCLUDED.chave
+  RETURNING *;
+END;
+$$;
+"""
+
+# Fecha um lote de atividades abandonadas (de todos os usuários) numa única
+# ida ao banco: fim = inicio + p_duracao, nunca depois de agora. O 'fim IS
+# NULL' no UPDATE garante que uma atividade finalizada por outro caminho
+# depois da seleção não é alterada (ver fechar_atividades_abandonadas).
+RPC_FECHAR_ABANDONADAS = "fechar_atividades_abandonadas"
+FECHAR_ABANDONADAS_SQL = f"""
+CREATE OR REPLACE FUNCTION public.{RPC_FECHAR_ABANDONADAS}(
+  p_corte timestamp, p_duracao interval, p_limite integer
+)
+RETURNS TABLE (id bigint, user_id text, horas_trabalhadas numeric)
+LANGUAGE sql AS $$
+  WITH alvo AS (
+    SELECT a.id, least(a.inicio + p_duracao, now() AT TIME ZONE '{TIMEZONE.zone}') AS fim
+      FROM public.{TABLE_NAME} a
+     WHERE a.fim IS NULL AND a.inicio < p_corte
+     ORDER BY a.id
+     LIMIT p_limite
+  )
+  UPDATE public.{TABLE_NAME} t
+     SET fim = alvo.fim,
+         horas_trabalhadas = round((extract(epoch FROM (alvo.fim - t.inicio)) / 3600)::numeric, 10)
+    FROM alvo
+   WHERE t.id = alvo.id AND t.fim IS NULL
+  RETURNING t.id, t.user_id, t.horas_trabalhadas;
+$$;
+"""
+
+# Resumo diário de horas (rollup) mantido por trigger: cada UPDATE que grava
+# horas_trabalhadas (finalizar_atividade, troca, sincronização do journal)
+# soma a diferença na linha (usuário, tipo, dia) correspondente. Assim os
+# relatórios leem um número de linhas proporcional aos grupos, não às atividades.
+RESUMO_TABLE_NAME = "atividades_resumo_diario"
+RESUMO_DIARIO_SQL = f"""
+CREATE TABLE IF NOT EXISTS public.{RESUMO_TABLE_NAME} (
+  user_id text NOT NULL,
+  tipo_atividade text NOT NULL,
+  ano integer NOT NULL,
+  mes integer NOT NULL,
+  dia integer NOT NULL,
+  horas_trabalhadas numeric NOT NULL DEFAULT 0,
+  quantidade integer NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, ano, mes, dia, tipo_atividade)
+);
+
+CREATE OR REPLACE FUNCTION public.atualizar_resumo_diario()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.horas_trabalhadas IS NOT NULL AND OLD.ano IS NOT NULL THEN
+    UPDATE public.{RESUMO_TABLE_NAME}
+       SET horas_trabalhadas = horas_trabalhadas - OLD.horas_trabalhadas,
+           quantidade = quantidade - 1
+     WHERE user_id = coalesce(OLD.user_id, '') AND tipo_atividade = OLD.tipo_atividade
+       AND ano = OLD.ano AND mes = OLD.mes AND dia = OLD.dia;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.horas_trabalhadas IS NOT NULL AND NEW.ano IS NOT NULL THEN
+    INSERT INTO public.{RESUMO_TABLE_NAME} AS r (user_id, tipo_atividade, ano, mes, dia, horas_trabalhadas, quantidade)
+    VALUES (coalesce(NEW.user_id, ''), NEW.tipo_atividade, NEW.ano, NEW.mes, NEW.dia, NEW.horas_trabalhadas, 1)
+    ON CONFLICT (user_id, ano, mes, dia, tipo_atividade) DO UPDATE
+      SET horas_trabalhadas = r.horas_trabalhadas + EXCLUDED.horas_trabalhadas,
+          quantidade = r.quantidade + 1;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_{TABLE_NAME}_resumo_diario ON public.{TABLE_NAME};
+CREATE TRIGGER trg_{TABLE_NAME}_resumo_diario
+AFTER INSERT OR DELETE OR UPDATE OF horas_trabalhadas, user_id, tipo_atividade, ano, mes, dia
+ON public.{TABLE_NAME}
+FOR EACH ROW EXECUTE FUNCTION public.atualizar_resumo_diario();
+"""
+
+# Carga inicial do resumo com o histórico existente (executar uma vez, logo
+# após criar a tabela e antes de novas finalizações).
+RESUMO_DIARIO_BACKFILL_SQL = f"""
+INSERT INTO public.{RESUMO_TABLE_NAME} (user_id, tipo_atividade, ano, mes, dia, horas_trabalhadas, quantidade)
+SELECT coalesce(user_id, ''), tipo_atividade, ano, mes, dia, sum(horas_trabalhadas), count(*)
+  FROM public.{TABLE_NAME}
+ WHERE horas_trabalhadas IS NOT NULL AND ano IS NOT NULL
+ GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT DO NOTHING;
+"""
+
+# Catálogo de tipos de atividade (botões da tela principal). Cada alteração na
+# tabela incrementa catalogo_versao, então os clientes só baixam o catálogo
+# quando a versão mudou (ver src/catalogo.py).
+CATALOGO_TABLE_NAME = "tipos_atividade"
+CATALOGO_VERSAO_TABLE = "catalogo_versao"
+TIPOS_ATIVIDADE_PADRAO = (
+    "Pesquisa e Desenvolvimento",
+    "Atendimento na Fábrica",
+    "Documentação",
+    "Confecção de Gabaritos",
+    "Cadastro",
+    "Reuniões",
+)
+CATALOGO_SQL = f"""
+CREATE TABLE IF NOT EXISTS public.{CATALOGO_TABLE_NAME} (
+  nome text PRIMARY KEY,
+  departamento text,
+  ordem integer NOT NULL DEFAULT 0,
+  ativo boolean NOT NULL DEFAULT true
+);
+
+CREATE TABLE IF NOT EXISTS public.{CATALOGO_VERSAO_TABLE} (
+  id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  versao bigint NOT NULL DEFAULT 1
+);
+INSERT INTO public.{CATALOGO_VERSAO_TABLE} (id, versao) VALUES (1, 1) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION public.incrementar_versao_catalogo()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE public.{CATALOGO_VERSAO_TABLE} SET versao = versao + 1 WHERE id = 1;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_{CATALOGO_TABLE_NAME}_versao ON public.{CATALOGO_TABLE_NAME};
+CREATE TRIGGER trg_{CATALOGO_TABLE_NAME}_versao
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.{CATALOGO_TABLE_NAME}
+FOR EACH STATEMENT EXECUTE FUNCTION public.incrementar_versao_catalogo();
+
+INSERT INTO public.{CATALOGO_TABLE_NAME} (nome, ordem) VALUES
+""" + ",\n".join(f"  ('{nome}', {i})" for i, nome in enumerate(TIPOS_ATIVIDADE_PADRAO, 1)) + """
+ON CONFLICT (nome) DO NOTHING;
+"""
+
+# colunas de período usadas em cada agrupamento do relatório
+AGRUPAMENTOS_RELATORIO = {
+    "dia": ("ano", "mes", "dia"),
+    "mes": ("ano", "mes"),
+    "ano": ("ano",),
+}
+RELATORIO_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 500
+IDS_POR_REQUISICAO = 200  # ids por filtro id=in.(...) (mantém a URL curta)
+
+# Colunas pedidas por cada leitura (nunca select=*: descricao longa e colunas
+# que a tela não usa só aumentariam a resposta)
+COLUNAS_EM_ANDAMENTO = "id, chave, user_id, tipo_atividade, descricao, inicio, ano, mes, dia"
+COLUNAS_LISTAGEM = "id, tipo_atividade, descricao, inicio, fim, horas_trabalhadas"
+
+# Atividades esquecidas abertas (fechar_atividades_abandonadas)
+DEFAULT_ABANDONO_IDADE_HORAS = 24.0     # abertas há mais que isso são consideradas abandonadas
+DEFAULT_ABANDONO_DURACAO_HORAS = 8.0    # duração atribuída a elas (fim = inicio + isso)
+DEFAULT_ABANDONO_LOTE = 500
+COLUNAS_ABANDONADAS = "id, user_id, tipo_atividade, inicio"
+
+# Migrações versionadas do schema (aplicadas por aplicar_migracoes, em ordem).
+# Nunca altere uma migração já publicada: acrescente uma nova versão.
+SCHEMA_VERSION_TABLE = "schema_version"
+MIGRACOES = [
+    (1, "tabela de atividades", CREATE_TABLE_SQL + f"""
+ALTER TABLE public.{TABLE_NAME}
+  ADD COLUMN IF NOT EXISTS ano integer,
+  ADD COLUMN IF NOT EXISTS mes integer,
+  ADD COLUMN IF NOT EXISTS dia integer,
+  ADD COLUMN IF NOT EXISTS horas_trabalhadas numeric;
+"""),
+    (2, "chave de idempotência", f"""
+ALTER TABLE public.{TABLE_NAME} ADD COLUMN IF NOT EXISTS chave text;
+CREATE UNIQUE INDEX IF NOT EXISTS {TABLE_NAME}_chave_key ON public.{TABLE_NAME} (chave);
+"""),
+    (3, "função finalizar_atividade", FINALIZAR_ATIVIDADE_V1_SQL),
+    (4, "função trocar_atividade", TROCAR_ATIVIDADE_SQL),
+    (5, "resumo diário de horas", RESUMO_DIARIO_SQL + RESUMO_DIARIO_BACKFILL_SQL),
+    (6, "índices das consultas frequentes", f"""
+-- atividade em andamento do usuário (fim IS NULL, ORDER BY id DESC LIMIT 1)
+CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_abertas ON public.{TABLE_NAME} (user_id, id) WHERE fim IS NULL;
+-- relatórios/listagens por usuário e período
+CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_user_periodo ON public.{TABLE_NAME} (user_id, ano, mes, dia);
+"""),
+    (7, "catálogo de tipos de atividade", CATALOGO_SQL),
+    (8, "índice das atividades abertas por início", f"""
+-- atividades esquecidas abertas, de todos os usuários (fechar_atividades_abandonadas)
+CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_abertas_inicio ON public.{TABLE_NAME} (inicio, id) WHERE fim IS NULL;
+"""),
+    (9, "finalizar_atividade só finaliza atividades abertas", FINALIZAR_ATIVIDADE_SQL),
+    (10, "função fechar_atividades_abandonadas", FECHAR_ABANDONADAS_SQL),
+]
+SCHEMA_VERSION = MIGRACOES[-1][0]
+
+# Cache em disco do resultado de setup_database (ver _ler_cache_schema)
+SCHEMA_CACHE_FILENAME = "schema_cache.json"
+DEFAULT_SCHEMA_CACHE_TTL = 24 * 3600  # segundos
+_schema_cache_lock = threading.Lock()
+
+# Erros que indicam schema diferente do esperado (coluna/tabela/função inexistente)
+CODIGOS_COLUNA_INEXISTENTE = ("42703", "PGRST204")
+CODIGOS_SCHEMA_DESATUALIZADO = CODIGOS_COLUNA_INEXISTENTE + ("42P01", "PGRST205", "PGRST202", "42883")
+
+# Códigos do PostgREST para função RPC inexistente
+RPC_INEXISTENTE_CODES = ("PGRST202", "42883")
+_rpc_finalizar_disponivel = True
+
+# Colunas enviadas pelo sincronizador do journal local (ver src/journal.py)
+COLUNAS_SINCRONIZACAO = (
+    "chave", "tipo_atividade", "descricao", "inicio", "fim",
+    "user_id", "ano", "mes", "dia", "horas_trabalhadas",
+)
+
+# Client compartilhado pelo processo (criado sob demanda, ver get_supabase_client)
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_POOL_SIZE = 4
+
+_client_lock = threading.Lock()
+_client: Client = None
+_http_client: httpx.Client = None
+_conexao_aquecida = False
+
+def _env_float(nome, padrao):
+    try:
+        return float(os.environ.get(nome, padrao))
+    except (TypeError, ValueError):
+        logger.warning("Valor inválido para %s; usando %s.", nome, padrao)
+        return padrao
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.environ.get(nome, padrao))
+    except (TypeError, ValueError):
+        logger.warning("Valor inválido para %s; usando %s.", nome, padrao)
+        return padrao
+
+def _event_hooks():
+    hooks = {"request": [], "response": []}
+    for modulo in (resiliencia, metricas):
+        for evento, funcoes in modulo.event_hooks().items():
+            hooks[evento].extend(funcoes)
+    return hooks
+
+def _criar_http_client():
+    """
+    Cria o httpx.Client com keep-alive usado pelo PostgREST.
+    Configurável via .env:
+      SUPABASE_TIMEOUT    -> timeout (segundos) padrão de cada requisição
+                             (por operação: ver src/resiliencia.py)
+      SUPABASE_POOL_SIZE  -> máximo de conexões mantidas abertas
+    """
+    timeout = _env_float("SUPABASE_TIMEOUT", DEFAULT_TIMEOUT)
+    pool_size = max(1, _env_int("SUPABASE_POOL_SIZE", DEFAULT_POOL_SIZE))
+    return httpx.Client(
+        timeout=httpx.Timeout(timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        follow_redirects=True,
+        event_hooks=_event_hooks(),
+    )
+
 def get_supabase_client():
-    """Cria e retorna o client do Supabase usando variáveis de ambiente."""
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_KEY")
-    if not url or not key:
-        raise RuntimeError("SUPABASE_URL e SUPABASE_KEY devem estar definidas como variáveis de ambiente.")
-    client = create_client(url, key)
-    return client
-
-def setup_database():
+    """
+    Retorna o client do Supabase compartilhado pelo processo.
+
+    O client (e o pool de conexões HTTP por trás dele) é criado na primeira
+    chamada e reutilizado depois, evitando novo handshake TLS a cada operação.
+    Thread-safe. Use fechar_supabase_client() para liberar as conexões.
+    """
+    global _client, _http_client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            url = os.environ.get("SUPABASE_URL")
+            key = os.environ.get("SUPABASE_KEY")
+            if not url or not key:
+                raise RuntimeError("SUPABASE_URL e SUPABASE_KEY devem estar definidas como variáveis de ambiente.")
+            metricas.configurar_pelo_ambiente()
+            http_client = _criar_http_client()
+            try:
+                _client = create_client(url, key, options=ClientOptions(httpx_client=http_client))
+            except Exception:
+                http_client.close()
+                raise
+            _http_client = http_client
+        return _client
+
+def aquecer_conexao():
+    """
+    Cria o client compartilhado e abre a conexão HTTP/TLS com uma consulta
+    mínima, para que a primeira operação real não pague o handshake.
+    Só faz a requisição uma vez por client. Erros são apenas registrados.
+    """
+    global _conexao_aquecida
+    if _conexao_aquecida:
+        return
+    try:
+        _executar(get_supabase_client().table(TABLE_NAME).select("id").limit(1), "aquecer_conexao",
+                  idempotente=True)
+        _conexao_aquecida = True
+    except Exception as e:
+        logger.warning("Falha ao aquecer conexão com o Supabase: %s", e)
+
+def fechar_supabase_client():
+    """Fecha as conexões do client compartilhado (chamado ao encerrar o app)."""
+    global _client, _http_client, _conexao_aquecida
+    with _client_lock:
+        http_client = _http_client
+        _client = None
+        _http_client = None
+        _conexao_aquecida = False
+    if http_client is not None:
+        try:
+            http_client.close()
+        except Exception as e:
+            logger.warning("Falha ao fechar conexões do Supabase: %s", e)
+    metricas.encerrar()
+    resiliencia.resetar_disjuntor()
+
+def conectar_postgres(dsn: str = None):
+    """
+    Abre uma conexão direta com o Postgres (psycopg 3 ou psycopg2), usada só
+    para migrações. dsn padrão: variável SUPABASE_DB_URL.
+    """
+    dsn = dsn or os.environ.get("SUPABASE_DB_URL")
+    if not dsn:
+        raise RuntimeError("SUPABASE_DB_URL deve estar definida para aplicar migrações.")
+    try:
+        import psycopg
+        return psycopg.connect(dsn)
+    except ImportError:
+        pass
+    try:
+        import psycopg2
+        return psycopg2.connect(dsn)
+    except ImportError as e:
+        raise RuntimeError("Instale 'psycopg' (ou 'psycopg2') para aplicar migrações.") from e
+
+def versao_schema(conn):
+    """Versão atual do schema no banco (0 se nenhuma migração foi aplicada)."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT to_regclass('public.{SCHEMA_VERSION_TABLE}')")
+        if cur.fetchone()[0] is None:
+            conn.rollback()
+            return 0
+        cur.execute(f"SELECT coalesce(max(versao), 0) FROM public.{SCHEMA_VERSION_TABLE}")
+        versao = cur.fetchone()[0]
+    conn.rollback()
+    return versao
+
+def aplicar_migracoes(conn, ate: int = None):
+    """
+    Aplica, cada uma na sua transação, as MIGRACOES ainda não registradas em
+    schema_version. Um advisory lock evita que dois terminais migrem ao mesmo
+    tempo. Retorna a versão final do schema.
+    """
+    ate = SCHEMA_VERSION if ate is None else ate
+    with conn.cursor() as cur:
+        cur.execute(f"""
+CREATE TABLE IF NOT EXISTS public.{SCHEMA_VERSION_TABLE} (
+  versao integer PRIMARY KEY,
+  descricao text,
+  aplicada_em timestamptz NOT NULL DEFAULT now()
+);""")
+    conn.commit()
+
+    versao_atual = 0
+    for versao, descricao, sql in MIGRACOES:
+        if versao > ate:
+            break
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SCHEMA_VERSION_TABLE,))
+            cur.execute(f"SELECT 1 FROM public.{SCHEMA_VERSION_TABLE} WHERE versao = %s", (versao,))
+            if cur.fetchone():
+                conn.rollback()
+                versao_atual = versao
+                continue
+            logger.info("Aplicando migração %d: %s", versao, descricao)
+            try:
+                cur.execute(sql)
+                cur.execute(
+                    f"INSERT INTO public.{SCHEMA_VERSION_TABLE} (versao, descricao) VALUES (%s, %s)",
+                    (versao, descricao),
+                )
+            except Exception:
+                conn.rollback()
+                logger.exception("Falha na migração %d (%s).", versao, descricao)
+                raise
+        conn.commit()
+        versao_atual = versao
+    return versao_atual
+
+def migrar_banco(dsn: str = None):
+    """Conecta via SUPABASE_DB_URL (ou dsn) e aplica as migrações pendentes."""
+    conn = conectar_postgres(dsn)
+    try:
+        return aplicar_migracoes(conn)
+    finally:
+        conn.close()
+
+def sql_migracoes():
+    """SQL de todas as migrações, para rodar manualmente no editor do Supabase."""
+    return "\n".join(f"-- migração {v}: {d}\n{sql.strip()}\n" for v, d, sql in MIGRACOES)
+
+def _schema_cache_path():
+    return get_app_data_dir() / SCHEMA_CACHE_FILENAME
+
+def _schema_cache_chave():
+    """Chave do cache: URL do Supabase + versão de schema esperada por este código."""
+    url = os.environ.get("SUPABASE_URL", "")
+    return hashlib.sha256(f"{url}|{SCHEMA_VERSION}".encode("utf-8")).hexdigest()
+
+def _ler_arquivo_cache_schema():
+    try:
+        with open(_schema_cache_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _gravar_arquivo_cache_schema(dados):
+    path = _schema_cache_path()
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dados, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Não foi possível gravar o cache do schema: %s", e)
+
+def _ler_cache_schema():
+    """Resultado do último probe bem-sucedido, se ainda dentro de SCHEMA_CACHE_TTL."""
+    entrada = _ler_arquivo_cache_schema().get(_schema_cache_chave())
+    if not entrada:
+        return None
+    ttl = _env_float("SCHEMA_CACHE_TTL", DEFAULT_SCHEMA_CACHE_TTL)
+    if _time.time() - entrada.get("verificado_em", 0) > ttl:
+        return None
+    return entrada.get("resultado")
+
+def _gravar_cache_schema(resultado):
+    with _schema_cache_lock:
+        dados = _ler_arquivo_cache_schema()
+        dados[_schema_cache_chave()] = {"verificado_em": _time.time(), "resultado": resultado}
+        _gravar_arquivo_cache_schema(dados)
+
+def invalidar_cache_schema():
+    """Descarta o probe em cache (ex.: uma escrita falhou por coluna/tabela inexistente)."""
+    with _schema_cache_lock:
+        dados = _ler_arquivo_cache_schema()
+        if dados.pop(_schema_cache_chave(), None) is not None:
+            _gravar_arquivo_cache_schema(dados)
+            logger.info("Cache do schema invalidado.")
+
+def _executar(query, operacao: str, user_id=None, idempotente: bool = False):
+    """
+    Executa a query com o timeout de 'operacao', novas tentativas e circuit
+    breaker (src/resiliencia.py); 'idempotente' libera repetir a chamada mesmo
+    depois de enviada. Erros de schema desatualizado invalidam o cache do probe.
+    Com as métricas ligadas (DB_METRICAS), a chamada é medida como 'operacao'.
+    """
+    chamada = lambda: resiliencia.executar(query.execute, operacao, idempotente)
+    try:
+        if metricas.ativo():
+            return metricas.medir(operacao, user_id, chamada)
+        return chamada()
+    except APIError as e:
+        if e.code in CODIGOS_SCHEMA_DESATUALIZADO:
+            invalidar_cache_schema()
+        raise
+
+def _verificar_schema():
+    if os.environ.get("SUPABASE_DB_URL"):
+        try:
+            versao = migrar_banco()
+            logger.info("Schema na versão %d.", versao)
+            return {"exists": True, "schema_version": versao}
+        except Exception as e:
+            logger.exception("Falha ao aplicar migrações: %s", e)
+
     supabase = get_supabase_client()
     try:
-        resp = supabase.table(TABLE_NAME).select("id").limit(1).execute()
-        if getattr(resp, "error", None):
-            logger.warning("Erro ao acessar tabela '%s': %s", TABLE_NAME, resp.error)
-            return {"exists": False, "create_table_sql": CREATE_TABLE_SQL}
-        check_columns = supabase.table(TABLE_NAME).select("ano, mes, dia, horas_trabalhadas").limit(1).execute()
-        if getattr(check_columns, "error", None):
-            logger.warning("Tabela existe mas faltam colunas. Execute este SQL no Supabase:\n%s", 
-                          "ALTER TABLE atividades ADD COLUMN ano integer, ADD COLUMN mes integer, ADD COLUMN dia integer, ADD COLUMN horas_trabalhadas numeric;")
+        # um único probe: tabela e colunas esperadas
+        _executar(supabase.table(TABLE_NAME).select("id, " + ", ".join(COLUNAS_SINCRONIZACAO)).limit(1),
+                  "verificar_schema", idempotente=True)
         logger.info("Tabela '%s' acessível no Supabase.", TABLE_NAME)
         return {"exists": True}
+    except APIError as e:
+        if e.code in CODIGOS_COLUNA_INEXISTENTE:
+            logger.warning("Tabela existe mas faltam colunas (%s). Defina SUPABASE_DB_URL para migrar "
+                           "automaticamente ou execute este SQL no Supabase:\n%s", e, sql_migracoes())
+            return {"exists": True, "missing_columns": True}
+        logger.warning("Erro ao acessar tabela '%s': %s", TABLE_NAME, e)
+        return {"exists": False, "create_table_sql": CREATE_TABLE_SQL}
     except Exception as e:
         logger.exception("Falha ao verificar tabela '%s': %s", TABLE_NAME, e)
         return {"exists": False, "create_table_sql": CREATE_TABLE_SQL}
 
+def setup_database(forcar: bool = False):
+    """
+    Verifica (e, com SUPABASE_DB_URL, migra) o schema. Um resultado positivo
+    fica em cache no disco, por URL e SCHEMA_VERSION, durante SCHEMA_CACHE_TTL
+    segundos; nesse período não há nenhuma requisição. forcar=True ignora o cache.
+    """
+    if not forcar:
+        cached = _ler_cache_schema()
+        if cached is not None:
+            return cached
+    resultado = _verificar_schema()
+    if resultado.get("exists") and not resultado.get("missing_columns"):
+        _gravar_cache_schema(resultado)
+    return resultado
+
 def calcular_horas_trabalhadas(inicio, fim):
     if not fim:
         return None
@@ -72,28 +627,246 @@ def calcular_horas_trabalhadas(inicio, fim):
     horas = diferenca.total_seconds() / 3600
     return round(horas, 10)
 
-def iniciar_nova_atividade(tipo, descricao, user_id, supabase_client: Client = None):
-    if not supabase_client:
-        supabase_client = get_supabase_client()
+# Cache de leitura (atividade em andamento e listagens recentes por usuário)
+DEFAULT_CACHE_TTL = 30.0    # segundos
+DEFAULT_CACHE_MAX = 256     # entradas
 
-    hora_inicio = datetime.now(TIMEZONE)
-    hora_inicio_iso = hora_inicio.isoformat()
-    ano = hora_inicio.year
-    mes = hora_inicio.month
-    dia = hora_inicio.day
+_AUSENTE = object()
+
+class CacheTTL:
+    """
+    Cache LRU com expiração (TTL), thread-safe. As chaves são tuplas
+    (tipo, user_id, ...), o que permite invalidar tudo de um usuário.
+    """
+
+    def __init__(self, max_itens: int = DEFAULT_CACHE_MAX, ttl: float = DEFAULT_CACHE_TTL):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        """Retorna o valor guardado ou _AUSENTE (None é um valor válido)."""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] > _time.monotonic():
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._itens[chave]
+            self.misses += 1
+            return _AUSENTE
+
+    def set(self, chave, valor):
+        if self.ttl <= 0 or self.max_itens <= 0:
+            return
+        with self._lock:
+            self._itens[chave] = (_time.monotonic() + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar_usuario(self, user_id):
+        with self._lock:
+            for chave in [c for c in self._itens if c[1] == user_id]:
+                del self._itens[chave]
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "itens": len(self._itens)}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache() -> CacheTTL:
+    """Cache criado no primeiro uso, depois de carregar_env (DB_CACHE_TTL / DB_CACHE_MAX)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheTTL(
+                    max_itens=_env_int("DB_CACHE_MAX", DEFAULT_CACHE_MAX),
+                    ttl=_env_float("DB_CACHE_TTL", DEFAULT_CACHE_TTL),
+                )
+    return _cache
+
+def estatisticas_cache():
+    """Contadores de hit/miss e tamanho do cache de leituras."""
+    return _get_cache().estatisticas()
+
+def limpar_cache():
+    _get_cache().limpar()
+
+def _copiar(valor):
+    # devolve cópias para que o chamador não altere o que está no cache
+    # (Atividade é somente leitura e pode ser compartilhada)
+    if isinstance(valor, list):
+        return [r if isinstance(r, Atividade) else dict(r) for r in valor]
+    if isinstance(valor, dict):
+        return dict(valor)
+    return valor
+
+_ouvintes_escrita = []
+
+def registrar_ouvinte_escrita(func):
+    """
+    func(rows) passa a receber as linhas devolvidas pelo Supabase em cada
+    escrita deste módulo (ex.: a réplica local em src/replica.py).
+    """
+    if func not in _ouvintes_escrita:
+        _ouvintes_escrita.append(func)
+
+def _atualizar_cache_escrita(rows):
+    """Após uma escrita: invalida as listagens e ajusta a atividade aberta dos usuários afetados."""
+    cache = _get_cache()
+    if rows:
+        cache.invalidar_usuario(None)  # consultas sem filtro de usuário
+    for row in rows or []:
+        user_id = row.get("user_id")
+        cache.invalidar_usuario(user_id)
+        if row.get("fim") is None and row.get("id") is not None:
+            cache.set(("em_andamento", user_id), Atividade.de_linha(row))
+    if not rows:
+        return
+    for ouvinte in list(_ouvintes_escrita):
+        try:
+            ouvinte([dict(r) for r in rows])
+        except Exception as e:
+            logger.warning("Falha ao repassar escrita para %s: %s", getattr(ouvinte, "__qualname__", ouvinte), e)
+
+def parse_datetime(valor):
+    """
+    Converte o timestamp ISO vindo do Supabase/journal para datetime em TIMEZONE.
+    inicio/fim são 'timestamp without time zone' (hora local de TIMEZONE): o
+    PostgREST os devolve sem fuso, então valores sem fuso são interpretados em
+    TIMEZONE, nunca no fuso da máquina.
+    """
+    dt = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        return TIMEZONE.localize(dt)
+    return dt.astimezone(TIMEZONE)
+
+COLUNAS_ATIVIDADE = ("id", "chave", "user_id", "tipo_atividade", "descricao", "inicio", "fim",
+                     "ano", "mes", "dia", "horas_trabalhadas")
+_COLUNAS_ATIVIDADE_SET = frozenset(COLUNAS_ATIVIDADE)
+
+class Atividade:
+    """
+    Linha (somente leitura) da tabela de atividades devolvida pelas leituras
+    deste módulo. Guarda só as colunas pedidas na consulta, em __slots__ (bem
+    menos memória que um dict por linha em listagens grandes), e continua
+    utilizável como dict: row["id"], row.get("fim"), "fim" in row, dict(row).
+    inicio_dt/fim_dt convertem o timestamp só na primeira leitura.
+    """
+
+    __slots__ = COLUNAS_ATIVIDADE + ("_inicio_dt", "_fim_dt")
+
+    def __init__(self, **colunas):
+        for coluna, valor in colunas.items():
+            object.__setattr__(self, coluna, valor)
+
+    @classmethod
+    def de_linha(cls, row):
+        """Linha do PostgREST (dict) -> Atividade; colunas desconhecidas são ignoradas."""
+        return cls(**{c: v for c, v in row.items() if c in _COLUNAS_ATIVIDADE_SET})
+
+    def __setattr__(self, nome, valor):
+        raise AttributeError("Atividade é somente leitura")
+
+    def __getitem__(self, coluna):
+        if coluna not in _COLUNAS_ATIVIDADE_SET:
+            raise KeyError(coluna)
+        try:
+            return getattr(self, coluna)
+        except AttributeError:
+            raise KeyError(coluna) from None
+
+    def get(self, coluna, padrao=None):
+        try:
+            return self[coluna]
+        except KeyError:
+            return padrao
+
+    def __contains__(self, coluna):
+        return coluna in _COLUNAS_ATIVIDADE_SET and hasattr(self, coluna)
+
+    def keys(self):
+        return [c for c in COLUNAS_ATIVIDADE if hasattr(self, c)]
+
+    def __iter__(self):
+        return iter(self.keys())
 
-    payload = {
+    def __len__(self):
+        return len(self.keys())
+
+    def para_dict(self):
+        return {c: getattr(self, c) for c in self.keys()}
+
+    def __eq__(self, outro):
+        if isinstance(outro, Atividade):
+            return self.para_dict() == outro.para_dict()
+        if isinstance(outro, dict):
+            return self.para_dict() == outro
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Atividade({self.para_dict()!r})"
+
+    def _converter(self, coluna, cache):
+        try:
+            return getattr(self, cache)
+        except AttributeError:
+            valor = self.get(coluna)
+            valor = parse_datetime(valor) if isinstance(valor, str) else valor
+            object.__setattr__(self, cache, valor)
+            return valor
+
+    @property
+    def inicio_dt(self):
+        return self._converter("inicio", "_inicio_dt")
+
+    @property
+    def fim_dt(self):
+        return self._converter("fim", "_fim_dt")
+
+def _atividades(resp):
+    return [Atividade.de_linha(r) for r in (getattr(resp, "data", None) or [])]
+
+def gerar_chave():
+    """Chave de idempotência gerada no cliente (coluna 'chave')."""
+    return uuid.uuid4().hex
+
+def montar_payload_inicio(tipo, descricao, user_id, hora_inicio, chave=None):
+    """Monta a linha de uma atividade recém iniciada (usado pelo insert e pelo journal)."""
+    return {
         "tipo_atividade": tipo,
         "descricao": descricao,
-        "inicio": hora_inicio_iso,
+        "inicio": hora_inicio.isoformat(),
         "user_id": user_id,
-        "ano": ano,
-        "mes": mes,
-        "dia": dia,
-        "horas_trabalhadas": None
+        "ano": hora_inicio.year,
+        "mes": hora_inicio.month,
+        "dia": hora_inicio.day,
+        "horas_trabalhadas": None,
+        "chave": chave,
     }
 
-    resp = supabase_client.table(TABLE_NAME).insert(payload).execute()
+def iniciar_nova_atividade(tipo, descricao, user_id, supabase_client: Client = None, chave=None):
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    hora_inicio = datetime.now(TIMEZONE)
+    payload = montar_payload_inicio(tipo, descricao, user_id, hora_inicio, chave or gerar_chave())
+
+    resp = _executar(supabase_client.table(TABLE_NAME).insert(payload), "iniciar_nova_atividade", user_id)
     if getattr(resp, "error", None):
         logger.error("Erro ao inserir atividade: %s", resp.error)
         raise RuntimeError(f"Supabase insert error: {resp.error}")
@@ -101,64 +874,535 @@ def iniciar_nova_atividade(tipo, descricao, user_id, supabase_client: Client = N
     data = getattr(resp, "data", None)
     if data and isinstance(data, list) and len(data) > 0:
         inserted = data[0]
+        _atualizar_cache_escrita([inserted])
         return inserted.get("id", None)
+    _get_cache().invalidar_usuario(user_id)
     return None
 
-def finalizar_atividade(activity_id, supabase_client: Client = None):
+def finalizar_atividade(activity_id, supabase_client: Client = None, inicio=None):
+    """
+    Finaliza a atividade com uma única requisição.
+
+    - Se 'inicio' (datetime ou string ISO) for informado, por exemplo o valor
+      devolvido por iniciar/buscar_atividade_em_andamento, horas_trabalhadas é
+      calculado localmente e basta o UPDATE.
+    - Caso contrário usa a função SQL FINALIZAR_ATIVIDADE_SQL, que calcula as
+      horas no banco (UPDATE ... RETURNING). Se ela ainda não existir no
+      Supabase, cai no caminho antigo (SELECT inicio + UPDATE).
+    """
+    global _rpc_finalizar_disponivel
     if not supabase_client:
         supabase_client = get_supabase_client()
 
-    atividade = supabase_client.table(TABLE_NAME).select("inicio").eq("id", activity_id).execute()
-    if getattr(atividade, "error", None):
-        logger.error("Erro ao buscar atividade id=%s: %s", activity_id, atividade.error)
-        raise RuntimeError(f"Supabase select error: {atividade.error}")
-    if not atividade.data:
-        logger.error("Atividade id=%s não encontrada.", activity_id)
-        raise RuntimeError("Atividade não encontrada.")
+    if inicio is None and _rpc_finalizar_disponivel:
+        try:
+            resp = _executar(supabase_client.rpc(RPC_FINALIZAR, {"p_id": activity_id}), "finalizar_atividade.rpc")
+        except APIError as e:
+            if e.code not in RPC_INEXISTENTE_CODES:
+                logger.error("Erro ao finalizar atividade id=%s: %s", activity_id, e)
+                raise RuntimeError(f"Supabase rpc error: {e}") from e
+            logger.warning("Função '%s' não encontrada no Supabase. Execute este SQL:\n%s",
+                           RPC_FINALIZAR, FINALIZAR_ATIVIDADE_SQL)
+            _rpc_finalizar_disponivel = False
+        else:
+            if not resp.data:
+                logger.error("Atividade id=%s não encontrada.", activity_id)
+                raise RuntimeError("Atividade não encontrada.")
+            _atualizar_cache_escrita(resp.data)
+            return True
+
+    if inicio is None:
+        atividade = _executar(supabase_client.table(TABLE_NAME).select("inicio").eq("id", activity_id),
+                              "finalizar_atividade.buscar_inicio", idempotente=True)
+        if getattr(atividade, "error", None):
+            logger.error("Erro ao buscar atividade id=%s: %s", activity_id, atividade.error)
+            raise RuntimeError(f"Supabase select error: {atividade.error}")
+        if not atividade.data:
+            logger.error("Atividade id=%s não encontrada.", activity_id)
+            raise RuntimeError("Atividade não encontrada.")
+        inicio = atividade.data[0]["inicio"]
 
-    inicio_str = atividade.data[0]["inicio"]
-    inicio = datetime.fromisoformat(inicio_str.replace('Z', '+00:00')).astimezone(TIMEZONE)
+    if isinstance(inicio, str):
+        inicio = parse_datetime(inicio)
     fim = datetime.now(TIMEZONE)
     fim_iso = fim.isoformat()
     horas_trabalhadas = calcular_horas_trabalhadas(inicio, fim)
 
-    resp = supabase_client.table(TABLE_NAME).update({
+    resp = _executar(supabase_client.table(TABLE_NAME).update({
         "fim": fim_iso,
         "horas_trabalhadas": horas_trabalhadas
-    }).eq("id", activity_id).execute()
+    }).eq("id", activity_id).is_("fim", None), "finalizar_atividade.update", idempotente=True)
 
     if getattr(resp, "error", None):
         logger.error("Erro ao finalizar atividade id=%s: %s", activity_id, resp.error)
         raise RuntimeError(f"Supabase update error: {resp.error}")
+    if resp.data is not None and len(resp.data) == 0:
+        # nada aberto com esse id: já finalizada (chamada repetida) ou inexistente
+        existe = _executar(supabase_client.table(TABLE_NAME).select("id").eq("id", activity_id),
+                           "finalizar_atividade.buscar_inicio", idempotente=True)
+        if getattr(existe, "data", None):
+            return True
+        logger.error("Atividade id=%s não encontrada.", activity_id)
+        raise RuntimeError("Atividade não encontrada.")
+    if resp.data:
+        _atualizar_cache_escrita(resp.data)
+    else:
+        _get_cache().limpar()  # sem a linha de volta não dá para saber o usuário
     return True
 
-def buscar_atividade_em_andamento(user_id=None, supabase_client: Client = None):
+def trocar_atividade(activity_id, tipo, descricao, user_id, supabase_client: Client = None, chave=None):
+    """
+    Finaliza a atividade 'activity_id' e inicia 'tipo' numa única chamada
+    transacional (função TROCAR_ATIVIDADE_SQL). Retorna a nova linha.
+    A 'chave' torna a chamada segura para reenvio.
+    """
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    try:
+        resp = _executar(supabase_client.rpc(RPC_TROCAR, {
+            "p_id": activity_id,
+            "p_tipo": tipo,
+            "p_descricao": descricao,
+            "p_user_id": user_id,
+            "p_chave": chave or gerar_chave(),
+        }), "trocar_atividade", user_id, idempotente=True)
+    except APIError as e:
+        if e.code in RPC_INEXISTENTE_CODES:
+            logger.error("Função '%s' não encontrada no Supabase. Execute este SQL:\n%s",
+                         RPC_TROCAR, TROCAR_ATIVIDADE_SQL)
+        else:
+            logger.error("Erro ao trocar atividade id=%s: %s", activity_id, e)
+        raise RuntimeError(f"Supabase rpc error: {e}") from e
+
+    _get_cache().invalidar_usuario(user_id)
+    data = getattr(resp, "data", None)
+    if data and isinstance(data, list):
+        _atualizar_cache_escrita(data)
+        return data[0]
+    return None
+
+def buscar_atividade_em_andamento(user_id=None, supabase_client: Client = None, usar_cache: bool = True):
+    """
+    Atividade aberta mais recente (do usuário, se informado). O resultado,
+    inclusive "nenhuma", fica no cache por DB_CACHE_TTL segundos e é
+    atualizado pelas escritas deste módulo.
+    """
+    chave_cache = ("em_andamento", user_id)
+    if usar_cache:
+        cached = _get_cache().get(chave_cache)
+        if cached is not _AUSENTE:
+            return _copiar(cached)
+
     if not supabase_client:
         supabase_client = get_supabase_client()
 
-    query = supabase_client.table(TABLE_NAME).select("*").is_("fim", None).order("id", desc=True).limit(1)
+    query = (supabase_client.table(TABLE_NAME).select(COLUNAS_EM_ANDAMENTO)
+             .is_("fim", None).order("id", desc=True).limit(1))
     if user_id is not None:
         query = query.eq("user_id", user_id)
 
-    resp = query.execute()
+    resp = _executar(query, "buscar_atividade_em_andamento", user_id, idempotente=True)
     if getattr(resp, "error", None):
         logger.error("Erro ao buscar atividade em andamento: %s", resp.error)
         raise RuntimeError(f"Supabase select error: {resp.error}")
 
-    data = getattr(resp, "data", None)
-    if data and isinstance(data, list) and len(data) > 0:
-        return data[0]
-    return None
+    rows = _atividades(resp)
+    row = rows[0] if rows else None
+    _get_cache().set(chave_cache, row)
+    return row
+
+def listar_atividades(limit: int = 100, user_id=None, supabase_client: Client = None, usar_cache: bool = True,
+                      colunas: str = COLUNAS_LISTAGEM):
+    """As 'limit' atividades mais recentes (Atividade, só com 'colunas')."""
+    chave_cache = ("lista", user_id, limit, colunas)
+    if usar_cache:
+        cached = _get_cache().get(chave_cache)
+        if cached is not _AUSENTE:
+            return _copiar(cached)
 
-def listar_atividades(limit: int = 100, user_id=None, supabase_client: Client = None):
     if not supabase_client:
         supabase_client = get_supabase_client()
 
-    query = supabase_client.table(TABLE_NAME).select("*").order("id", desc=True).limit(limit)
+    query = supabase_client.table(TABLE_NAME).select(colunas).order("id", desc=True).limit(limit)
     if user_id is not None:
         query = query.eq("user_id", user_id)
-    resp = query.execute()
+    resp = _executar(query, "listar_atividades", user_id, idempotente=True)
     if getattr(resp, "error", None):
         logger.error("Erro ao listar atividades: %s", resp.error)
         raise RuntimeError(f"Supabase select error: {resp.error}")
+    rows = _atividades(resp)
+    _get_cache().set(chave_cache, rows)
+    return _copiar(rows)
+
+def buscar_versao_catalogo(supabase_client: Client = None) -> int:
+    """Versão atual do catálogo de tipos (uma linha, uma coluna)."""
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+    query = supabase_client.table(CATALOGO_VERSAO_TABLE).select("versao").eq("id", 1).limit(1)
+    resp = _executar(query, "buscar_versao_catalogo", idempotente=True)
+    if getattr(resp, "error", None):
+        logger.error("Erro ao buscar versão do catálogo: %s", resp.error)
+        raise RuntimeError(f"Supabase select error: {resp.error}")
+    data = getattr(resp, "data", None) or []
+    return int(data[0]["versao"]) if data else 0
+
+def listar_tipos_atividade(supabase_client: Client = None):
+    """Tipos ativos do catálogo, na ordem de exibição: [{"nome", "departamento"}, ...]."""
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+    query = (supabase_client.table(CATALOGO_TABLE_NAME).select("nome, departamento")
+             .eq("ativo", True).order("ordem").order("nome"))
+    resp = _executar(query, "listar_tipos_atividade", idempotente=True)
+    if getattr(resp, "error", None):
+        logger.error("Erro ao listar tipos de atividade: %s", resp.error)
+        raise RuntimeError(f"Supabase select error: {resp.error}")
     return getattr(resp, "data", []) or []
+
+def sincronizar_atividades(rows, supabase_client: Client = None):
+    """
+    Envia em lote linhas do journal local (ver src/journal.py).
+
+    Cada linha traz a 'chave' de idempotência gerada no cliente; o upsert por
+    'chave' garante que reenviar o mesmo lote não cria linhas duplicadas.
+    Linhas que já têm 'id' remoto (ex.: atividade aberta antes do journal)
+    são atualizadas pelo id. Retorna a lista de linhas gravadas ({id, chave, ...}).
+    """
+    if not rows:
+        return []
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    por_id = [r for r in rows if r.get("id") is not None]
+    por_chave = [r for r in rows if r.get("id") is None]
+    gravadas = []
+    for lote, conflito, colunas in (
+        (por_chave, "chave", COLUNAS_SINCRONIZACAO),
+        (por_id, "id", ("id",) + COLUNAS_SINCRONIZACAO),
+    ):
+        if not lote:
+            continue
+        payload = [{c: r.get(c) for c in colunas} for r in lote]
+        resp = _executar(supabase_client.table(TABLE_NAME).upsert(payload, on_conflict=conflito),
+                         "sincronizar_atividades", idempotente=True)
+        if getattr(resp, "error", None):
+            logger.error("Erro ao sincronizar atividades: %s", resp.error)
+            raise RuntimeError(f"Supabase upsert error: {resp.error}")
+        gravadas.extend(getattr(resp, "data", None) or [])
+    for user_id in {r.get("user_id") for r in rows}:
+        _get_cache().invalidar_usuario(user_id)
+    _atualizar_cache_escrita(gravadas)
+    return gravadas
+
+def gravar_fim_sincronizado(activity_id, fim, horas_trabalhadas, chave=None, supabase_client: Client = None):
+    """
+    Grava no Supabase o fim calculado no cliente (journal) com
+    UPDATE ... WHERE id = ? AND fim IS NULL, numa requisição: um fim gravado
+    antes por outro caminho (outro terminal, fechar_atividades_abandonadas)
+    não é sobrescrito, e uma atividade apagada não é recriada. 'chave' é
+    gravada junto quando informada (atividades abertas antes do journal).
+    Retorna a linha gravada, ou None se nada foi alterado.
+    """
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+    dados = {"fim": fim, "horas_trabalhadas": horas_trabalhadas}
+    if chave is not None:
+        dados["chave"] = chave
+    resp = _executar(supabase_client.table(TABLE_NAME).update(dados).eq("id", activity_id).is_("fim", None),
+                     "gravar_fim_sincronizado", idempotente=True)
+    if getattr(resp, "error", None):
+        logger.error("Erro ao gravar fim da atividade id=%s: %s", activity_id, resp.error)
+        raise RuntimeError(f"Supabase update error: {resp.error}")
+    if not resp.data:
+        return None
+    _atualizar_cache_escrita(resp.data)
+    return resp.data[0]
+
+def importar_lote(rows, supabase_client: Client = None):
+    """
+    Grava um lote de atividades históricas numa única requisição (usado por
+    src/importacao.py). Upsert por 'chave' ignorando as já existentes, então
+    reenviar um lote importado não altera nada. Não devolve as linhas
+    (return=minimal); retorna quantas foram de fato inseridas (count=exact),
+    sem contar as chaves que já existiam.
+    """
+    if not rows:
+        return 0
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    payload = [{c: r.get(c) for c in COLUNAS_SINCRONIZACAO} for r in rows]
+    resp = _executar(supabase_client.table(TABLE_NAME).upsert(
+        payload, on_conflict="chave", ignore_duplicates=True, returning=ReturnMethod.minimal,
+        count=CountMethod.exact,
+    ), "importar_lote", idempotente=True)
+    if getattr(resp, "error", None):
+        logger.error("Erro ao importar lote: %s", resp.error)
+        raise RuntimeError(f"Supabase upsert error: {resp.error}")
+    cache = _get_cache()
+    cache.invalidar_usuario(None)
+    for user_id in {r.get("user_id") for r in rows}:
+        cache.invalidar_usuario(user_id)
+    return resp.count if resp.count is not None else len(rows)
+
+def buscar_atividades_abandonadas(iniciadas_antes_de: datetime, depois_de_id=None,
+                                  limite: int = DEFAULT_ABANDONO_LOTE, supabase_client: Client = None):
+    """
+    Atividades ainda abertas, de todos os usuários, com inicio anterior a
+    'iniciadas_antes_de', em ordem de id (keyset: passe o último id em
+    depois_de_id). Usa o índice parcial idx_atividades_abertas_inicio.
+    """
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+    query = (supabase_client.table(TABLE_NAME).select(COLUNAS_ABANDONADAS)
+             .is_("fim", None).lt("inicio", iniciadas_antes_de.isoformat()))
+    if depois_de_id is not None:
+        query = query.gt("id", depois_de_id)
+    resp = _executar(query.order("id").limit(limite), "buscar_atividades_abandonadas", idempotente=True)
+    if getattr(resp, "error", None):
+        logger.error("Erro ao buscar atividades abandonadas: %s", resp.error)
+        raise RuntimeError(f"Supabase select error: {resp.error}")
+    return _atividades(resp)
+
+def fechar_atividades_abandonadas(idade_horas: float = DEFAULT_ABANDONO_IDADE_HORAS,
+                                  duracao_horas: float = DEFAULT_ABANDONO_DURACAO_HORAS,
+                                  lote: int = DEFAULT_ABANDONO_LOTE, simular: bool = False,
+                                  supabase_client: Client = None):
+    """
+    Finaliza as atividades abertas há mais de 'idade_horas' (esquecidas sem
+    Finalizar), de todos os usuários. O fim é limitado a inicio + duracao_horas
+    (nunca depois de agora) e horas_trabalhadas é recalculado.
+
+    Cada lote de até 'lote' atividades é uma única chamada à função
+    FECHAR_ABANDONADAS_SQL (UPDATE ... WHERE fim IS NULL RETURNING): uma
+    atividade finalizada ou apagada entre a seleção e a gravação não é
+    alterada nem recriada.
+
+    Com simular=True nada é gravado (as candidatas são só listadas, por
+    buscar_atividades_abandonadas). Retorna
+    {"encontradas", "fechadas", "horas_atribuidas", "usuarios"};
+    "fechadas" conta só as linhas que o UPDATE de fato alterou.
+    """
+    if idade_horas <= 0 or duracao_horas <= 0 or lote <= 0:
+        raise ValueError("idade_horas, duracao_horas e lote devem ser positivos")
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    agora = datetime.now(TIMEZONE)
+    corte = agora - timedelta(hours=idade_horas)
+    stats = {"encontradas": 0, "fechadas": 0, "horas_atribuidas": 0.0, "usuarios": set()}
+
+    if simular:
+        duracao = timedelta(hours=duracao_horas)
+        ultimo_id = None
+        while True:
+            rows = buscar_atividades_abandonadas(corte, ultimo_id, lote, supabase_client)
+            if not rows:
+                break
+            ultimo_id = rows[-1]["id"]
+            stats["encontradas"] += len(rows)
+            for row in rows:
+                inicio = row.inicio_dt
+                stats["horas_atribuidas"] += calcular_horas_trabalhadas(inicio, min(inicio + duracao, agora))
+                stats["usuarios"].add(row.get("user_id"))
+            if len(rows) < lote:
+                break
+    else:
+        params = {"p_corte": corte.isoformat(), "p_duracao": f"{duracao_horas} hours", "p_limite": lote}
+        while True:
+            # as fechadas deixam de ser candidatas: o próximo lote começa sozinho depois delas
+            try:
+                resp = _executar(supabase_client.rpc(RPC_FECHAR_ABANDONADAS, params),
+                                 "fechar_atividades_abandonadas", idempotente=True)
+            except APIError as e:
+                if e.code in RPC_INEXISTENTE_CODES:
+                    logger.error("Função '%s' não encontrada no Supabase. Execute este SQL:\n%s",
+                                 RPC_FECHAR_ABANDONADAS, FECHAR_ABANDONADAS_SQL)
+                else:
+                    logger.error("Erro ao fechar atividades abandonadas: %s", e)
+                raise RuntimeError(f"Supabase rpc error: {e}") from e
+            rows = getattr(resp, "data", None) or []
+            stats["encontradas"] += len(rows)
+            stats["fechadas"] += len(rows)
+            for row in rows:
+                stats["horas_atribuidas"] += float(row["horas_trabalhadas"] or 0)
+                stats["usuarios"].add(row.get("user_id"))
+            if len(rows) < lote:
+                break
+
+    cache = _get_cache()
+    if stats["fechadas"]:
+        cache.invalidar_usuario(None)
+        for user_id in stats["usuarios"]:
+            cache.invalidar_usuario(user_id)
+        logger.info("%d atividade(s) abandonada(s) finalizada(s).", stats["fechadas"])
+    stats["horas_atribuidas"] = round(stats["horas_atribuidas"], 10)
+    stats["usuarios"] = len(stats["usuarios"])
+    return stats
+
+def relatorio_horas(user_id=None, tipo_atividade=None, ano=None, mes=None, dia=None,
+                    agrupar_por: str = "mes", supabase_client: Client = None):
+    """
+    Total de horas por usuário, tipo de atividade e período ('dia', 'mes' ou 'ano'),
+    lido do resumo diário (RESUMO_DIARIO_SQL). Os filtros são opcionais.
+
+    Retorna lista de dicts ordenada por período/usuário/tipo:
+      {"user_id", "tipo_atividade", "ano", ["mes", ["dia"]], "horas_trabalhadas", "quantidade"}
+    """
+    if agrupar_por not in AGRUPAMENTOS_RELATORIO:
+        raise ValueError(f"agrupar_por deve ser um de {tuple(AGRUPAMENTOS_RELATORIO)}")
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    chaves_periodo = AGRUPAMENTOS_RELATORIO[agrupar_por]
+    totais = {}
+    inicio = 0
+    while True:
+        query = supabase_client.table(RESUMO_TABLE_NAME).select(
+            "user_id, tipo_atividade, ano, mes, dia, horas_trabalhadas, quantidade"
+        )
+        query = filtrar_atividades(query, user_id, tipo_atividade, ano, mes, dia)
+        query = query.order("ano").order("mes").order("dia").order("user_id").order("tipo_atividade")
+        resp = _executar(query.range(inicio, inicio + RELATORIO_PAGE_SIZE - 1), "relatorio_horas", user_id,
+                         idempotente=True)
+        if getattr(resp, "error", None):
+            logger.error("Erro ao gerar relatório de horas: %s", resp.error)
+            raise RuntimeError(f"Supabase select error: {resp.error}")
+        linhas = getattr(resp, "data", None) or []
+
+        for linha in linhas:
+            grupo = (linha["user_id"], linha["tipo_atividade"]) + tuple(linha[c] for c in chaves_periodo)
+            total = totais.get(grupo)
+            if total is None:
+                total = totais[grupo] = [0.0, 0]
+            total[0] += float(linha["horas_trabalhadas"] or 0)
+            total[1] += int(linha["quantidade"] or 0)
+
+        if len(linhas) < RELATORIO_PAGE_SIZE:
+            break
+        inicio += RELATORIO_PAGE_SIZE
+
+    resultado = []
+    for grupo, (horas, quantidade) in totais.items():
+        item = {"user_id": grupo[0], "tipo_atividade": grupo[1]}
+        item.update(zip(chaves_periodo, grupo[2:]))
+        item["horas_trabalhadas"] = round(horas, 10)
+        item["quantidade"] = quantidade
+        resultado.append(item)
+    resultado.sort(key=lambda i: (tuple(i[c] for c in chaves_periodo), i["user_id"], i["tipo_atividade"]))
+    return resultado
+
+def _inicio_do_dia(dia: date):
+    return TIMEZONE.localize(datetime.combine(dia, time.min)).isoformat()
+
+def filtrar_atividades(query, user_id=None, tipo_atividade=None, ano=None, mes=None, dia=None,
+                       desde: date = None, ate: date = None):
+    """
+    Aplica à query os filtros comuns de atividades. 'desde'/'ate' são datas
+    (inclusivas) comparadas com 'inicio'; ano/mes/dia filtram por igualdade.
+    """
+    for coluna, valor in (("user_id", user_id), ("tipo_atividade", tipo_atividade),
+                          ("ano", ano), ("mes", mes), ("dia", dia)):
+        if valor is not None:
+            query = query.eq(coluna, valor)
+    if desde is not None:
+        query = query.gte("inicio", _inicio_do_dia(desde))
+    if ate is not None:
+        query = query.lt("inicio", _inicio_do_dia(ate + timedelta(days=1)))
+    return query
+
+def buscar_pagina_atividades(user_id=None, tipo_atividade=None, ano=None, mes=None, dia=None,
+                             desde: date = None, ate: date = None, antes_de_id=None, depois_de_id=None,
+                             limite: int = DEFAULT_PAGE_SIZE, colunas: str = COLUNAS_LISTAGEM, ignorar_ids=(),
+                             supabase_client: Client = None):
+    """
+    Uma página de atividades paginada por 'id' (keyset, sem OFFSET), sempre em
+    ordem decrescente de id:
+      - sem cursor ou com antes_de_id: as 'limite' mais recentes com id < antes_de_id;
+      - com depois_de_id: as 'limite' imediatamente mais novas (id > depois_de_id),
+        para voltar em direção ao topo de uma lista.
+    'colunas' deve incluir 'id' (é acrescentado se faltar). Linhas com id em
+    'ignorar_ids' (já conhecidas pelo chamador) não são enviadas.
+    Retorna uma lista de Atividade.
+    """
+    if limite <= 0:
+        raise ValueError("limite deve ser positivo")
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+    if colunas != "*" and "id" not in [c.strip() for c in colunas.split(",")]:
+        colunas = "id, " + colunas
+
+    query = supabase_client.table(TABLE_NAME).select(colunas)
+    query = filtrar_atividades(query, user_id, tipo_atividade, ano, mes, dia, desde, ate)
+    if ignorar_ids:
+        query = query.not_.in_("id", sorted(ignorar_ids))
+    if depois_de_id is not None:
+        query = query.gt("id", depois_de_id).order("id")
+    else:
+        if antes_de_id is not None:
+            query = query.lt("id", antes_de_id)
+        query = query.order("id", desc=True)
+    resp = _executar(query.limit(limite), "buscar_pagina_atividades", user_id, idempotente=True)
+    if getattr(resp, "error", None):
+        logger.error("Erro ao paginar atividades: %s", resp.error)
+        raise RuntimeError(f"Supabase select error: {resp.error}")
+    rows = _atividades(resp)
+    if depois_de_id is not None:
+        rows.reverse()
+    return rows
+
+def buscar_atividades_por_id(ids, somente_finalizadas: bool = False, colunas: str = COLUNAS_LISTAGEM,
+                             supabase_client: Client = None):
+    """
+    Atividades com os ids informados, em blocos de IDS_POR_REQUISICAO por
+    requisição. Com somente_finalizadas, só vêm as que já têm 'fim' (usado para
+    saber quais atividades abertas foram finalizadas em outro lugar).
+    """
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+    ids = sorted(set(ids))
+    rows = []
+    for i in range(0, len(ids), IDS_POR_REQUISICAO):
+        query = supabase_client.table(TABLE_NAME).select(colunas).in_("id", ids[i:i + IDS_POR_REQUISICAO])
+        if somente_finalizadas:
+            query = query.not_.is_("fim", None)
+        resp = _executar(query, "buscar_atividades_por_id", idempotente=True)
+        if getattr(resp, "error", None):
+            logger.error("Erro ao buscar atividades por id: %s", resp.error)
+            raise RuntimeError(f"Supabase select error: {resp.error}")
+        rows.extend(_atividades(resp))
+    return rows
+
+def iterar_atividades(user_id=None, tipo_atividade=None, ano=None, mes=None, dia=None,
+                      desde: date = None, ate: date = None, page_size: int = DEFAULT_PAGE_SIZE,
+                      colunas: str = COLUNAS_LISTAGEM, supabase_client: Client = None):
+    """
+    Gera as atividades (Atividade) da mais recente para a mais antiga,
+    paginando por 'id' (buscar_pagina_atividades).
+
+    A próxima página é buscada em segundo plano enquanto o chamador processa a
+    atual, então no máximo duas páginas ficam em memória.
+    """
+    if page_size <= 0:
+        raise ValueError("page_size deve ser positivo")
+    if not supabase_client:
+        supabase_client = get_supabase_client()
+
+    def buscar_pagina(antes_de_id):
+        return buscar_pagina_atividades(user_id, tipo_atividade, ano, mes, dia, desde, ate,
+                                        antes_de_id=antes_de_id, limite=page_size, colunas=colunas,
+                                        supabase_client=supabase_client)
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-prefetch")
+    try:
+        futuro = executor.submit(buscar_pagina, None)
+        while futuro is not None:
+            pagina = futuro.result()
+            futuro = None
+            if len(pagina) == page_size:
+                # pede a próxima página antes de entregar a atual
+                futuro = executor.submit(buscar_pagina, pagina[-1]["id"])
+            for row in pagina:
+                yield row
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,219 @@
+# historico.py
+"""
+Tela de histórico de atividades do usuário.
+
+A lista usa RecycleView: só as linhas visíveis viram widgets, e cada linha
+chega já formatada (texto pronto, formatado no worker), então rolar não faz
+nenhum parse na thread da UI. As páginas são buscadas por keyset
+(handle_db.buscar_pagina_atividades) quando a rolagem se aproxima do fim ou
+do começo da lista, e no máximo MAX_LINHAS_JANELA linhas ficam em memória:
+ao passar disso, as linhas da outra ponta são descartadas e buscadas de novo
+se o usuário voltar.
+
+Os totais de horas do filtro atual são calculados na réplica local do
+usuário (src/replica.py), que antes é sincronizada só com o que mudou. Sem
+conexão, valem os totais da última sincronização.
+"""
+
+import logging
+from datetime import datetime
+from kivy.clock import Clock
+from kivy.metrics import dp
+from kivy.properties import NumericProperty, StringProperty, ListProperty
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.screenmanager import Screen
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivymd.app import MDApp
+import src.handle_db as db
+import src.replica as replica
+from src.worker import executar_em_background
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_PAGINA = 100
+MAX_LINHAS_JANELA = 500
+ALTURA_LINHA = 44      # dp; deve bater com default_size do RecycleBoxLayout em historico.kv
+LIMIAR_ROLAGEM = 0.1   # fração da rolagem perto das pontas que dispara nova página
+COLUNAS_HISTORICO = "id, tipo_atividade, descricao, inicio, fim, horas_trabalhadas"
+
+TODOS_OS_TIPOS = "Todos os tipos"
+PERIODOS = ("Este mês", "Este ano", "Tudo")
+
+def formatar_horas(horas) -> str:
+    minutos = int(round(float(horas or 0) * 60))
+    return f"{minutos // 60}h{minutos % 60:02d}"
+
+def formatar_linha(row) -> dict:
+    """Atividade (handle_db) -> dados prontos para LinhaHistorico."""
+    inicio = row.inicio_dt
+    return {
+        "id": row["id"],
+        "data_hora": inicio.strftime("%d/%m/%Y %H:%M"),
+        "tipo": row.get("tipo_atividade") or "",
+        "duracao": formatar_horas(row.get("horas_trabalhadas")) if row.get("fim") else "em andamento",
+        "descricao": (row.get("descricao") or "").replace("\n", " "),
+    }
+
+def _buscar_pagina(filtros, **cursor):
+    rows = db.buscar_pagina_atividades(limite=TAMANHO_PAGINA, colunas=COLUNAS_HISTORICO, **filtros, **cursor)
+    return [formatar_linha(r) for r in rows]
+
+def _buscar_totais(filtros):
+    user_id = filtros["user_id"]
+    try:
+        replica.sincronizar(user_id)
+    except Exception as e:
+        if not replica.existe(user_id):
+            raise
+        logger.warning("Réplica local não sincronizada; totais podem estar desatualizados: %s", e)
+    itens = replica.relatorio_horas(agrupar_por="ano", **filtros)
+    return sum(float(i["horas_trabalhadas"]) for i in itens), sum(i["quantidade"] for i in itens)
+
+class LinhaHistorico(RecycleDataViewBehavior, BoxLayout):
+    index = NumericProperty(0)
+    data_hora = StringProperty("")
+    tipo = StringProperty("")
+    duracao = StringProperty("")
+    descricao = StringProperty("")
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        return super().refresh_view_attrs(rv, index, data)
+
+class HistoricoScreen(Screen):
+    tipos = ListProperty([TODOS_OS_TIPOS])
+    periodos = ListProperty(PERIODOS)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._geracao = 0          # incrementado a cada filtro novo: respostas antigas são descartadas
+        self._carregando = False
+        self._fim_antigas = False  # não há linhas mais antigas que a última da lista
+        self._topo = True          # a primeira linha da lista é a mais recente
+        self._aberta = False
+
+    def abrir(self, tipos_atividade=()):
+        self.tipos = [TODOS_OS_TIPOS] + list(tipos_atividade)
+        self._aberta = True
+        self.aplicar_filtro()
+
+    def voltar(self):
+        self._aberta = False
+        self._geracao += 1
+        self.ids.lista.data = []
+        MDApp.get_running_app().sm.current = 'main'
+
+    def _filtros(self):
+        hoje = datetime.now(db.TIMEZONE)
+        periodo = self.ids.periodo_spinner.text
+        tipo = self.ids.tipo_spinner.text
+        return {
+            "user_id": MDApp.get_running_app().user_id,
+            "tipo_atividade": None if tipo == TODOS_OS_TIPOS else tipo,
+            "ano": hoje.year if periodo in ("Este mês", "Este ano") else None,
+            "mes": hoje.month if periodo == "Este mês" else None,
+        }
+
+    def aplicar_filtro(self, *_):
+        if not self._aberta:
+            return  # on_text dos spinners durante a montagem do kv
+        self._geracao += 1
+        self._carregando = False
+        self._fim_antigas = False
+        self._topo = True
+        self.ids.lista.data = []
+        self.ids.lista.scroll_y = 1
+        self.ids.totais_label.text = "Calculando totais..."
+        filtros = self._filtros()
+        geracao = self._geracao
+
+        def on_totais(resultado):
+            if geracao == self._geracao:
+                horas, quantidade = resultado
+                self.ids.totais_label.text = f"Total: {formatar_horas(horas)} em {quantidade} atividade(s)"
+
+        def on_erro_totais(e):
+            if geracao == self._geracao:
+                self.ids.totais_label.text = "Totais indisponíveis."
+
+        executar_em_background(_buscar_totais, filtros, on_sucesso=on_totais, on_erro=on_erro_totais)
+        self._carregar_antigas()
+
+    def ao_rolar(self, scroll_y):
+        if self._carregando or not self.ids.lista.data:
+            return
+        if scroll_y <= LIMIAR_ROLAGEM and not self._fim_antigas:
+            self._carregar_antigas()
+        elif scroll_y >= 1 - LIMIAR_ROLAGEM and not self._topo:
+            self._carregar_recentes()
+
+    def _carregar(self, cursor, ao_receber):
+        self._carregando = True
+        self.ids.status_label.text = "Carregando..."
+        geracao = self._geracao
+
+        def on_sucesso(linhas):
+            if geracao != self._geracao:
+                return
+            ao_receber(linhas)
+            self._carregando = False
+            self._atualizar_status()
+
+        def on_erro(e):
+            if geracao != self._geracao:
+                return
+            self._carregando = False
+            self.ids.status_label.text = f"Falha ao carregar o histórico: {e}"
+
+        executar_em_background(_buscar_pagina, self._filtros(), **cursor, on_sucesso=on_sucesso, on_erro=on_erro)
+
+    def _carregar_antigas(self):
+        data = self.ids.lista.data
+        cursor = {"antes_de_id": data[-1]["id"]} if data else {}
+
+        def ao_receber(linhas):
+            self._fim_antigas = len(linhas) < TAMANHO_PAGINA
+            data = self.ids.lista.data
+            excesso = max(0, len(data) + len(linhas) - MAX_LINHAS_JANELA)
+            if excesso:
+                self._topo = False  # linhas do topo descartadas
+            self._substituir(data[excesso:] + linhas, -excesso)
+
+        self._carregar(cursor, ao_receber)
+
+    def _carregar_recentes(self):
+        cursor = {"depois_de_id": self.ids.lista.data[0]["id"]}
+
+        def ao_receber(linhas):
+            self._topo = len(linhas) < TAMANHO_PAGINA
+            data = self.ids.lista.data
+            excesso = max(0, len(data) + len(linhas) - MAX_LINHAS_JANELA)
+            if excesso:
+                self._fim_antigas = False
+            self._substituir(linhas + data[:len(data) - excesso], len(linhas))
+
+        self._carregar(cursor, ao_receber)
+
+    def _substituir(self, novas, delta_topo):
+        """
+        Troca os dados da lista mantendo na tela as mesmas linhas: delta_topo é
+        quantas linhas entraram (positivo) ou saíram (negativo) acima da vista.
+        """
+        rv = self.ids.lista
+        altura = dp(ALTURA_LINHA)
+        rolavel_antes = max(0.0, len(rv.data) * altura - rv.height)
+        deslocamento = (1 - rv.scroll_y) * rolavel_antes + delta_topo * altura
+        rv.data = novas
+        rolavel = len(novas) * altura - rv.height
+        scroll_y = 1 - deslocamento / rolavel if rolavel > 0 else 1
+        scroll_y = min(1.0, max(0.0, scroll_y))
+        # a altura do conteúdo só é recalculada no próximo frame
+        Clock.schedule_once(lambda dt: setattr(rv, "scroll_y", scroll_y))
+
+    def _atualizar_status(self):
+        if not self.ids.lista.data:
+            self.ids.status_label.text = "Nenhuma atividade no período."
+        elif self._fim_antigas:
+            self.ids.status_label.text = "Fim do histórico."
+        else:
+            self.ids.status_label.text = ""
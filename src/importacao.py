@@ -0,0 +1,316 @@
+# importacao.py
+"""
+Importação em massa de atividades históricas (planilhas, registros em papel
+digitados) a partir de CSV.
+
+As linhas são lidas em streaming, validadas e convertidas no mesmo formato
+gravado pelo app (ano/mes/dia do início no fuso TIMEZONE, horas_trabalhadas
+por calcular_horas_trabalhadas). Cada lote vai ao Supabase numa única
+requisição (handle_db.importar_lote), com vários lotes em paralelo.
+
+A 'chave' de cada linha é derivada do conteúdo (uuid5), e o upsert ignora
+chaves já existentes: reimportar o mesmo arquivo não duplica nada. Os lotes
+concluídos ficam num checkpoint ao lado do CSV, então uma importação
+interrompida continua de onde parou ao rodar o mesmo comando de novo.
+
+Colunas do CSV (cabeçalho obrigatório; ',' ';' ou tab):
+  tipo_atividade (ou tipo), inicio, fim, descricao (opcional),
+  user_id (ou usuario; opcional com --usuario), chave (opcional)
+Datas: ISO 8601 (2024-03-01 08:00[:00][-03:00]) ou dd/mm/aaaa HH:MM[:SS];
+sem fuso, são interpretadas em America/Sao_Paulo.
+
+Uso:
+    python -m src.importacao planilha_2019.csv --usuario joao
+    python -m src.importacao historico.csv --lote 2000 --workers 8 --rejeitados rejeitados.csv
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import src.handle_db as db
+from src.config import carregar_env
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TAMANHO_LOTE = 1000
+DEFAULT_WORKERS = 4
+SUFIXO_CHECKPOINT = ".importacao.json"
+NAMESPACE_CHAVE = uuid.uuid5(uuid.NAMESPACE_URL, "registro-atividades/importacao")
+FORMATOS_DATA = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M")
+ALIASES_COLUNAS = {"tipo": "tipo_atividade", "usuario": "user_id"}
+
+class LinhaInvalida(ValueError):
+    def __init__(self, linha: int, motivo: str):
+        super().__init__(f"linha {linha}: {motivo}")
+        self.linha = linha
+        self.motivo = motivo
+
+def parse_data_hora(texto: str) -> datetime:
+    """Data/hora do CSV em datetime com fuso (TIMEZONE quando o texto não traz fuso)."""
+    texto = (texto or "").strip()
+    if not texto:
+        raise ValueError("vazio")
+    try:
+        valor = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+    except ValueError:
+        for formato in FORMATOS_DATA:
+            try:
+                valor = datetime.strptime(texto, formato)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"data/hora inválida: {texto!r}")
+    if valor.tzinfo is None:
+        return db.TIMEZONE.localize(valor)
+    return valor.astimezone(db.TIMEZONE)
+
+def gerar_chave_importacao(user_id, tipo, inicio: datetime, fim: datetime) -> str:
+    """Chave determinística: a mesma atividade gera sempre a mesma chave."""
+    return uuid.uuid5(NAMESPACE_CHAVE, f"{user_id}|{tipo}|{inicio.isoformat()}|{fim.isoformat()}").hex
+
+def montar_linha(registro: dict, numero: int, user_id_padrao=None) -> dict:
+    """Valida um registro do CSV e devolve a linha no formato da tabela."""
+    tipo = (registro.get("tipo_atividade") or "").strip()
+    if not tipo:
+        raise LinhaInvalida(numero, "tipo_atividade vazio")
+    user_id = (registro.get("user_id") or "").strip() or user_id_padrao
+    if not user_id:
+        raise LinhaInvalida(numero, "user_id vazio (use --usuario para um valor padrão)")
+    try:
+        inicio = parse_data_hora(registro.get("inicio"))
+    except ValueError as e:
+        raise LinhaInvalida(numero, f"inicio: {e}") from None
+    try:
+        fim = parse_data_hora(registro.get("fim"))
+    except ValueError as e:
+        raise LinhaInvalida(numero, f"fim: {e}") from None
+    if fim < inicio:
+        raise LinhaInvalida(numero, "fim anterior ao inicio")
+
+    descricao = (registro.get("descricao") or "").strip()
+    chave = (registro.get("chave") or "").strip() or gerar_chave_importacao(user_id, tipo, inicio, fim)
+    linha = db.montar_payload_inicio(tipo, descricao, user_id, inicio, chave)
+    linha["fim"] = fim.isoformat()
+    linha["horas_trabalhadas"] = db.calcular_horas_trabalhadas(inicio, fim)
+    return linha
+
+def _detectar_dialeto(arquivo):
+    amostra = arquivo.read(8192)
+    arquivo.seek(0)
+    try:
+        return csv.Sniffer().sniff(amostra, delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+def ler_csv(arquivo, user_id_padrao=None, delimitador=None):
+    """
+    Gera (numero_da_linha, linha | LinhaInvalida) para cada registro do CSV.
+    'arquivo' é um arquivo texto aberto com newline="".
+    """
+    if delimitador:
+        reader = csv.DictReader(arquivo, delimiter=delimitador)
+    else:
+        reader = csv.DictReader(arquivo, dialect=_detectar_dialeto(arquivo))
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [ALIASES_COLUNAS.get(c.strip().lower(), c.strip().lower()) for c in reader.fieldnames]
+    faltando = {"tipo_atividade", "inicio", "fim"} - set(reader.fieldnames)
+    if faltando:
+        raise ValueError(f"colunas obrigatórias ausentes no CSV: {', '.join(sorted(faltando))}")
+    for registro in reader:
+        numero = reader.line_num
+        try:
+            yield numero, montar_linha(registro, numero, user_id_padrao)
+        except LinhaInvalida as e:
+            yield numero, e
+
+class Checkpoint:
+    """Lotes já gravados de um arquivo, persistidos em JSON (escrita atômica)."""
+
+    def __init__(self, caminho, arquivo_csv, tamanho_lote: int):
+        self.caminho = caminho
+        stat = os.stat(arquivo_csv)
+        self._identidade = {
+            "arquivo": os.path.abspath(arquivo_csv), "tamanho": stat.st_size,
+            "mtime": stat.st_mtime, "tamanho_lote": tamanho_lote,
+        }
+        self._lock = threading.Lock()
+        self.concluidos = set()
+        if caminho and os.path.exists(caminho):
+            try:
+                with open(caminho, "r", encoding="utf-8") as f:
+                    dados = json.load(f)
+            except (OSError, ValueError):
+                dados = {}
+            if all(dados.get(k) == v for k, v in self._identidade.items()):
+                self.concluidos = set(dados.get("lotes_concluidos", []))
+            else:
+                logger.warning("Checkpoint %s é de outro arquivo/tamanho de lote; ignorado.", caminho)
+
+    def concluir(self, indice: int):
+        if not self.caminho:
+            return
+        with self._lock:
+            self.concluidos.add(indice)
+            dados = dict(self._identidade, lotes_concluidos=sorted(self.concluidos))
+            tmp = self.caminho + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(dados, f)
+            os.replace(tmp, self.caminho)
+
+    def remover(self):
+        if self.caminho and os.path.exists(self.caminho):
+            os.remove(self.caminho)
+
+def importar_csv(caminho, user_id_padrao=None, tamanho_lote: int = DEFAULT_TAMANHO_LOTE,
+                 workers: int = DEFAULT_WORKERS, usar_checkpoint: bool = True, rejeitados=None,
+                 delimitador=None, encoding: str = "utf-8-sig", progresso=None, supabase_client=None):
+    """
+    Importa o CSV 'caminho'. Linhas inválidas não interrompem a importação:
+    são contadas e, se 'rejeitados' (caminho) for dado, gravadas lá com o motivo.
+    progresso(estatisticas) é chamado após cada lote gravado.
+
+    Retorna as estatísticas:
+      {linhas_lidas, enviadas, importadas, rejeitadas, lotes, lotes_pulados, segundos, linhas_por_segundo}
+    'enviadas' são as linhas válidas mandadas ao Supabase; 'importadas', as que
+    de fato entraram (chaves já existentes são ignoradas pelo upsert).
+    Em caso de falha de um lote levanta RuntimeError; rodar de novo continua do checkpoint.
+    """
+    if tamanho_lote <= 0:
+        raise ValueError("tamanho_lote deve ser positivo")
+    workers = max(1, workers)
+    checkpoint = Checkpoint(caminho + SUFIXO_CHECKPOINT if usar_checkpoint else None, caminho, tamanho_lote)
+    stats = {"linhas_lidas": 0, "enviadas": 0, "importadas": 0, "rejeitadas": 0, "lotes": 0, "lotes_pulados": 0}
+    stats_lock = threading.Lock()
+    inicio = time.perf_counter()
+
+    def enviar(indice, lote):
+        inseridas = db.importar_lote(lote, supabase_client=supabase_client)
+        checkpoint.concluir(indice)
+        with stats_lock:
+            stats["enviadas"] += len(lote)
+            stats["importadas"] += inseridas
+            stats["lotes"] += 1
+            atual = _com_taxa(stats, inicio)
+        if progresso is not None:
+            progresso(atual)
+
+    saida_rejeitados = open(rejeitados, "w", encoding="utf-8", newline="") if rejeitados else None
+    escritor_rejeitados = csv.writer(saida_rejeitados) if saida_rejeitados else None
+    if escritor_rejeitados:
+        escritor_rejeitados.writerow(["linha", "motivo"])
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="importacao")
+    pendentes = set()
+    falha = None
+
+    def coletar():
+        nonlocal pendentes, falha
+        prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+        for futuro in prontos:
+            if futuro.exception() is not None and falha is None:
+                falha = futuro.exception()
+
+    try:
+        with open(caminho, "r", encoding=encoding, newline="") as arquivo:
+            lote, indice = [], 0
+            for numero, linha in ler_csv(arquivo, user_id_padrao, delimitador):
+                stats["linhas_lidas"] += 1
+                if isinstance(linha, LinhaInvalida):
+                    stats["rejeitadas"] += 1
+                    if escritor_rejeitados:
+                        escritor_rejeitados.writerow([numero, linha.motivo])
+                    continue
+                lote.append(linha)
+                if len(lote) < tamanho_lote:
+                    continue
+                if indice in checkpoint.concluidos:
+                    stats["lotes_pulados"] += 1
+                else:
+                    # no máximo 2 lotes por worker em memória
+                    while len(pendentes) >= workers * 2 and falha is None:
+                        coletar()
+                    if falha is not None:
+                        break
+                    pendentes.add(executor.submit(enviar, indice, lote))
+                lote, indice = [], indice + 1
+            else:
+                if lote:
+                    if indice in checkpoint.concluidos:
+                        stats["lotes_pulados"] += 1
+                    else:
+                        pendentes.add(executor.submit(enviar, indice, lote))
+        while pendentes:
+            coletar()
+    finally:
+        executor.shutdown(wait=True)
+        if saida_rejeitados:
+            saida_rejeitados.close()
+
+    if falha is not None:
+        raise RuntimeError(f"Importação interrompida: {falha}. Rode o mesmo comando para continuar.") from falha
+    checkpoint.remover()
+    return _com_taxa(stats, inicio)
+
+def _com_taxa(stats, inicio):
+    segundos = time.perf_counter() - inicio
+    resultado = dict(stats)
+    resultado["segundos"] = round(segundos, 3)
+    resultado["linhas_por_segundo"] = round(stats["enviadas"] / segundos, 1) if segundos > 0 else 0.0
+    return resultado
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m src.importacao",
+                                     description="Importa atividades históricas de um CSV.")
+    parser.add_argument("arquivo", help="CSV com tipo_atividade, inicio, fim [, descricao, user_id]")
+    parser.add_argument("--usuario", help="user_id das linhas sem essa coluna")
+    parser.add_argument("--lote", type=int, default=DEFAULT_TAMANHO_LOTE, help="linhas por requisição")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="lotes enviados em paralelo")
+    parser.add_argument("--rejeitados", help="grava as linhas inválidas (linha, motivo) neste CSV")
+    parser.add_argument("--delimitador", help="padrão: detectado (',' ';' ou tab)")
+    parser.add_argument("--encoding", default="utf-8-sig")
+    parser.add_argument("--sem-checkpoint", action="store_true", help="não grava/retoma o checkpoint")
+    return parser.parse_args(args)
+
+def main(args) -> int:
+    opts = _parse_args(args)
+    carregar_env()
+    ultimo = [0.0]
+
+    def progresso(stats):
+        agora = time.monotonic()
+        if agora - ultimo[0] >= 2:
+            ultimo[0] = agora
+            print(f"{stats['enviadas']} linha(s) enviada(s) ({stats['linhas_por_segundo']:.0f} linhas/s)...",
+                  file=sys.stderr)
+
+    try:
+        stats = importar_csv(
+            opts.arquivo, user_id_padrao=opts.usuario, tamanho_lote=opts.lote, workers=opts.workers,
+            usar_checkpoint=not opts.sem_checkpoint, rejeitados=opts.rejeitados,
+            delimitador=opts.delimitador, encoding=opts.encoding, progresso=progresso,
+        )
+    except (RuntimeError, ValueError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"{stats['importadas']} atividade(s) importada(s) de {stats['enviadas']} enviada(s) "
+        f"em {stats['segundos']:.2f}s "
+        f"({stats['linhas_por_segundo']:.0f} linhas/s, {stats['lotes']} lote(s)"
+        f"{', %d já importado(s)' % stats['lotes_pulados'] if stats['lotes_pulados'] else ''}); "
+        f"{stats['rejeitadas']} linha(s) rejeitada(s).",
+        file=sys.stderr,
+    )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,407 @@
+# journal.py
+"""
+Journal local (SQLite) para início/fim de atividades, com sincronização em
+segundo plano para o Supabase.
+
+Os eventos são gravados primeiro no disco local, então a UI responde mesmo
+com o Supabase lento ou fora do ar. O Sincronizador reenvia as linhas
+pendentes em lotes usando a 'chave' gerada no cliente, de modo que repetir
+um envio nunca cria linhas duplicadas.
+
+Um fim gravado antes no Supabase (outro terminal, fechar_atividades_abandonadas)
+prevalece: o fim de uma atividade já enviada vai com 'fim IS NULL' no filtro
+e, se nada mudar lá, o journal adota o fim remoto. O Sincronizador também
+confere de tempos em tempos as atividades abertas localmente
+(conferir_abertas), sem atrasar buscar_em_andamento, que só lê o disco
+quando há algo aberto localmente.
+"""
+
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+import src.handle_db as db
+from src.storage import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = "journal.sqlite3"
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_SYNC_INTERVAL = 15.0  # segundos entre tentativas de sincronização
+DEFAULT_CONFERENCIA_INTERVAL = 300.0  # segundos entre conferências das abertas no Supabase
+
+CREATE_JOURNAL_SQL = """
+CREATE TABLE IF NOT EXISTS atividades_locais (
+  chave TEXT PRIMARY KEY,
+  remote_id INTEGER,
+  user_id TEXT,
+  tipo_atividade TEXT NOT NULL,
+  descricao TEXT,
+  inicio TEXT NOT NULL,
+  fim TEXT,
+  ano INTEGER,
+  mes INTEGER,
+  dia INTEGER,
+  horas_trabalhadas REAL,
+  pendente INTEGER NOT NULL DEFAULT 1,
+  versao INTEGER NOT NULL DEFAULT 0,
+  sincronizar_por_id INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_locais_abertas ON atividades_locais (user_id) WHERE fim IS NULL;
+CREATE INDEX IF NOT EXISTS idx_locais_pendentes ON atividades_locais (pendente) WHERE pendente = 1;
+"""
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+def get_journal_path():
+    return get_app_data_dir() / JOURNAL_FILENAME
+
+def _connect(path=None):
+    path = str(path or get_journal_path())
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    if path not in _initialized_paths:
+        with _init_lock:
+            if path not in _initialized_paths:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(CREATE_JOURNAL_SQL)
+                _initialized_paths.add(path)
+    return conn
+
+def _row_to_dict(row):
+    if row is None:
+        return None
+    d = dict(row)
+    d["id"] = d.pop("remote_id")
+    d.pop("pendente", None)
+    d.pop("versao", None)
+    d.pop("sincronizar_por_id", None)
+    return d
+
+def _row_para_sincronizar(row):
+    """
+    Linha a enviar ao Supabase. O 'id' remoto só vai junto quando a linha
+    remota ainda não tem 'chave' (atividade aberta antes do journal); as demais
+    são enviadas pela chave, no mesmo upsert.
+    """
+    d = _row_to_dict(row)
+    if not row["sincronizar_por_id"]:
+        d["id"] = None
+    return d
+
+def registrar_inicio(tipo, descricao, user_id, path=None):
+    """Grava o início de uma atividade no journal e retorna a linha local."""
+    hora_inicio = datetime.now(db.TIMEZONE)
+    row = db.montar_payload_inicio(tipo, descricao, user_id, hora_inicio, db.gerar_chave())
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO atividades_locais (chave, user_id, tipo_atividade, descricao, inicio, ano, mes, dia) "
+                "VALUES (:chave, :user_id, :tipo_atividade, :descricao, :inicio, :ano, :mes, :dia)",
+                row,
+            )
+    finally:
+        conn.close()
+    notificar_sincronizador()
+    row["id"] = None
+    return row
+
+def registrar_fim(chave, path=None):
+    """Grava o fim da atividade 'chave' calculando horas_trabalhadas a partir do início local."""
+    conn = _connect(path)
+    try:
+        with conn:
+            row = conn.execute(
+                "SELECT inicio, fim FROM atividades_locais WHERE chave = ?", (chave,)
+            ).fetchone()
+            if row is None:
+                raise RuntimeError("Atividade não encontrada.")
+            if row["fim"] is not None:
+                return True  # já finalizada
+            fim = datetime.now(db.TIMEZONE)
+            horas = db.calcular_horas_trabalhadas(db.parse_datetime(row["inicio"]), fim)
+            conn.execute(
+                "UPDATE atividades_locais SET fim = ?, horas_trabalhadas = ?, "
+                "pendente = 1, versao = versao + 1 WHERE chave = ?",
+                (fim.isoformat(), horas, chave),
+            )
+    finally:
+        conn.close()
+    notificar_sincronizador()
+    return True
+
+def registrar_troca(chave_atual, tipo, descricao, user_id, path=None):
+    """
+    Finaliza 'chave_atual' e inicia 'tipo' numa única transação local, com o
+    mesmo instante como fim de uma e início da outra. O sincronizador envia as
+    duas linhas no mesmo upsert. Retorna a nova linha.
+    """
+    agora = datetime.now(db.TIMEZONE)
+    nova = db.montar_payload_inicio(tipo, descricao, user_id, agora, db.gerar_chave())
+    conn = _connect(path)
+    try:
+        with conn:
+            atual = conn.execute(
+                "SELECT inicio, fim FROM atividades_locais WHERE chave = ?", (chave_atual,)
+            ).fetchone()
+            if atual is None:
+                raise RuntimeError("Atividade não encontrada.")
+            if atual["fim"] is None:
+                horas = db.calcular_horas_trabalhadas(db.parse_datetime(atual["inicio"]), agora)
+                conn.execute(
+                    "UPDATE atividades_locais SET fim = ?, horas_trabalhadas = ?, "
+                    "pendente = 1, versao = versao + 1 WHERE chave = ?",
+                    (agora.isoformat(), horas, chave_atual),
+                )
+            conn.execute(
+                "INSERT INTO atividades_locais (chave, user_id, tipo_atividade, descricao, inicio, ano, mes, dia) "
+                "VALUES (:chave, :user_id, :tipo_atividade, :descricao, :inicio, :ano, :mes, :dia)",
+                nova,
+            )
+    finally:
+        conn.close()
+    notificar_sincronizador()
+    nova["id"] = None
+    return nova
+
+def _importar_remota(conn, remota):
+    """Guarda no journal uma atividade aberta que veio do Supabase (já sincronizada)."""
+    chave = remota.get("chave") or db.gerar_chave()
+    conn.execute(
+        "INSERT OR IGNORE INTO atividades_locais "
+        "(chave, remote_id, user_id, tipo_atividade, descricao, inicio, ano, mes, dia, pendente, sincronizar_por_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+        (chave, remota.get("id"), remota.get("user_id"), remota.get("tipo_atividade"),
+         remota.get("descricao"), remota.get("inicio"), remota.get("ano"),
+         remota.get("mes"), remota.get("dia"), 0 if remota.get("chave") else 1),
+    )
+    return chave
+
+def _finalizadas_no_servidor(remote_ids):
+    """{remote_id: linha remota} das atividades que já têm 'fim' no Supabase."""
+    remote_ids = [i for i in remote_ids if i is not None]
+    if not remote_ids:
+        return {}
+    remotas = db.buscar_atividades_por_id(remote_ids, somente_finalizadas=True,
+                                          colunas="id, fim, horas_trabalhadas")
+    return {r["id"]: r for r in remotas}
+
+def _adotar_fim_remoto(conn, chave, remota, versao=None):
+    """Grava no journal o fim que o Supabase já tem (ex.: fechada por fechar_atividades_abandonadas)."""
+    sql = ("UPDATE atividades_locais SET fim = ?, horas_trabalhadas = ?, pendente = 0, "
+           "sincronizar_por_id = 0, versao = versao + 1 WHERE chave = ?")
+    params = [remota["fim"], remota["horas_trabalhadas"], chave]
+    if versao is not None:
+        sql += " AND versao = ?"  # não descarta uma alteração local feita durante o envio
+        params.append(versao)
+    conn.execute(sql, params)
+
+def buscar_em_andamento(user_id, path=None):
+    """
+    Retorna a atividade aberta do usuário lendo primeiro o journal local.
+    Só consulta o Supabase quando não há nada aberto localmente (ex.: atividade
+    iniciada em outro terminal); se o Supabase estiver inacessível, retorna None.
+    Atividades finalizadas no Supabase por outro caminho são conferidas em
+    segundo plano (conferir_abertas, no Sincronizador).
+    """
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT * FROM atividades_locais WHERE user_id = ? AND fim IS NULL "
+            "ORDER BY inicio DESC LIMIT 1",
+            (user_id,),
+        ).fetchone()
+        if row is not None:
+            return _row_to_dict(row)
+
+        try:
+            remota = db.buscar_atividade_em_andamento(user_id)
+        except Exception as e:
+            logger.warning("Supabase indisponível ao buscar atividade em andamento: %s", e)
+            return None
+        if not remota:
+            return None
+
+        with conn:
+            if remota.get("chave"):
+                local = conn.execute(
+                    "SELECT fim FROM atividades_locais WHERE chave = ?", (remota["chave"],)
+                ).fetchone()
+                if local is not None and local["fim"] is not None:
+                    return None  # finalizada localmente, sincronização pendente
+            if remota.get("id") is not None:
+                local = conn.execute(
+                    "SELECT fim FROM atividades_locais WHERE remote_id = ?", (remota["id"],)
+                ).fetchone()
+                if local is not None and local["fim"] is not None:
+                    return None
+            chave = _importar_remota(conn, remota)
+        return _row_to_dict(conn.execute(
+            "SELECT * FROM atividades_locais WHERE chave = ?", (chave,)
+        ).fetchone())
+    finally:
+        conn.close()
+
+def conferir_abertas(path=None):
+    """
+    Confere no Supabase, numa requisição, as atividades abertas no journal que
+    já foram enviadas; as que foram finalizadas lá (outro terminal,
+    fechar_atividades_abandonadas) adotam o fim remoto. Roda no Sincronizador,
+    fora do caminho da UI. Retorna quantas foram atualizadas.
+    """
+    conn = _connect(path)
+    try:
+        abertas = conn.execute(
+            "SELECT chave, remote_id, versao FROM atividades_locais "
+            "WHERE fim IS NULL AND remote_id IS NOT NULL AND pendente = 0"
+        ).fetchall()
+    finally:
+        conn.close()
+    if not abertas:
+        return 0
+    fechadas = _finalizadas_no_servidor(r["remote_id"] for r in abertas)
+    if not fechadas:
+        return 0
+    conn = _connect(path)
+    try:
+        with conn:
+            for r in abertas:
+                if r["remote_id"] in fechadas:
+                    _adotar_fim_remoto(conn, r["chave"], fechadas[r["remote_id"]], r["versao"])
+    finally:
+        conn.close()
+    logger.info("Journal: %d atividade(s) já finalizada(s) no Supabase.", len(fechadas))
+    return len(fechadas)
+
+def contar_pendentes(path=None):
+    conn = _connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM atividades_locais WHERE pendente = 1").fetchone()[0]
+    finally:
+        conn.close()
+
+def sincronizar_pendentes(batch_size: int = DEFAULT_BATCH_SIZE, path=None):
+    """
+    Envia ao Supabase as linhas pendentes, em lotes de até batch_size.
+    Retorna o número de linhas sincronizadas. Erros de rede propagam.
+    """
+    total = 0
+    while True:
+        conn = _connect(path)
+        try:
+            pendentes = conn.execute(
+                "SELECT * FROM atividades_locais WHERE pendente = 1 ORDER BY inicio LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+        finally:
+            conn.close()
+        if not pendentes:
+            return total
+
+        versoes = {r["chave"]: r["versao"] for r in pendentes}
+        # fim de atividade já enviada: UPDATE guardado por 'fim IS NULL' (um fim
+        # gravado antes no Supabase prevalece); o resto vai no upsert por chave
+        fechamentos = [r for r in pendentes if r["fim"] is not None and r["remote_id"] is not None]
+        envio = [r for r in pendentes if r["fim"] is None or r["remote_id"] is None]
+        sem_efeito = [
+            r for r in fechamentos
+            if db.gravar_fim_sincronizado(r["remote_id"], r["fim"], r["horas_trabalhadas"],
+                                          chave=r["chave"] if r["sincronizar_por_id"] else None) is None
+        ]
+        gravadas = db.sincronizar_atividades([_row_para_sincronizar(r) for r in envio])
+        ids_por_chave = {g.get("chave"): g.get("id") for g in gravadas if g.get("chave")}
+        # nada mudou no Supabase: já finalizada lá (adota o fim remoto) ou apagada
+        remotas = {r["id"]: r for r in db.buscar_atividades_por_id(
+            [r["remote_id"] for r in sem_efeito], colunas="id, fim, horas_trabalhadas")} if sem_efeito else {}
+
+        conn = _connect(path)
+        try:
+            with conn:
+                for r in sem_efeito:
+                    remota = remotas.get(r["remote_id"])
+                    if remota is None:
+                        # apagada no Supabase: não é recriada, só deixa de ficar pendente
+                        logger.warning("Atividade %s não existe mais no Supabase; fim local não enviado.",
+                                       r["remote_id"])
+                        continue
+                    if remota["fim"] is not None:
+                        _adotar_fim_remoto(conn, r["chave"], remota, r["versao"])
+                    versoes.pop(r["chave"])  # ainda aberta lá (corrida): tenta de novo depois
+                for chave, versao in versoes.items():
+                    # só limpa 'pendente' se a linha não mudou durante o envio
+                    conn.execute(
+                        "UPDATE atividades_locais SET pendente = 0, sincronizar_por_id = 0, "
+                        "remote_id = COALESCE(?, remote_id) WHERE chave = ? AND versao = ?",
+                        (ids_por_chave.get(chave), chave, versao),
+                    )
+        finally:
+            conn.close()
+        total += len(pendentes)
+        if len(pendentes) < batch_size:
+            return total
+
+class Sincronizador(threading.Thread):
+    """Thread que reenvia periodicamente o journal para o Supabase."""
+
+    def __init__(self, intervalo: float = DEFAULT_SYNC_INTERVAL, batch_size: int = DEFAULT_BATCH_SIZE, path=None,
+                 intervalo_conferencia: float = DEFAULT_CONFERENCIA_INTERVAL):
+        super().__init__(name="journal-sync", daemon=True)
+        self.intervalo = intervalo
+        self.batch_size = batch_size
+        self.path = path
+        self.intervalo_conferencia = intervalo_conferencia
+        self._proxima_conferencia = 0.0  # a primeira volta já confere
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+
+    def notificar(self):
+        """Pede uma sincronização imediata (ex.: após gravar um evento)."""
+        self._acordar.set()
+
+    def parar(self, timeout: float = None):
+        self._parar.set()
+        self._acordar.set()
+        if timeout is not None:
+            self.join(timeout)
+
+    def run(self):
+        while not self._parar.is_set():
+            self._acordar.clear()
+            try:
+                enviados = sincronizar_pendentes(self.batch_size, self.path)
+                if enviados:
+                    logger.info("Journal: %d atividade(s) sincronizada(s).", enviados)
+                if time.monotonic() >= self._proxima_conferencia:
+                    conferir_abertas(self.path)
+                    self._proxima_conferencia = time.monotonic() + self.intervalo_conferencia
+            except Exception as e:
+                logger.warning("Journal: falha ao sincronizar (nova tentativa em %ss): %s", self.intervalo, e)
+            self._acordar.wait(self.intervalo)
+
+_sincronizador = None
+_sinc_lock = threading.Lock()
+
+def iniciar_sincronizador(intervalo: float = DEFAULT_SYNC_INTERVAL):
+    """Inicia (uma única vez) a thread de sincronização do journal."""
+    global _sincronizador
+    with _sinc_lock:
+        if _sincronizador is None or not _sincronizador.is_alive():
+            _sincronizador = Sincronizador(intervalo)
+            _sincronizador.start()
+        return _sincronizador
+
+def notificar_sincronizador():
+    sinc = _sincronizador
+    if sinc is not None:
+        sinc.notificar()
+
+def parar_sincronizador(timeout: float = 2.0):
+    global _sincronizador
+    with _sinc_lock:
+        sinc = _sincronizador
+        _sincronizador = None
+    if sinc is not None:
+        sinc.parar(timeout)
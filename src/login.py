@@ -1,37 +1,111 @@
 # login.py
 import os
-import sys
 import json
+import time
 import base64
 import hashlib
+import logging
 import secrets
-from pathlib import Path
+import threading
 from kivy.uix.screenmanager import Screen
 from kivy.uix.popup import Popup
 from kivy.uix.label import Label
 from kivy.app import App
 from kivy.core.window import Window
+from src.storage import get_app_data_dir
+import src.user_store as user_store
+from src.worker import executar_em_background, get_worker
+
+logger = logging.getLogger(__name__)
 
 # local storage path para credenciais (persistente)
 def get_user_store_path():
     """
-    Retorna o caminho completo para o ficheiro users.json onde guardamos
-    as credenciais (salt + hash). Diretório padrão:
+    Retorna o caminho do antigo ficheiro users.json. As credenciais (salt +
+    hash) agora ficam em users.sqlite3 na mesma pasta (ver src/user_store.py);
+    o users.json é importado automaticamente. Diretório padrão:
       Windows: %APPDATA%/RegistroAtividades/users.json
       Linux/Mac: ~/.local/share/RegistroAtividades/users.json
     """
-    if sys.platform.startswith("win"):
-        base = os.getenv("APPDATA") or Path.home()
-    elif sys.platform == "darwin":
-        base = Path.home() / "Library" / "Application Support"
-    else:
-        base = Path.home() / ".local" / "share"
-    folder = Path(base) / "RegistroAtividades"
-    folder.mkdir(parents=True, exist_ok=True)
-    return folder / "users.json"
+    return get_app_data_dir() / "users.json"
+
+# Custo do PBKDF2: calibrado por máquina para ~PBKDF2_TEMPO_ALVO segundos,
+# nunca abaixo de MIN_ITERATIONS. A calibração é guardada em disco para que o
+# alvo não mude a cada execução (o que forçaria rehash em todo login).
+DEFAULT_ITERATIONS = 200_000
+MIN_ITERATIONS = 100_000
+DEFAULT_TEMPO_ALVO = 0.25  # segundos
+CALIBRACAO_FILENAME = "pbkdf2_calibracao.json"
+_AMOSTRA_ITERACOES = 20_000
+
+_iteracoes_alvo = None
+_calibracao_lock = threading.Lock()
+
+def _medir_iteracoes_alvo(tempo_alvo: float):
+    inicio = time.perf_counter()
+    hashlib.pbkdf2_hmac('sha256', b"calibracao", b"0123456789abcdef", _AMOSTRA_ITERACOES)
+    decorrido = max(time.perf_counter() - inicio, 1e-6)
+    iteracoes = int(_AMOSTRA_ITERACOES * tempo_alvo / decorrido)
+    iteracoes = (iteracoes // 10_000) * 10_000  # arredonda para múltiplo de 10k
+    return max(MIN_ITERATIONS, iteracoes)
+
+def _ler_calibracao(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return max(MIN_ITERATIONS, int(json.load(f)["iters"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _gravar_calibracao(path, iteracoes, tempo_alvo):
+    # grava num temporário e troca de uma vez: outra instância do app nunca lê o arquivo pela metade
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"iters": iteracoes, "tempo_alvo": tempo_alvo}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Não foi possível salvar a calibração do PBKDF2: %s", e)
+
+def calibrar_iteracoes(tempo_alvo: float = None, forcar: bool = False):
+    """
+    Define o número de iterações do PBKDF2 para esta máquina (chamado em
+    background na inicialização). Usa o valor salvo em disco, se houver; a
+    medição roda uma vez por processo, sob _calibracao_lock.
+    """
+    global _iteracoes_alvo
+    with _calibracao_lock:
+        path = get_app_data_dir() / CALIBRACAO_FILENAME
+        if not forcar and _iteracoes_alvo is not None:
+            return _iteracoes_alvo
+        if not forcar:
+            salvo = _ler_calibracao(path)
+            if salvo is not None:
+                _iteracoes_alvo = salvo
+                return _iteracoes_alvo
+        if tempo_alvo is None:
+            try:
+                tempo_alvo = float(os.environ.get("PBKDF2_TEMPO_ALVO", DEFAULT_TEMPO_ALVO))
+            except ValueError:
+                tempo_alvo = DEFAULT_TEMPO_ALVO
+        iteracoes = _medir_iteracoes_alvo(tempo_alvo)
+        # outra instância pode ter calibrado enquanto medíamos: vale a que já está em disco
+        salvo = None if forcar else _ler_calibracao(path)
+        if salvo is not None:
+            _iteracoes_alvo = salvo
+            return _iteracoes_alvo
+        _gravar_calibracao(path, iteracoes, tempo_alvo)
+        _iteracoes_alvo = iteracoes
+        logger.info("PBKDF2 calibrado: %d iterações (~%.2fs).", _iteracoes_alvo, tempo_alvo)
+        return _iteracoes_alvo
+
+def get_iteracoes_alvo():
+    """Iterações a usar em novos hashes (DEFAULT_ITERATIONS até a calibração terminar)."""
+    return _iteracoes_alvo or DEFAULT_ITERATIONS
 
 # Hashing seguro: PBKDF2-HMAC-SHA256
-def hash_password(password: str, salt: bytes = None, iterations: int = 200_000):
+def hash_password(password: str, salt: bytes = None, iterations: int = None):
+    if iterations is None:
+        iterations = get_iteracoes_alvo()
     if salt is None:
         salt = secrets.token_bytes(16)
     pwd = password.encode('utf-8')
@@ -48,51 +122,112 @@ def verify_password(password: str, salt_b64: str, hash_b64: str, iterations: int
     dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
     return secrets.compare_digest(dk, expected)
 
+def verificar_credenciais(username: str, password: str):
+    """
+    Verifica usuário/senha (roda no worker, fora da thread do Kivy).
+    Retorna 'ok', 'nao_encontrado' ou 'senha_incorreta'. Se a senha confere e
+    o hash usa menos iterações que o alvo desta máquina, o hash é refeito com
+    o custo atual (nunca é rebaixado: logins em máquinas mais lentas, ou antes
+    da calibração terminar, não desfazem um hash mais forte).
+    """
+    try:
+        record = user_store.buscar_usuario(username)
+    except Exception:
+        record = None
+    if not record:
+        return "nao_encontrado"
+
+    iters = int(record.get("iters", DEFAULT_ITERATIONS))
+    try:
+        ok = verify_password(password, record["salt"], record["hash"], iters)
+    except Exception:
+        ok = False
+    if not ok:
+        return "senha_incorreta"
+
+    alvo = get_iteracoes_alvo()
+    if iters < alvo:
+        try:
+            user_store.atualizar_usuario(username, hash_password(password, iterations=alvo), iters_anteriores=iters)
+        except Exception as e:
+            logger.warning("Falha ao atualizar hash do usuário '%s': %s", username, e)
+    return "ok"
+
+# handle_db/journal (supabase, pytz) são importados sob demanda, nas threads
+# do worker, para não atrasar a exibição da tela de login
+def _aquecer_conexao():
+    import src.handle_db as db
+    db.aquecer_conexao()
+
+def _buscar_em_andamento(username):
+    import src.journal as journal
+    return journal.buscar_em_andamento(username)
+
 def load_users():
-    path = get_user_store_path()
-    if not path.exists():
-        return {}  # vazio
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return user_store.carregar_todos()
     except Exception:
         return {}
 
 def save_users(users: dict):
-    path = get_user_store_path()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    user_store.salvar_todos(users)
 
 # LoginScreen com botão de criação de conta
 class LoginScreen(Screen):
+    verificando = False  # True enquanto o hash da senha está sendo verificado
+
     def fazer_login(self, username, password):
+        if self.verificando:
+            return  # ignora Enter/cliques repetidos
         username = (username or "").strip()
         password = (password or "").strip()
         if not username or not password:
             self.show_error("Por favor, preencha todos os campos.")
             return
 
-        users = load_users()
-        record = users.get(username)
-        if not record:
+        self.verificando = True
+
+        # enquanto o hash é verificado, já abre a conexão com o Supabase e busca
+        # a atividade em andamento do usuário digitado (login em max(hash, rede));
+        # o resultado só é usado se a senha conferir, senão é descartado
+        executar_em_background(_aquecer_conexao)
+        prefetch = get_worker().submit(_buscar_em_andamento, username)
+
+        def on_sucesso(resultado):
+            self.verificando = False
+            self._concluir_login(username, resultado, prefetch)
+
+        def on_erro(e):
+            self.verificando = False
+            prefetch.cancel()
+            self.show_error(f"Falha ao verificar login:\n{e}")
+
+        # PBKDF2 é lento de propósito: roda no worker, resultado volta pelo Clock
+        executar_em_background(verificar_credenciais, username, password,
+                               on_sucesso=on_sucesso, on_erro=on_erro)
+
+    def _concluir_login(self, username, resultado, prefetch=None):
+        if resultado != "ok" and prefetch is not None:
+            prefetch.cancel()  # login recusado: a busca antecipada é descartada sem ser lida
+        if resultado == "nao_encontrado":
             self.show_error("Usuário não encontrado. Cadastre-se primeiro.")
             return
 
-        try:
-            ok = verify_password(password, record["salt"], record["hash"], int(record.get("iters", 200000)))
-        except Exception:
-            ok = False
-
-        if ok:
+        if resultado == "ok":
             # login OK
             app = App.get_running_app()
             app.user_id = username
-            app.sm.current = 'main'
-            try:
-                main_screen = app.sm.get_screen('main')
-                main_screen.carregar_atividades()
-            except Exception:
-                pass
+
+            def abrir_tela_principal():
+                app.sm.current = 'main'
+                try:
+                    main_screen = app.sm.get_screen('main')
+                    main_screen.carregar_atividades(prefetch)
+                except Exception:
+                    pass
+
+            # a tela principal é montada em segundo plano na inicialização
+            app.quando_pronto(abrir_tela_principal)
         else:
             self.show_error("Usuário ou senha incorretos.")
             try:
@@ -142,20 +277,27 @@ class LoginScreen(Screen):
             if pwd != conf:
                 self.show_error("Senha e confirmação não coincidem.")
                 return
-            users = load_users()
-            if user in users:
-                self.show_error("Usuário já existe. Escolha outro nome.")
+            if ok_btn.disabled:
                 return
-            # criar hash
-            rec = hash_password(pwd)
-            users[user] = rec
-            try:
-                save_users(users)
-            except Exception as e:
+
+            def criar():
+                # criar hash (lento) e gravar, fora da thread da UI
+                return user_store.criar_usuario(user, hash_password(pwd))
+
+            def on_criado(criado):
+                ok_btn.disabled = False
+                if not criado:
+                    self.show_error("Usuário já existe. Escolha outro nome.")
+                    return
+                popup.dismiss()
+                self._show_info("Conta criada com sucesso. Faça login.")
+
+            def on_falha(e):
+                ok_btn.disabled = False
                 self.show_error(f"Falha ao salvar usuário: {e}")
-                return
-            popup.dismiss()
-            self._show_info("Conta criada com sucesso. Faça login.")
+
+            ok_btn.disabled = True
+            executar_em_background(criar, on_sucesso=on_criado, on_erro=on_falha)
 
         ok_btn.bind(on_release=on_create)
         cancel_btn.bind(on_release=on_cancel)
@@ -1,17 +1,24 @@
 # main.py
+import os
 import sys
-import src.functions as fn
+from src import perfil  # primeiro import: início da medição de inicialização
+
+# as opções da linha de comando são do app (--startup-profile), não do Kivy:
+# sem isto o Kivy lê sys.argv no import e encerra com "option not recognized"
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+import src.functions as fn  # noqa: E402
 
 def main(args) -> None:
+    if "--startup-profile" in args:
+        perfil.ativar()
+    perfil.marcar("imports (kivy, kivymd, tela de login)")
     fn.adicionar_caminhos_kv()
     fn.carregar_env()
+    perfil.marcar("carregar .env")
     fn.carregar_arquivos_kv()
+    perfil.marcar("kv da tela de login")
     fn.ActivityTrackerApp().run()
     sys.exit(0)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
-
-
-
-
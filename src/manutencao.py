@@ -0,0 +1,50 @@
+# manutencao.py
+"""
+Tarefas de manutenção do banco, para rodar à mão ou agendadas (cron/Agendador
+de Tarefas).
+
+Uso:
+    python -m src.manutencao fechar-abandonadas --simular
+    python -m src.manutencao fechar-abandonadas --idade-horas 24 --duracao-horas 8
+"""
+
+import sys
+import argparse
+import src.handle_db as db
+from src.config import carregar_env
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m src.manutencao", description="Manutenção do banco de atividades.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    fechar = comandos.add_parser("fechar-abandonadas",
+                                 help="finaliza atividades esquecidas abertas (todos os usuários)")
+    fechar.add_argument("--idade-horas", type=float, default=db.DEFAULT_ABANDONO_IDADE_HORAS,
+                        help="abertas há mais que isso são finalizadas (padrão: %(default)s)")
+    fechar.add_argument("--duracao-horas", type=float, default=db.DEFAULT_ABANDONO_DURACAO_HORAS,
+                        help="duração atribuída: fim = inicio + isso (padrão: %(default)s)")
+    fechar.add_argument("--lote", type=int, default=db.DEFAULT_ABANDONO_LOTE, help="linhas por requisição")
+    fechar.add_argument("--simular", action="store_true", help="só mostra o que seria feito, sem gravar")
+    return parser.parse_args(args)
+
+def main(args) -> int:
+    opts = _parse_args(args)
+    carregar_env()
+    try:
+        stats = db.fechar_atividades_abandonadas(
+            idade_horas=opts.idade_horas, duracao_horas=opts.duracao_horas,
+            lote=opts.lote, simular=opts.simular,
+        )
+    except (RuntimeError, ValueError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    if opts.simular:
+        print(f"Simulação: {stats['encontradas']} atividade(s) abandonada(s) de {stats['usuarios']} usuário(s) "
+              f"seriam finalizadas ({stats['horas_atribuidas']:.2f}h atribuídas).")
+    else:
+        print(f"{stats['fechadas']} atividade(s) abandonada(s) de {stats['usuarios']} usuário(s) finalizada(s) "
+              f"({stats['horas_atribuidas']:.2f}h atribuídas).")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
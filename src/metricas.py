@@ -0,0 +1,289 @@
+# metricas.py
+"""
+Métricas das chamadas ao Supabase feitas pelo handle_db.
+
+Cada chamada passa por medir(operacao, user_id, func): o tempo total, o
+número de requisições HTTP (round trips), os bytes enviados/recebidos e se
+houve erro são agregados por (operação, usuário) num histograma e entregues
+aos sinks configurados:
+
+  SinkArquivo     -> uma linha JSON por chamada, arquivo com rotação
+  SinkPrometheus  -> dump periódico no formato texto do Prometheus
+
+Configuração via .env:
+  DB_METRICAS            -> sinks ativos: "arquivo", "prometheus" ou "arquivo,prometheus"
+                            (vazio = desligado; é o padrão)
+  DB_METRICAS_DIR        -> pasta dos arquivos (padrão: pasta de dados do app)
+  DB_METRICAS_MAX_MB     -> tamanho de cada arquivo JSONL antes de rotacionar
+  DB_METRICAS_INTERVALO  -> segundos entre dumps do arquivo .prom
+
+Desligado, o custo por chamada é um teste de booleano no handle_db.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import logging.handlers
+from bisect import bisect_left
+from pathlib import Path
+from src.storage import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_JSONL = "metricas_supabase.jsonl"
+ARQUIVO_PROMETHEUS = "metricas_supabase.prom"
+DEFAULT_MAX_MB = 5.0
+DEFAULT_BACKUPS = 3
+DEFAULT_INTERVALO = 60.0  # segundos
+# limites superiores (ms) dos buckets do histograma; o último bucket é +Inf
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Serie:
+    """Agregado de uma (operação, usuário)."""
+
+    __slots__ = ("chamadas", "erros", "requisicoes", "bytes_enviados", "bytes_recebidos",
+                 "soma_ms", "buckets")
+
+    def __init__(self):
+        self.chamadas = 0
+        self.erros = 0
+        self.requisicoes = 0
+        self.bytes_enviados = 0
+        self.bytes_recebidos = 0
+        self.soma_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def adicionar(self, amostra):
+        self.chamadas += 1
+        self.erros += 1 if amostra["erro"] else 0
+        self.requisicoes += amostra["requisicoes"]
+        self.bytes_enviados += amostra["bytes_enviados"]
+        self.bytes_recebidos += amostra["bytes_recebidos"]
+        self.soma_ms += amostra["ms"]
+        self.buckets[bisect_left(BUCKETS_MS, amostra["ms"])] += 1
+
+    def como_dict(self):
+        return {
+            "chamadas": self.chamadas, "erros": self.erros, "requisicoes": self.requisicoes,
+            "bytes_enviados": self.bytes_enviados, "bytes_recebidos": self.bytes_recebidos,
+            "soma_ms": round(self.soma_ms, 3),
+            "buckets": dict(zip([str(b) for b in BUCKETS_MS] + ["+Inf"], self.buckets)),
+        }
+
+class Registro:
+    """Séries por (operação, user_id), thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def adicionar(self, amostra):
+        chave = (amostra["operacao"], amostra["user_id"])
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = Serie()
+            serie.adicionar(amostra)
+
+    def instantaneo(self):
+        """Cópia das séries: {(operacao, user_id): dict}."""
+        with self._lock:
+            return {chave: serie.como_dict() for chave, serie in self._series.items()}
+
+    def limpar(self):
+        with self._lock:
+            self._series.clear()
+
+class Sink:
+    """Interface dos sinks: registrar() a cada chamada, fechar() ao desligar."""
+
+    def registrar(self, amostra, registro):
+        pass
+
+    def fechar(self, registro):
+        pass
+
+class SinkArquivo(Sink):
+    """Uma linha JSON por chamada, com rotação por tamanho (RotatingFileHandler)."""
+
+    def __init__(self, caminho, max_bytes: int = int(DEFAULT_MAX_MB * 1024 * 1024),
+                 backups: int = DEFAULT_BACKUPS):
+        self._handler = logging.handlers.RotatingFileHandler(
+            caminho, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True,
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def registrar(self, amostra, registro):
+        self._handler.emit(logging.makeLogRecord({"msg": json.dumps(amostra, ensure_ascii=False)}))
+
+    def fechar(self, registro):
+        self._handler.close()
+
+def _escapar_label(valor) -> str:
+    return str("" if valor is None else valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def texto_prometheus(instantaneo) -> str:
+    """Formata um Registro.instantaneo() no formato texto de exposição do Prometheus."""
+    linhas = [
+        "# HELP supabase_operacao_duracao_ms Duração das chamadas ao Supabase (ms).",
+        "# TYPE supabase_operacao_duracao_ms histogram",
+    ]
+    contadores = (
+        ("supabase_operacao_chamadas_total", "chamadas", "Chamadas por operação."),
+        ("supabase_operacao_erros_total", "erros", "Chamadas que terminaram em erro."),
+        ("supabase_http_requisicoes_total", "requisicoes", "Requisições HTTP (round trips)."),
+        ("supabase_bytes_enviados_total", "bytes_enviados", "Bytes de corpo enviados."),
+        ("supabase_bytes_recebidos_total", "bytes_recebidos", "Bytes de corpo recebidos."),
+    )
+    series = sorted(instantaneo.items(), key=lambda i: (i[0][0], str(i[0][1])))
+    for (operacao, user_id), s in series:
+        labels = f'operacao="{_escapar_label(operacao)}",user_id="{_escapar_label(user_id)}"'
+        acumulado = 0
+        for limite, n in s["buckets"].items():
+            acumulado += n
+            linhas.append(f'supabase_operacao_duracao_ms_bucket{{{labels},le="{limite}"}} {acumulado}')
+        linhas.append(f"supabase_operacao_duracao_ms_sum{{{labels}}} {s['soma_ms']}")
+        linhas.append(f"supabase_operacao_duracao_ms_count{{{labels}}} {s['chamadas']}")
+    for nome, campo, ajuda in contadores:
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} counter")
+        for (operacao, user_id), s in series:
+            labels = f'operacao="{_escapar_label(operacao)}",user_id="{_escapar_label(user_id)}"'
+            linhas.append(f"{nome}{{{labels}}} {s[campo]}")
+    return "\n".join(linhas) + "\n"
+
+class SinkPrometheus(Sink):
+    """Regrava o arquivo .prom (escrita atômica) no máximo a cada 'intervalo' segundos."""
+
+    def __init__(self, caminho, intervalo: float = DEFAULT_INTERVALO):
+        self.caminho = Path(caminho)
+        self.intervalo = intervalo
+        self._ultimo = 0.0
+        self._lock = threading.Lock()
+
+    def _gravar(self, registro):
+        tmp = self.caminho.with_name(self.caminho.name + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(texto_prometheus(registro.instantaneo()))
+            os.replace(tmp, self.caminho)
+        except OSError as e:
+            logger.warning("Não foi possível gravar métricas em %s: %s", self.caminho, e)
+
+    def registrar(self, amostra, registro):
+        agora = time.monotonic()
+        if agora - self._ultimo < self.intervalo:
+            return
+        with self._lock:
+            if agora - self._ultimo < self.intervalo:
+                return
+            self._ultimo = agora
+        self._gravar(registro)
+
+    def fechar(self, registro):
+        self._gravar(registro)
+
+_ativo = False
+_registro = Registro()
+_sinks = []
+_config_lock = threading.Lock()
+_local = threading.local()
+
+def ativo() -> bool:
+    return _ativo
+
+def registro() -> Registro:
+    return _registro
+
+def configurar(sinks=()):
+    """Liga a coleta com os sinks dados (lista vazia = só o Registro em memória)."""
+    global _ativo, _sinks
+    with _config_lock:
+        _sinks = list(sinks)
+        _ativo = True
+
+def adicionar_sink(sink: Sink):
+    with _config_lock:
+        _sinks.append(sink)
+
+def configurar_pelo_ambiente():
+    """Liga os sinks pedidos em DB_METRICAS (ver docstring do módulo). Retorna se ficou ativo."""
+    nomes = {n.strip().lower() for n in os.environ.get("DB_METRICAS", "").split(",") if n.strip()}
+    if not nomes:
+        return _ativo
+    pasta = Path(os.environ.get("DB_METRICAS_DIR") or get_app_data_dir())
+    try:
+        pasta.mkdir(parents=True, exist_ok=True)
+        max_mb = float(os.environ.get("DB_METRICAS_MAX_MB", DEFAULT_MAX_MB))
+        intervalo = float(os.environ.get("DB_METRICAS_INTERVALO", DEFAULT_INTERVALO))
+    except (OSError, ValueError) as e:
+        logger.warning("Configuração de métricas inválida (%s); métricas desligadas.", e)
+        return _ativo
+    sinks = []
+    if "arquivo" in nomes:
+        sinks.append(SinkArquivo(pasta / ARQUIVO_JSONL, max_bytes=int(max_mb * 1024 * 1024)))
+    if "prometheus" in nomes:
+        sinks.append(SinkPrometheus(pasta / ARQUIVO_PROMETHEUS, intervalo=intervalo))
+    desconhecidos = nomes - {"arquivo", "prometheus"}
+    if desconhecidos:
+        logger.warning("DB_METRICAS: sink(s) desconhecido(s) ignorado(s): %s", ", ".join(sorted(desconhecidos)))
+    configurar(sinks)
+    logger.info("Métricas do Supabase ativas em %s (%s).", pasta, ", ".join(sorted(nomes)))
+    return True
+
+def encerrar():
+    """Desliga a coleta e fecha os sinks (o Prometheus grava o último dump)."""
+    global _ativo, _sinks
+    with _config_lock:
+        sinks = _sinks
+        _sinks = []
+        _ativo = False
+    for sink in sinks:
+        try:
+            sink.fechar(_registro)
+        except Exception as e:
+            logger.warning("Falha ao fechar sink de métricas %r: %s", sink, e)
+
+def medir(operacao: str, user_id, func):
+    """Executa func() medindo tempo, round trips e bytes; registra e devolve o resultado."""
+    contexto = {"requisicoes": 0, "bytes_enviados": 0, "bytes_recebidos": 0}
+    anterior = getattr(_local, "contexto", None)
+    _local.contexto = contexto
+    erro = None
+    t0 = time.perf_counter()
+    try:
+        return func()
+    except Exception as e:
+        erro = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        _local.contexto = anterior
+        amostra = {
+            "ts": round(time.time(), 3), "operacao": operacao, "user_id": user_id,
+            "ms": round(ms, 3), "erro": erro, **contexto,
+        }
+        _registro.adicionar(amostra)
+        for sink in list(_sinks):
+            try:
+                sink.registrar(amostra, _registro)
+            except Exception as e:
+                logger.warning("Falha no sink de métricas %r: %s", sink, e)
+
+def _ao_enviar(request):
+    contexto = getattr(_local, "contexto", None)
+    if contexto is not None:
+        contexto["requisicoes"] += 1
+        contexto["bytes_enviados"] += len(request.content)
+
+def _ao_receber(response):
+    contexto = getattr(_local, "contexto", None)
+    if contexto is not None:
+        response.read()  # o PostgREST leria o corpo logo em seguida de qualquer forma
+        contexto["bytes_recebidos"] += len(response.content)
+
+def event_hooks():
+    """Hooks para o httpx.Client: contam requisições/bytes da chamada em medição nesta thread."""
+    return {"request": [_ao_enviar], "response": [_ao_receber]}
@@ -0,0 +1,42 @@
+# perfil.py
+"""
+Tempos da inicialização do app, por fase.
+
+As marcas são sempre registradas (custo desprezível); o relatório só é
+impresso com  python -m src.main --startup-profile.
+Este módulo deve ser o primeiro import do main.py: o relógio começa aqui.
+"""
+
+import sys
+import time
+import threading
+
+_T0 = time.perf_counter()
+_ativo = False
+_fases = []
+_lock = threading.Lock()
+
+def ativar() -> None:
+    global _ativo
+    _ativo = True
+
+def ativo() -> bool:
+    return _ativo
+
+def marcar(fase: str) -> None:
+    """Registra o fim de uma fase (tempo desde o início do processo)."""
+    with _lock:
+        _fases.append((fase, time.perf_counter(), threading.current_thread().name))
+
+def relatorio() -> str:
+    with _lock:
+        fases = list(_fases)
+    linhas = [f"{'fase':<48} {'+ms':>8} {'total ms':>9}  thread"]
+    anterior = _T0
+    for fase, t, thread in fases:
+        linhas.append(f"{fase:<48} {(t - anterior) * 1000:>8.1f} {(t - _T0) * 1000:>9.1f}  {thread}")
+        anterior = t
+    return "\n".join(linhas)
+
+def imprimir() -> None:
+    print("Perfil de inicialização:\n" + relatorio(), file=sys.stderr)
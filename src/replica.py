@@ -0,0 +1,199 @@
+# replica.py
+"""
+Réplica local (SQLite, um arquivo por usuário) do histórico de atividades.
+
+Relatórios de horas por dia/tipo são respondidos direto da réplica, sem ida
+ao Supabase. sincronizar() só traz o que mudou desde a última vez:
+  - atividades com id acima da marca d'água (maior id já sincronizado);
+  - atividades que estão abertas na réplica e já têm 'fim' no Supabase
+    (finalizadas em outro terminal, pelo serviço, pela limpeza de
+    abandonadas etc.); todas as abertas são conferidas a cada sincronização.
+As escritas feitas por este processo (journal, handle_db) chegam à réplica
+na hora, pelo ouvinte registrado em handle_db, e ficam de fora do próximo
+delta (ignorar_ids, reduzido aos ids acima do cursor a cada página). A
+primeira sincronização baixa o histórico inteiro, em páginas por id.
+
+Alterações em atividades já finalizadas e exclusões no Supabase não são
+detectadas; apague o arquivo da réplica para baixá-la de novo.
+"""
+
+import hashlib
+import sqlite3
+import logging
+import threading
+import src.handle_db as db
+from src.storage import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+REPLICA_DIRNAME = "replicas"
+DEFAULT_PAGINA = 1000
+COLUNAS_REPLICA = ("id", "chave", "tipo_atividade", "descricao", "inicio", "fim",
+                   "ano", "mes", "dia", "horas_trabalhadas")
+
+CREATE_REPLICA_SQL = """
+CREATE TABLE IF NOT EXISTS atividades (
+  id INTEGER PRIMARY KEY,
+  chave TEXT,
+  tipo_atividade TEXT NOT NULL,
+  descricao TEXT,
+  inicio TEXT NOT NULL,
+  fim TEXT,
+  ano INTEGER,
+  mes INTEGER,
+  dia INTEGER,
+  horas_trabalhadas REAL
+);
+CREATE INDEX IF NOT EXISTS idx_replica_abertas ON atividades (id) WHERE fim IS NULL;
+CREATE INDEX IF NOT EXISTS idx_replica_periodo ON atividades (ano, mes, dia, tipo_atividade);
+CREATE TABLE IF NOT EXISTS estado (
+  nome TEXT PRIMARY KEY,
+  valor INTEGER
+);
+"""
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+_sync_lock = threading.Lock()
+
+def get_replica_path(user_id):
+    """Arquivo da réplica do usuário (nome derivado do user_id, seguro para o sistema de arquivos)."""
+    nome = hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()[:32]
+    pasta = get_app_data_dir() / REPLICA_DIRNAME
+    pasta.mkdir(parents=True, exist_ok=True)
+    return pasta / f"{nome}.sqlite3"
+
+def _connect(path):
+    path = str(path)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    if path not in _initialized_paths:
+        with _init_lock:
+            if path not in _initialized_paths:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(CREATE_REPLICA_SQL)
+                _initialized_paths.add(path)
+    return conn
+
+def _gravar(conn, rows):
+    conn.executemany(
+        f"INSERT OR REPLACE INTO atividades ({', '.join(COLUNAS_REPLICA)}) "
+        f"VALUES ({', '.join(':' + c for c in COLUNAS_REPLICA)})",
+        [{c: r.get(c) for c in COLUNAS_REPLICA} for r in rows],
+    )
+
+def _marca_dagua(conn):
+    row = conn.execute("SELECT valor FROM estado WHERE nome = 'ultimo_id'").fetchone()
+    return row["valor"] if row else 0
+
+def sincronizar(user_id, pagina: int = DEFAULT_PAGINA, path=None):
+    """
+    Traz para a réplica as atividades novas e as finalizadas desde a última
+    sincronização. Retorna {"novas": n, "finalizadas": n}. Erros de rede propagam.
+    """
+    path = path or get_replica_path(user_id)
+    colunas = ", ".join(COLUNAS_REPLICA)
+    with _sync_lock:
+        conn = _connect(path)
+        try:
+            marca = _marca_dagua(conn)
+            # acima da marca, só as linhas gravadas por este processo (ouvinte de escrita)
+            conhecidas = {r["id"] for r in conn.execute("SELECT id FROM atividades WHERE id > ?", (marca,))}
+            abertas = {r["id"] for r in conn.execute("SELECT id FROM atividades WHERE fim IS NULL")}
+
+            novas = 0
+            cursor = marca
+            while True:
+                rows = db.buscar_pagina_atividades(user_id, depois_de_id=cursor, limite=pagina,
+                                                   colunas=colunas, ignorar_ids=conhecidas)
+                if rows:
+                    with conn:
+                        _gravar(conn, rows)
+                    novas += len(rows)
+                    abertas.difference_update(r["id"] for r in rows)  # acabaram de vir do Supabase
+                    cursor = rows[0]["id"]  # página em ordem decrescente
+                    # as próximas páginas só têm ids acima do cursor
+                    conhecidas = {i for i in conhecidas if i > cursor}
+                if len(rows) < pagina:
+                    break
+
+            finalizadas = db.buscar_atividades_por_id(sorted(abertas), somente_finalizadas=True, colunas=colunas) \
+                if abertas else []
+            with conn:
+                _gravar(conn, finalizadas)
+                # tudo acima da marca antiga já está na réplica: a marca vai para o maior id local
+                conn.execute(
+                    "INSERT OR REPLACE INTO estado (nome, valor) "
+                    "VALUES ('ultimo_id', (SELECT COALESCE(MAX(id), 0) FROM atividades))"
+                )
+        finally:
+            conn.close()
+    if novas or finalizadas:
+        logger.info("Réplica de %s: %d nova(s), %d finalizada(s).", user_id, novas, len(finalizadas))
+    return {"novas": novas, "finalizadas": len(finalizadas)}
+
+def existe(user_id, path=None):
+    """True se a réplica do usuário já foi sincronizada ao menos uma vez."""
+    path = path or get_replica_path(user_id)
+    if not path.exists():
+        return False
+    conn = _connect(path)
+    try:
+        return conn.execute("SELECT 1 FROM estado WHERE nome = 'ultimo_id'").fetchone() is not None
+    finally:
+        conn.close()
+
+def relatorio_horas(user_id, tipo_atividade=None, ano=None, mes=None, dia=None,
+                    agrupar_por: str = "mes", path=None):
+    """
+    Mesmo resultado de handle_db.relatorio_horas para um usuário, calculado na
+    réplica (sem rede). Só conta atividades finalizadas, como o resumo diário.
+    """
+    if agrupar_por not in db.AGRUPAMENTOS_RELATORIO:
+        raise ValueError(f"agrupar_por deve ser um de {tuple(db.AGRUPAMENTOS_RELATORIO)}")
+    periodo = db.AGRUPAMENTOS_RELATORIO[agrupar_por]
+    filtros = ["horas_trabalhadas IS NOT NULL", "ano IS NOT NULL"]
+    params = []
+    for coluna, valor in (("tipo_atividade", tipo_atividade), ("ano", ano), ("mes", mes), ("dia", dia)):
+        if valor is not None:
+            filtros.append(f"{coluna} = ?")
+            params.append(valor)
+    grupo = ", ".join(periodo + ("tipo_atividade",))
+
+    conn = _connect(path or get_replica_path(user_id))
+    try:
+        rows = conn.execute(
+            f"SELECT {grupo}, SUM(horas_trabalhadas) AS horas, COUNT(*) AS quantidade "
+            f"FROM atividades WHERE {' AND '.join(filtros)} GROUP BY {grupo} ORDER BY {grupo}",
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    resultado = []
+    for row in rows:
+        item = {"user_id": user_id, "tipo_atividade": row["tipo_atividade"]}
+        item.update((c, row[c]) for c in periodo)
+        item["horas_trabalhadas"] = round(row["horas"], 10)
+        item["quantidade"] = row["quantidade"]
+        resultado.append(item)
+    return resultado
+
+def _ao_escrever(rows):
+    """Ouvinte de handle_db: aplica as escritas deste processo às réplicas já existentes."""
+    por_usuario = {}
+    for row in rows:
+        if row.get("id") is not None and row.get("user_id") is not None:
+            por_usuario.setdefault(row["user_id"], []).append(row)
+    for user_id, linhas in por_usuario.items():
+        path = get_replica_path(user_id)
+        if not path.exists():
+            continue  # usuário sem réplica: a primeira sincronização traz tudo
+        conn = _connect(path)
+        try:
+            with conn:
+                _gravar(conn, linhas)
+        finally:
+            conn.close()
+
+db.registrar_ouvinte_escrita(_ao_escrever)
@@ -0,0 +1,272 @@
+# resiliencia.py
+"""
+Timeouts por operação, novas tentativas com backoff e circuit breaker para
+as chamadas ao Supabase (usado por handle_db._executar e, em asyncio, por src/servico.py).
+
+- Timeout: cada operação tem um limite próprio (TIMEOUTS_PADRAO, ajustável por
+  SUPABASE_TIMEOUTS="listar_atividades=5,buscar_pagina_atividades=30"); as demais
+  usam SUPABASE_TIMEOUT. O valor é aplicado à requisição HTTP por um event
+  hook do httpx, então uma resposta lenta nunca depende do timeout do TCP.
+- Novas tentativas: só para falhas transitórias (rede, 408/429/502/503/504,
+  PGRST000-003, deadlock...). Operações idempotentes (leituras, upsert por
+  chave, RPC de troca com chave) repetem em qualquer falha transitória; as
+  demais só quando a requisição nem chegou a sair (falha ao conectar).
+  Espera entre tentativas: backoff exponencial com jitter completo.
+- Circuit breaker: após SUPABASE_CIRCUITO_FALHAS falhas transitórias seguidas,
+  as chamadas falham na hora com CircuitoAberto durante SUPABASE_CIRCUITO_PAUSA
+  segundos; depois disso uma chamada de teste decide se o circuito fecha.
+"""
+
+import os
+import time
+import asyncio
+import random
+import logging
+import threading
+import httpx
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENTATIVAS = 3
+DEFAULT_BACKOFF_BASE = 0.2   # segundos
+DEFAULT_BACKOFF_MAX = 2.0    # segundos
+DEFAULT_CIRCUITO_FALHAS = 5
+DEFAULT_CIRCUITO_PAUSA = 30.0  # segundos
+
+# segundos; operações fora da lista usam SUPABASE_TIMEOUT
+TIMEOUTS_PADRAO = {
+    "aquecer_conexao": 3.0,
+    "verificar_schema": 5.0,
+    "buscar_versao_catalogo": 3.0,
+    "buscar_atividade_em_andamento": 5.0,
+    "listar_atividades": 8.0,
+    "relatorio_horas": 15.0,
+    "buscar_pagina_atividades": 30.0,
+    "sincronizar_atividades": 20.0,
+}
+
+STATUS_TRANSITORIOS = {408, 429, 502, 503, 504}
+# PostgREST sem conexão com o banco / erros do Postgres que passam ao repetir
+CODIGOS_TRANSITORIOS = {"PGRST000", "PGRST001", "PGRST002", "PGRST003",
+                        "40001", "40P01", "53300", "57P01", "57P03"}
+
+class CircuitoAberto(RuntimeError):
+    """O Supabase falhou repetidamente; a chamada nem foi tentada."""
+
+def _env_float(nome, padrao):
+    try:
+        return float(os.environ.get(nome, padrao))
+    except (TypeError, ValueError):
+        logger.warning("Valor inválido para %s; usando %s.", nome, padrao)
+        return padrao
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.environ.get(nome, padrao))
+    except (TypeError, ValueError):
+        logger.warning("Valor inválido para %s; usando %s.", nome, padrao)
+        return padrao
+
+def _timeouts_do_ambiente():
+    timeouts = dict(TIMEOUTS_PADRAO)
+    for item in os.environ.get("SUPABASE_TIMEOUTS", "").split(","):
+        nome, _, valor = item.partition("=")
+        if not nome.strip():
+            continue
+        try:
+            timeouts[nome.strip()] = float(valor)
+        except ValueError:
+            logger.warning("SUPABASE_TIMEOUTS: valor inválido para '%s'.", nome.strip())
+    return timeouts
+
+def timeout_da_operacao(operacao: str) -> float:
+    """Timeout (s) de 'operacao'; 'finalizar_atividade.rpc' cai em 'finalizar_atividade'."""
+    timeouts = _timeouts_do_ambiente()
+    if operacao in timeouts:
+        return timeouts[operacao]
+    base = operacao.split(".", 1)[0]
+    if base in timeouts:
+        return timeouts[base]
+    return _env_float("SUPABASE_TIMEOUT", 10.0)
+
+def erro_antes_do_envio(exc) -> bool:
+    """A requisição não saiu do cliente: repetir é seguro para qualquer operação."""
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+def erro_transitorio(exc) -> bool:
+    if isinstance(exc, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc, APIError):
+        codigo = exc.code
+        if isinstance(codigo, int):
+            return codigo in STATUS_TRANSITORIOS
+        return codigo in CODIGOS_TRANSITORIOS
+    return False
+
+def espera_backoff(tentativa: int, base: float = DEFAULT_BACKOFF_BASE, maximo: float = DEFAULT_BACKOFF_MAX) -> float:
+    """Backoff exponencial com jitter completo: uniforme em [0, min(maximo, base * 2^tentativa)]."""
+    return random.uniform(0, min(maximo, base * (2 ** tentativa)))
+
+class Disjuntor:
+    """Circuit breaker simples: fechado -> aberto (após N falhas) -> meio-aberto (1 teste)."""
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio-aberto"
+
+    def __init__(self, limite_falhas: int = DEFAULT_CIRCUITO_FALHAS, pausa: float = DEFAULT_CIRCUITO_PAUSA):
+        self.limite_falhas = max(1, limite_falhas)
+        self.pausa = pausa
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._estado = self.FECHADO
+        self._aberto_ate = 0.0
+        self._teste_em_andamento = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado
+
+    def permitir(self):
+        """Levanta CircuitoAberto se a chamada não deve ser tentada agora."""
+        with self._lock:
+            if self._estado == self.FECHADO:
+                return
+            agora = time.monotonic()
+            if self._estado == self.ABERTO and agora >= self._aberto_ate:
+                self._estado = self.MEIO_ABERTO
+                self._teste_em_andamento = False
+            if self._estado == self.MEIO_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return
+            restante = max(0.0, self._aberto_ate - agora)
+        raise CircuitoAberto(f"Supabase indisponível; nova tentativa em {restante:.0f}s.")
+
+    def sucesso(self):
+        with self._lock:
+            if self._estado != self.FECHADO:
+                logger.info("Circuito do Supabase fechado.")
+            self._falhas = 0
+            self._estado = self.FECHADO
+            self._teste_em_andamento = False
+
+    def falha(self):
+        with self._lock:
+            self._falhas += 1
+            if self._estado == self.MEIO_ABERTO or self._falhas >= self.limite_falhas:
+                if self._estado != self.ABERTO:
+                    logger.warning("Circuito do Supabase aberto por %.0fs após %d falha(s).",
+                                   self.pausa, self._falhas)
+                self._estado = self.ABERTO
+                self._aberto_ate = time.monotonic() + self.pausa
+                self._teste_em_andamento = False
+
+_disjuntor = None
+_disjuntor_lock = threading.Lock()
+_local = threading.local()
+
+def get_disjuntor() -> Disjuntor:
+    global _disjuntor
+    with _disjuntor_lock:
+        if _disjuntor is None:
+            _disjuntor = Disjuntor(
+                _env_int("SUPABASE_CIRCUITO_FALHAS", DEFAULT_CIRCUITO_FALHAS),
+                _env_float("SUPABASE_CIRCUITO_PAUSA", DEFAULT_CIRCUITO_PAUSA),
+            )
+        return _disjuntor
+
+def resetar_disjuntor():
+    """Descarta o estado do circuito (ex.: client recriado com outra URL)."""
+    global _disjuntor
+    with _disjuntor_lock:
+        _disjuntor = None
+
+def _politica():
+    """(tentativas, base, maximo) do backoff, lidos do .env."""
+    return (
+        max(1, _env_int("SUPABASE_RETRY_TENTATIVAS", DEFAULT_TENTATIVAS)),
+        _env_float("SUPABASE_RETRY_BASE", DEFAULT_BACKOFF_BASE),
+        _env_float("SUPABASE_RETRY_MAX", DEFAULT_BACKOFF_MAX),
+    )
+
+def _espera_apos_falha(e, disjuntor, operacao, idempotente, tentativa, politica):
+    """
+    Registra a falha número 'tentativa' no disjuntor e devolve quantos segundos
+    esperar antes de repetir, ou None se a exceção deve propagar.
+    """
+    if not erro_transitorio(e):
+        disjuntor.sucesso()  # o backend respondeu
+        return None
+    disjuntor.falha()
+    tentativas, base, maximo = politica
+    if not (idempotente or erro_antes_do_envio(e)) or tentativa >= tentativas:
+        return None
+    espera = espera_backoff(tentativa - 1, base, maximo)
+    logger.warning("%s: falha transitória (%s); tentativa %d/%d em %.2fs.",
+                   operacao, e or type(e).__name__, tentativa + 1, tentativas, espera)
+    return espera
+
+def executar(func, operacao: str, idempotente: bool = False):
+    """
+    Chama func() com o timeout de 'operacao', repetindo falhas transitórias
+    conforme a política do módulo. Erros não transitórios (ex.: coluna
+    inexistente, chave duplicada) propagam na primeira vez.
+    """
+    disjuntor = get_disjuntor()
+    politica = _politica()
+    timeout = timeout_da_operacao(operacao)
+
+    tentativa = 0
+    while True:
+        disjuntor.permitir()
+        anterior = getattr(_local, "timeout", None)
+        _local.timeout = timeout
+        try:
+            resultado = func()
+        except Exception as e:
+            tentativa += 1
+            espera = _espera_apos_falha(e, disjuntor, operacao, idempotente, tentativa, politica)
+            if espera is None:
+                raise
+            time.sleep(espera)
+        else:
+            disjuntor.sucesso()
+            return resultado
+        finally:
+            _local.timeout = anterior
+
+async def executar_async(fabrica, operacao: str, idempotente: bool = False):
+    """
+    Versão asyncio de executar(): 'fabrica()' devolve a corrotina da chamada
+    (uma nova a cada tentativa). O timeout da operação é aplicado com
+    asyncio.wait_for.
+    """
+    disjuntor = get_disjuntor()
+    politica = _politica()
+    timeout = timeout_da_operacao(operacao)
+
+    tentativa = 0
+    while True:
+        disjuntor.permitir()
+        try:
+            resultado = await asyncio.wait_for(fabrica(), timeout)
+        except Exception as e:
+            tentativa += 1
+            espera = _espera_apos_falha(e, disjuntor, operacao, idempotente, tentativa, politica)
+            if espera is None:
+                raise
+            await asyncio.sleep(espera)
+        else:
+            disjuntor.sucesso()
+            return resultado
+
+def _aplicar_timeout(request):
+    timeout = getattr(_local, "timeout", None)
+    if timeout is not None:
+        request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+
+def event_hooks():
+    """Hook do httpx.Client que aplica o timeout da operação em andamento nesta thread."""
+    return {"request": [_aplicar_timeout], "response": []}
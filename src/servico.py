@@ -0,0 +1,341 @@
+# servico.py
+"""
+Serviço HTTP local (sem Kivy) para terminais do chão de fábrica.
+
+Um único processo asyncio atende vários terminais com as mesmas regras do
+handle_db (payload de início, chave de idempotência, finalização pela função
+SQL ou pelo UPDATE com horas calculadas no cliente). Todas as chamadas usam
+um único AsyncClient do Supabase sobre um pool httpx compartilhado, com os
+timeouts/novas tentativas/circuit breaker de src/resiliencia.py. Consultas
+simultâneas da atividade em andamento do mesmo usuário viram uma só
+requisição ao Supabase.
+
+API (JSON):
+  GET  /atividades/em-andamento?user_id=joao   -> {"atividade": {...} | null}
+  POST /atividades/iniciar    {"user_id", "tipo_atividade", "descricao"?, "chave"?}
+                                              -> 201 {"atividade": {...}}
+  POST /atividades/finalizar  {"id", "inicio"?} -> {"ok": true}
+  GET  /saude                                   -> {"status": "ok", "circuito": "fechado"}
+
+Com SERVICO_TOKEN definido, toda requisição precisa de
+"Authorization: Bearer <token>".
+
+Uso:
+    python -m src.servico --host 0.0.0.0 --porta 8765
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+import httpx
+from supabase import create_async_client, AsyncClientOptions
+from postgrest.exceptions import APIError
+import src.handle_db as db
+from src import resiliencia
+from src.config import carregar_env
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORTA = 8765
+DEFAULT_POOL_SIZE = 20
+MAX_CORPO = 64 * 1024  # bytes
+TEMPO_OCIOSO = 60.0    # segundos até fechar uma conexão keep-alive parada
+
+class ErroRequisicao(Exception):
+    def __init__(self, status: int, mensagem: str):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+class Coalescedor:
+    """Chamadas simultâneas com a mesma chave aguardam uma única tarefa."""
+
+    def __init__(self):
+        self._em_voo = {}
+
+    async def obter(self, chave, fabrica):
+        tarefa = self._em_voo.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.ensure_future(fabrica())
+            self._em_voo[chave] = tarefa
+            tarefa.add_done_callback(lambda t: self._concluir(chave, t))
+        # shield: um terminal que desiste não cancela a consulta dos outros
+        return await asyncio.shield(tarefa)
+
+    def _concluir(self, chave, tarefa):
+        if self._em_voo.get(chave) is tarefa:
+            del self._em_voo[chave]
+        if not tarefa.cancelled():
+            tarefa.exception()  # evita o aviso de exceção não lida
+
+    def descartar(self, chave):
+        """Após uma escrita: as próximas leituras não reaproveitam a consulta em andamento."""
+        self._em_voo.pop(chave, None)
+
+class ServicoAtividades:
+    """Operações assíncronas com a mesma semântica das funções do handle_db."""
+
+    def __init__(self, client):
+        self.client = client
+        self._leituras = Coalescedor()
+        self._rpc_finalizar_disponivel = True
+
+    @classmethod
+    async def criar(cls, pool_size: int = None):
+        url = os.environ.get("SUPABASE_URL")
+        key = os.environ.get("SUPABASE_KEY")
+        if not url or not key:
+            raise RuntimeError("SUPABASE_URL e SUPABASE_KEY devem estar definidas como variáveis de ambiente.")
+        pool_size = pool_size or max(1, db._env_int("SERVICO_POOL_SIZE", DEFAULT_POOL_SIZE))
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(db._env_float("SUPABASE_TIMEOUT", db.DEFAULT_TIMEOUT)),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            follow_redirects=True,
+        )
+        client = await create_async_client(url, key, options=AsyncClientOptions(httpx_client=http_client))
+        servico = cls(client)
+        servico._http_client = http_client
+        return servico
+
+    async def fechar(self):
+        http_client = getattr(self, "_http_client", None)
+        if http_client is not None:
+            await http_client.aclose()
+
+    async def _executar(self, fabrica, operacao, idempotente=False):
+        try:
+            return await resiliencia.executar_async(lambda: fabrica().execute(), operacao, idempotente)
+        except APIError as e:
+            if e.code in db.CODIGOS_SCHEMA_DESATUALIZADO:
+                db.invalidar_cache_schema()
+            raise
+
+    async def buscar_em_andamento(self, user_id):
+        async def consultar():
+            resp = await self._executar(
+                lambda: self.client.table(db.TABLE_NAME).select(db.COLUNAS_EM_ANDAMENTO).is_("fim", None)
+                .eq("user_id", user_id).order("id", desc=True).limit(1),
+                "buscar_atividade_em_andamento", idempotente=True,
+            )
+            return resp.data[0] if resp.data else None
+        return await self._leituras.obter(user_id, consultar)
+
+    async def iniciar(self, tipo, descricao, user_id, chave=None):
+        payload = db.montar_payload_inicio(tipo, descricao, user_id, datetime.now(db.TIMEZONE),
+                                           chave or db.gerar_chave())
+        resp = await self._executar(
+            lambda: self.client.table(db.TABLE_NAME).insert(payload), "iniciar_nova_atividade",
+        )
+        self._leituras.descartar(user_id)
+        return resp.data[0] if resp.data else payload
+
+    async def finalizar(self, activity_id, inicio=None):
+        """Mesmo fluxo de handle_db.finalizar_atividade; retorna a linha finalizada."""
+        if inicio is None and self._rpc_finalizar_disponivel:
+            try:
+                resp = await self._executar(
+                    lambda: self.client.rpc(db.RPC_FINALIZAR, {"p_id": activity_id}), "finalizar_atividade.rpc",
+                )
+            except APIError as e:
+                if e.code not in db.RPC_INEXISTENTE_CODES:
+                    raise
+                logger.warning("Função '%s' não encontrada no Supabase; usando SELECT + UPDATE.", db.RPC_FINALIZAR)
+                self._rpc_finalizar_disponivel = False
+            else:
+                return self._finalizada(resp.data)
+
+        if inicio is None:
+            atividade = await self._executar(
+                lambda: self.client.table(db.TABLE_NAME).select("inicio").eq("id", activity_id),
+                "finalizar_atividade.buscar_inicio", idempotente=True,
+            )
+            if not atividade.data:
+                raise ErroRequisicao(404, "Atividade não encontrada.")
+            inicio = atividade.data[0]["inicio"]
+        if isinstance(inicio, str):
+            inicio = db.parse_datetime(inicio)
+        fim = datetime.now(db.TIMEZONE)
+        dados = {"fim": fim.isoformat(), "horas_trabalhadas": db.calcular_horas_trabalhadas(inicio, fim)}
+        resp = await self._executar(
+            lambda: self.client.table(db.TABLE_NAME).update(dados).eq("id", activity_id).is_("fim", None),
+            "finalizar_atividade.update", idempotente=True,
+        )
+        if not resp.data:
+            # nada aberto com esse id: já finalizada (chamada repetida) ou inexistente
+            resp = await self._executar(
+                lambda: self.client.table(db.TABLE_NAME).select("id, user_id").eq("id", activity_id),
+                "finalizar_atividade.buscar_inicio", idempotente=True,
+            )
+        return self._finalizada(resp.data)
+
+    def _finalizada(self, rows):
+        if not rows:
+            raise ErroRequisicao(404, "Atividade não encontrada.")
+        self._leituras.descartar(rows[0].get("user_id"))
+        return rows[0]
+
+class ServidorHTTP:
+    """HTTP/1.1 mínimo (keep-alive, corpo JSON) sobre asyncio streams."""
+
+    def __init__(self, servico: ServicoAtividades, token: str = None):
+        self.servico = servico
+        self.token = token
+
+    async def tratar_conexao(self, reader, writer):
+        try:
+            while True:
+                try:
+                    linha = await asyncio.wait_for(reader.readline(), TEMPO_OCIOSO)
+                except asyncio.TimeoutError:
+                    break
+                if not linha:
+                    break
+                metodo, alvo, versao = linha.decode("latin-1").split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    nome, _, valor = h.decode("latin-1").partition(":")
+                    headers[nome.strip().lower()] = valor.strip()
+                tamanho = int(headers.get("content-length") or 0)
+                if tamanho > MAX_CORPO:
+                    await self._responder(writer, 413, {"erro": "corpo muito grande"}, False)
+                    break
+                corpo = await reader.readexactly(tamanho) if tamanho else b""
+                manter = versao == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, resposta = await self._processar(metodo, alvo, headers, corpo)
+                await self._responder(writer, status, resposta, manter)
+                if not manter:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _responder(self, writer, status, corpo, manter):
+        dados = json.dumps(corpo, ensure_ascii=False, default=str).encode("utf-8")
+        cabecalho = (
+            f"HTTP/1.1 {status} {_MOTIVOS.get(status, 'OK')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(dados)}\r\n"
+            f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n"
+        )
+        writer.write(cabecalho.encode("latin-1") + dados)
+        await writer.drain()
+
+    async def _processar(self, metodo, alvo, headers, corpo):
+        if self.token and headers.get("authorization") != f"Bearer {self.token}":
+            return 401, {"erro": "não autorizado"}
+        partes = urlsplit(alvo)
+        try:
+            dados = json.loads(corpo) if corpo else {}
+        except ValueError as e:
+            return 400, {"erro": f"JSON inválido: {e}"}
+        try:
+            if not isinstance(dados, dict):
+                raise ErroRequisicao(400, "corpo deve ser um objeto JSON")
+            rota = (metodo, partes.path.rstrip("/"))
+            if rota == ("GET", "/saude"):
+                return 200, {"status": "ok", "circuito": resiliencia.get_disjuntor().estado}
+            if rota == ("GET", "/atividades/em-andamento"):
+                user_id = _obrigatorio(parse_qs(partes.query).get("user_id", [None])[0], "user_id")
+                return 200, {"atividade": await self.servico.buscar_em_andamento(user_id)}
+            if rota == ("POST", "/atividades/iniciar"):
+                atividade = await self.servico.iniciar(
+                    _obrigatorio(dados.get("tipo_atividade"), "tipo_atividade"),
+                    _opcional(dados.get("descricao"), "descricao") or "",
+                    _obrigatorio(dados.get("user_id"), "user_id"), _opcional(dados.get("chave"), "chave"),
+                )
+                return 201, {"atividade": atividade}
+            if rota == ("POST", "/atividades/finalizar"):
+                activity_id = _obrigatorio(dados.get("id"), "id", int)
+                await self.servico.finalizar(activity_id, _data_hora(dados.get("inicio"), "inicio"))
+                return 200, {"ok": True}
+            return 404, {"erro": "rota não encontrada"}
+        except ErroRequisicao as e:
+            return e.status, {"erro": e.mensagem}
+        except resiliencia.CircuitoAberto as e:
+            return 503, {"erro": str(e)}
+        except APIError as e:
+            if e.code == "23505":
+                return 409, {"erro": "chave já utilizada"}
+            logger.error("Erro do Supabase em %s %s: %s", metodo, partes.path, e)
+            return 502, {"erro": f"Supabase: {e.message}"}
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            logger.error("Supabase inacessível em %s %s: %r", metodo, partes.path, e)
+            return 504, {"erro": "Supabase não respondeu"}
+        except Exception:
+            # nunca derrubar a conexão sem resposta
+            logger.exception("Erro inesperado em %s %s", metodo, partes.path)
+            return 500, {"erro": "erro interno"}
+
+_MOTIVOS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+            409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable",
+            504: "Gateway Timeout"}
+
+def _opcional(valor, campo, tipo=str):
+    if valor is None:
+        return None
+    # bool é subclasse de int, mas true/false nunca é um id
+    if not isinstance(valor, tipo) or (tipo is int and isinstance(valor, bool)):
+        nome = "número inteiro" if tipo is int else "texto"
+        raise ErroRequisicao(400, f"campo inválido: {campo} (deve ser {nome})")
+    return valor
+
+def _obrigatorio(valor, campo, tipo=str):
+    if valor in (None, ""):
+        raise ErroRequisicao(400, f"campo obrigatório: {campo}")
+    return _opcional(valor, campo, tipo)
+
+def _data_hora(valor, campo):
+    """Texto ISO 8601 opcional -> datetime em TIMEZONE."""
+    valor = _opcional(valor, campo)
+    if valor is None:
+        return None
+    try:
+        return db.parse_datetime(valor)
+    except ValueError:
+        raise ErroRequisicao(400, f"campo inválido: {campo} (data/hora ISO 8601)") from None
+
+async def servir(host: str = DEFAULT_HOST, porta: int = DEFAULT_PORTA, pronto=None):
+    """
+    Sobe o serviço e atende até ser cancelado. pronto(server), se dado, é
+    chamado com o asyncio.Server já escutando (útil em testes com porta 0).
+    """
+    servico = await ServicoAtividades.criar()
+    http = ServidorHTTP(servico, token=os.environ.get("SERVICO_TOKEN") or None)
+    server = await asyncio.start_server(http.tratar_conexao, host, porta)
+    try:
+        enderecos = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+        logger.info("Serviço de atividades escutando em %s.", enderecos)
+        if pronto is not None:
+            pronto(server)
+        async with server:
+            await server.serve_forever()
+    finally:
+        await servico.fechar()
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m src.servico",
+                                     description="Serviço HTTP de atividades para terminais sem interface.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="use 0.0.0.0 para aceitar outros terminais")
+    parser.add_argument("--porta", type=int, default=DEFAULT_PORTA)
+    return parser.parse_args(args)
+
+def main(args) -> None:
+    opts = _parse_args(args)
+    carregar_env()
+    try:
+        asyncio.run(servir(opts.host, opts.porta))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,28 @@
+# storage.py
+"""
+Local padrão dos arquivos persistentes do app (credenciais, journal, caches).
+Mantido sem dependências do Kivy/Supabase para poder ser usado em qualquer módulo.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+APP_DIR_NAME = "RegistroAtividades"
+
+def get_app_data_dir() -> Path:
+    """
+    Retorna (criando se necessário) a pasta de dados do app:
+      Windows: %APPDATA%/RegistroAtividades
+      Mac: ~/Library/Application Support/RegistroAtividades
+      Linux: ~/.local/share/RegistroAtividades
+    """
+    if sys.platform.startswith("win"):
+        base = os.getenv("APPDATA") or Path.home()
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Application Support"
+    else:
+        base = Path.home() / ".local" / "share"
+    folder = Path(base) / APP_DIR_NAME
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
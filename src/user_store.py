@@ -0,0 +1,150 @@
+# user_store.py
+"""
+Armazenamento local das credenciais (salt + hash) em SQLite.
+
+Substitui o users.json: cada login busca só o usuário digitado, cada conta
+nova é um INSERT atômico e o SQLite faz o lock entre processos (dois
+terminais/instâncias abertos ao mesmo tempo não corrompem o arquivo).
+Um users.json existente é importado automaticamente na primeira abertura.
+"""
+
+import json
+import sqlite3
+import logging
+import threading
+from src.storage import get_app_data_dir
+
+logger = logging.getLogger(__name__)
+
+USER_DB_FILENAME = "users.sqlite3"
+LEGACY_JSON_FILENAME = "users.json"
+
+CREATE_USERS_SQL = """
+CREATE TABLE IF NOT EXISTS usuarios (
+  username TEXT PRIMARY KEY,
+  salt TEXT NOT NULL,
+  hash TEXT NOT NULL,
+  iters INTEGER NOT NULL
+);
+"""
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+
+def get_user_db_path():
+    return get_app_data_dir() / USER_DB_FILENAME
+
+def _migrar_json(conn, json_path):
+    """Importa o users.json antigo (se existir) e o renomeia para não importar de novo."""
+    if not json_path.exists():
+        return
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            users = json.load(f)
+    except Exception as e:
+        logger.warning("Não foi possível ler %s para migração: %s", json_path, e)
+        return
+    conn.executemany(
+        "INSERT OR IGNORE INTO usuarios (username, salt, hash, iters) VALUES (?, ?, ?, ?)",
+        [(u, r["salt"], r["hash"], int(r.get("iters", 200000))) for u, r in users.items()],
+    )
+    conn.commit()
+    try:
+        json_path.replace(json_path.with_name(json_path.name + ".migrado"))
+    except OSError as e:
+        logger.warning("Usuários migrados, mas não foi possível renomear %s: %s", json_path, e)
+    logger.info("%d usuário(s) migrado(s) de %s.", len(users), json_path)
+
+def _connect(path=None):
+    path = path or get_user_db_path()
+    key = str(path)
+    conn = sqlite3.connect(key, timeout=10)
+    conn.row_factory = sqlite3.Row
+    if key not in _initialized_paths:
+        with _init_lock:
+            if key not in _initialized_paths:
+                conn.execute("PRAGMA journal_mode=WAL")
+                # BEGIN IMMEDIATE: só um processo cria/migra por vez
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(CREATE_USERS_SQL)
+                _migrar_json(conn, path.parent / LEGACY_JSON_FILENAME)
+                conn.commit()
+                _initialized_paths.add(key)
+    return conn
+
+def _to_record(row):
+    return {"salt": row["salt"], "hash": row["hash"], "iters": row["iters"]}
+
+def buscar_usuario(username, path=None):
+    """Registro {salt, hash, iters} do usuário, ou None."""
+    conn = _connect(path)
+    try:
+        row = conn.execute(
+            "SELECT salt, hash, iters FROM usuarios WHERE username = ?", (username,)
+        ).fetchone()
+        return _to_record(row) if row else None
+    finally:
+        conn.close()
+
+def criar_usuario(username, record, path=None):
+    """Insere o usuário; retorna False se o nome já existir."""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO usuarios (username, salt, hash, iters) VALUES (?, ?, ?, ?)",
+                (username, record["salt"], record["hash"], int(record["iters"])),
+            )
+        return True
+    except sqlite3.IntegrityError:
+        return False
+    finally:
+        conn.close()
+
+def atualizar_usuario(username, record, path=None, iters_anteriores=None):
+    """
+    Troca salt/hash/iters do usuário. Com iters_anteriores, só grava se o
+    registro ainda tem esse custo (outro login pode já ter refeito o hash).
+    Retorna True se gravou.
+    """
+    sql = "UPDATE usuarios SET salt = ?, hash = ?, iters = ? WHERE username = ?"
+    params = [record["salt"], record["hash"], int(record["iters"]), username]
+    if iters_anteriores is not None:
+        sql += " AND iters = ?"
+        params.append(int(iters_anteriores))
+    conn = _connect(path)
+    try:
+        with conn:
+            return conn.execute(sql, params).rowcount > 0
+    finally:
+        conn.close()
+
+def carregar_todos(path=None):
+    """Todos os usuários como {username: {salt, hash, iters}} (formato do antigo users.json)."""
+    conn = _connect(path)
+    try:
+        return {row["username"]: _to_record(row) for row in conn.execute(
+            "SELECT username, salt, hash, iters FROM usuarios"
+        )}
+    finally:
+        conn.close()
+
+def salvar_todos(users: dict, path=None):
+    """Substitui o conteúdo do store por 'users' numa única transação."""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO usuarios (username, salt, hash, iters) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET salt = excluded.salt, "
+                "hash = excluded.hash, iters = excluded.iters",
+                [(u, r["salt"], r["hash"], int(r.get("iters", 200000))) for u, r in users.items()],
+            )
+            existentes = [r[0] for r in conn.execute("SELECT username FROM usuarios")]
+            conn.executemany(
+                "DELETE FROM usuarios WHERE username = ?",
+                [(u,) for u in existentes if u not in users],
+            )
+    finally:
+        conn.close()
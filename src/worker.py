@@ -0,0 +1,94 @@
+# worker.py
+"""
+Execução de tarefas (principalmente chamadas ao Supabase) fora da thread
+principal do Kivy.
+
+As funções rodam num pool de threads; o resultado (ou a exceção) volta para
+a UI através de kivy.clock.Clock, então os callbacks podem mexer em widgets
+com segurança. Leituras independentes podem rodar ao mesmo tempo.
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from kivy.clock import Clock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
+class BackgroundWorker:
+    def __init__(self, max_workers: int = None):
+        if max_workers is None:
+            try:
+                max_workers = int(os.environ.get("DB_WORKERS", DEFAULT_MAX_WORKERS))
+            except ValueError:
+                max_workers = DEFAULT_MAX_WORKERS
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="db-worker"
+                )
+            return self._executor
+
+    def submit(self, func, *args, on_sucesso=None, on_erro=None, **kwargs):
+        """
+        Agenda func(*args, **kwargs) no pool.
+        on_sucesso(resultado) / on_erro(exc) são chamados na thread do Kivy.
+        Retorna o Future da tarefa.
+        """
+        future = self._get_executor().submit(func, *args, **kwargs)
+
+        def _done(fut):
+            if fut.cancelled():
+                return
+            exc = fut.exception()
+            if exc is not None:
+                if on_erro is not None:
+                    Clock.schedule_once(lambda dt: on_erro(exc))
+                else:
+                    logger.error("Tarefa em background falhou: %s", exc)
+                return
+            if on_sucesso is not None:
+                resultado = fut.result()
+                Clock.schedule_once(lambda dt: on_sucesso(resultado))
+
+        future.add_done_callback(_done)
+        return future
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def get_worker() -> BackgroundWorker:
+    """Retorna o worker compartilhado pelo app (criado sob demanda)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = BackgroundWorker()
+        return _worker
+
+def executar_em_background(func, *args, on_sucesso=None, on_erro=None, **kwargs):
+    """Atalho para get_worker().submit(...)."""
+    return get_worker().submit(func, *args, on_sucesso=on_sucesso, on_erro=on_erro, **kwargs)
+
+def encerrar_worker(wait: bool = False):
+    """Encerra o pool (chamado ao fechar o app)."""
+    global _worker
+    with _worker_lock:
+        worker = _worker
+        _worker = None
+    if worker is not None:
+        worker.shutdown(wait=wait)